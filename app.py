@@ -1,14 +1,28 @@
 import io
 import re
 import os, time, threading
+import hashlib
+import functools
+import contextlib
+import json
+import uuid
+import secrets
+import codecs
+from array import array
+import gzip
+import heapq
+import sqlite3
+import sys
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib import cbook
 from flask import Flask, render_template, request, jsonify
 from scipy.stats import zscore
-from flask import flash, redirect, url_for
+from flask import flash, redirect, url_for, session
+from flask.sessions import SecureCookieSessionInterface
 ##import dropbox
 from flask import Flask, send_from_directory
 import glob
@@ -17,6 +31,22 @@ import urllib.parse
 from flask import send_file
 import socket
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import brotli  # ไม่บังคับ — ถ้ามีจะใช้บีบอัดแบบ br ได้
+except ImportError:
+    brotli = None
+try:
+    import fcntl  # POSIX — ล็อกไฟล์ข้าม process (Windows ใช้ msvcrt)
+except ImportError:
+    fcntl = None
+    import msvcrt
+try:
+    from watchdog.observers import Observer  # ไม่บังคับ — ถ้ามีจะรับ event จาก inotify แทนการ poll
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
 
 # === ตั้งค่า ===
 ##DROPBOX_ACCESS_TOKEN = "<YOUR_ACCESS_TOKEN>"  # <-- ไม่ใช้แล้ว
@@ -26,113 +56,486 @@ FRAMESTOCK_FOLDER = 'uploads'
 PACKTYPE_FOLDER = 'packtype'
 PACKAGECODE_FOLFER = 'package code'
 PACKAGEANDFRAMSTOCK = 'package and frame stock'
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DATA_FOLDER, exist_ok=True)
-os.makedirs(FRAMESTOCK_FOLDER, exist_ok=True)
-os.makedirs(PACKAGECODE_FOLFER, exist_ok=True)
+NOBUMP_FOLDER = 'temp'
+CACHE_FOLDER = 'cache'
+DATASET_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'datasets')
+FILE_INDEX_PATH = os.path.join(CACHE_FOLDER, 'file_index.json')
+FACET_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'facets')
+FACET_COLUMNS = ['bom_no', 'operation', 'optn_code']
+DATASET_CACHE_MAX_ENTRIES = 32  # จำนวน DataFrame ที่เก็บไว้ในหน่วยความจำ
+EXPORT_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'exports')
+BOX_STATS_FOLDER = os.path.join(CACHE_FOLDER, 'box_stats')
+ARTIFACT_MAX_MB = int(os.environ.get('ARTIFACT_MAX_MB', 1024))  # ขนาดรวมสูงสุดของไฟล์ export ที่เก็บไว้
+ARTIFACT_TTL_SECONDS = 24 * 3600  # ไฟล์ที่ไม่ถูกใช้นานเกินนี้จะถูกลบ
+EXPORT_TTL_SECONDS = 6 * 3600
+ARTIFACT_SWEEP_SECONDS = 60
+APL_JOB_WORKERS = 2  # จำนวนงานดึง APL ที่ทำพร้อมกัน
+APL_JOB_HISTORY = 50  # จำนวนงานที่จบแล้วที่เก็บสถานะไว้
+APL_STORE_FOLDER = 'apl_store'
+FRAME_RESULT_FOLDER = os.path.join(CACHE_FOLDER, 'frame_results')
+FRAME_RESULT_MEMORY_MB = int(os.environ.get('FRAME_RESULT_MEMORY_MB', 512))  # งบหน่วยความจำของผล frame_stock ทุก session
+FRAME_RESULT_SPILL = os.environ.get('FRAME_RESULT_SPILL', '1') != '0'  # 0 = ทิ้งผลที่ล้นงบแทนการเขียนลงดิสก์
+FRAME_RESULT_MAX_SPILLED = 64  # จำนวนผลที่เก็บไว้บนดิสก์
+FRAME_RESULT_TTL_SECONDS = 24 * 3600  # ไฟล์ผลบนดิสก์ที่เก่ากว่านี้ถูกลบ (รวมของ process อื่น / การรันครั้งก่อน)
+WATCH_POLL_SECONDS = 2  # รอบการตรวจโฟลเดอร์เมื่อไม่มี watchdog
+WATCH_SAFETY_POLL_SECONDS = 60  # รอบตรวจซ้ำกันพลาดเมื่อใช้ inotify
+WATCH_EVENT_HISTORY = 500  # จำนวน event ล่าสุดที่เก็บไว้ให้ถามย้อนหลัง
+APL_API_URL = os.environ.get('APL_API_URL', 'http://th3sroeeeng4/RTMSAPI/ApiAutoUph/api/data')
+APL_API_SINCE_PARAM = os.environ.get('APL_API_SINCE_PARAM', '')  # ชื่อพารามิเตอร์ "ตั้งแต่เวลา" ของ API (ว่าง = กรองฝั่งเราเอง)
+APL_MOCK_API = os.environ.get('APL_MOCK_API', '0') == '1'  # 1 = เปิด /mock_apl_api/data (API จำลองสำหรับทดสอบ ไม่เปิดโดย default)
+APL_API_TIMEOUT = (10, 600)  # (connect, read) วินาที
+APL_API_RETRIES = 3
+APL_COMPACT_PARTS = 8  # รวม part ของ partition เมื่อมีเกินจำนวนนี้
+APL_COLUMNS = ['date_time_start', 'bom_no', 'operation', 'optn_code', 'Machine_Model', 'UPH']
+APL_KEY_COLUMNS = ['date_time_start', 'bom_no', 'operation', 'optn_code', 'Machine_Model']
+APL_NUMERIC_COLUMNS = ['UPH']  # อ่านจาก API ลง array('d') แทน list ของ object (ดู read_apl_columns)
+APL_TIME_COLUMN = 'date_time_start'  # ค่าไม่ซ้ำกันแทบทุกแถว — ไม่ต้อง intern
+
+SECRET_KEY_PATH = os.path.join(CACHE_FOLDER, 'secret_key')  # ใช้เมื่อไม่ได้ตั้ง SECRET_KEY ใน environment
+STATE_DB_PATH = os.path.join(CACHE_FOLDER, 'state.db')  # สถานะที่ทุก process ใช้ร่วมกัน (งาน APL / event / ไฟล์ที่สร้าง)
+APP_MODE = os.environ.get('APP_MODE', 'development')  # 'production' = หลาย process (ดู serve_production / gunicorn.conf.py)
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))  # จำนวน process ในโหมด production
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))  # จำนวน thread ต่อ process (gunicorn gthread / waitress)
+
+# โฟลเดอร์ที่ต้องมี — สร้างใน ensure_folders() ตอนเริ่ม process ไม่ใช่ตอน import
+APP_FOLDERS = [
+    UPLOAD_FOLDER, DATA_FOLDER, FRAMESTOCK_FOLDER, PACKAGECODE_FOLFER, DATASET_CACHE_FOLDER, FACET_CACHE_FOLDER,
+    EXPORT_CACHE_FOLDER, BOX_STATS_FOLDER, APL_STORE_FOLDER, FRAME_RESULT_FOLDER,
+]
+
+def ensure_folders():
+    for folder in APP_FOLDERS:
+        os.makedirs(folder, exist_ok=True)
+
+def load_secret_key():
+    """key สำหรับเซ็น cookie session: SECRET_KEY จาก environment หรือไฟล์ cache/secret_key (สุ่มครั้งแรกที่ใช้ ทุก process ใช้ไฟล์เดียวกัน)"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    try:
+        with open(SECRET_KEY_PATH, 'rb') as fh:
+            key = fh.read()
+    except FileNotFoundError:
+        key = b''
+    if not key:
+        os.makedirs(os.path.dirname(SECRET_KEY_PATH), exist_ok=True)
+        tmp_path = tmp_path_for(SECRET_KEY_PATH)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(secrets.token_bytes(32))
+        try:
+            os.link(tmp_path, SECRET_KEY_PATH)  # ไม่ทับ key ที่ process อื่นสร้างไว้ก่อน
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        with open(SECRET_KEY_PATH, 'rb') as fh:
+            key = fh.read()
+    return key
+
+class KeyFileSessionInterface(SecureCookieSessionInterface):
+    """cookie session ที่โหลด secret key ตอนใช้ครั้งแรก (import app จึงไม่อ่าน/สร้างไฟล์)"""
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            app.secret_key = load_secret_key()
+        return super().get_signing_serializer(app)
 
 app = Flask(__name__)
 ##dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN)
-app.secret_key = '12345'
+app.session_interface = KeyFileSessionInterface()
 
 def safe_filename(name):
     return re.sub(r'[^a-zA-Z0-9_]', '_', name)
 
-def apply_zscore(df):
-    col_map = {col.lower(): col for col in df.columns}
-    if 'uph' not in col_map:
-        raise KeyError("ไม่พบคอลัมน์ UPH ในข้อมูล")
-    uph_col = col_map['uph']
-
-    mean = df[uph_col].mean()
-    std = df[uph_col].std()
-    if std == 0:
-        return df  # ถ้า std = 0, return ค่าเดิม
-    z_scores = (df[uph_col] - mean) / std
-    filtered = df[(z_scores >= -3) & (z_scores <= 3)].copy()
-    filtered['Outlier_Method'] = 'Z-Score ±3'
-    return filtered
-
-def has_outlier(df):
-    col_map = {col.lower(): col for col in df.columns}
-    if 'uph' not in col_map:
-        raise KeyError("ไม่พบคอลัมน์ UPH ในข้อมูล")
-    uph_col = col_map['uph']
+# === Data folder watcher ===
+# เฝ้าโฟลเดอร์ข้อมูล / ตารางอ้างอิง / uploads แล้วประกาศ event (added / modified / deleted) พร้อมเลข seq ที่เพิ่มขึ้นเรื่อย ๆ
+# ใช้ watchdog (inotify) ถ้าติดตั้งไว้ ไม่งั้น poll ทุก WATCH_POLL_SECONDS — แคชแต่ละตัวลงทะเบียนด้วย @on_data_change
+# เพื่อลบเฉพาะ entry ของไฟล์ที่เปลี่ยน และรายชื่อไฟล์อ่านจาก snapshot ของ watcher แทน os.listdir ทุก request
+WATCH_FOLDERS = [DATA_FOLDER, PACKTYPE_FOLDER, PACKAGECODE_FOLFER, PACKAGEANDFRAMSTOCK, FRAMESTOCK_FOLDER, NOBUMP_FOLDER]
+_watch_snapshot = {}  # โฟลเดอร์ (normpath) -> {ชื่อไฟล์: (mtime_ns, size)}
+_watch_seq = 0
+_watch_events = deque(maxlen=WATCH_EVENT_HISTORY)
+_watch_listeners = []
+_watch_cond = threading.Condition()
+_watch_scan_lock = threading.Lock()
+_watch_wakeup = threading.Event()
+_watch_started = False
+
+def _scan_folder(folder):
+    files = {}
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return files
+    for entry in entries:
+        # ข้าม lock file ของ Excel และไฟล์ที่กำลังเขียน (.tmp ก่อน os.replace)
+        if entry.name.startswith('~$') or entry.name.endswith('.tmp'):
+            continue
+        try:
+            if entry.is_file():
+                st = entry.stat()
+                files[entry.name] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            continue
+    if os.path.normpath(folder) == os.path.normpath(DATA_FOLDER):
+        # partition ใน APL store แสดงเป็นไฟล์ APL_*.xlsx ในโฟลเดอร์ data (version = ของ manifest)
+        files.update({name: version for name, (version, _) in apl_store_files().items()})
+    return files
+
+def on_data_change(listener):
+    """decorator: ลงทะเบียน listener(events) ที่ถูกเรียกเมื่อมีไฟล์ในโฟลเดอร์ที่เฝ้าเปลี่ยน"""
+    _watch_listeners.append(listener)
+    return listener
+
+def rescan_folders(folders=None):
+    """เทียบ snapshot กับไฟล์จริง ประกาศ event ของไฟล์ที่เปลี่ยนให้ listener แล้วคืนรายการ event"""
+    global _watch_seq
+    with _watch_scan_lock:
+        events = []
+        with _watch_cond:
+            for folder in folders or WATCH_FOLDERS:
+                key = os.path.normpath(folder)
+                old = _watch_snapshot.get(key, {})
+                new = _scan_folder(folder)
+                for name in sorted(set(old) | set(new)):
+                    if old.get(name) == new.get(name):
+                        continue
+                    _watch_seq += 1
+                    events.append({
+                        'seq': _watch_seq,
+                        'folder': key,
+                        'file': name,
+                        'path': os.path.normcase(os.path.abspath(os.path.join(folder, name))),
+                        'kind': 'added' if name not in old else 'deleted' if name not in new else 'modified',
+                        'version': list(new[name]) if name in new else None,
+                        'time': time.time(),
+                    })
+                _watch_snapshot[key] = new
+            _watch_events.extend(events)
+            if events:
+                _watch_cond.notify_all()
+
+        if events:
+            for listener in list(_watch_listeners):
+                try:
+                    listener(events)
+                except Exception as e:
+                    print(f"❌ listener {listener.__name__} ล้มเหลว: {e}")
+        return events
+
+def data_change_seq():
+    with _watch_cond:
+        return _watch_seq
+
+def data_changes_since(seq):
+    """event ที่ seq มากกว่าค่าที่ให้ — คืน None ถ้าประวัติถูกตัดไปแล้ว (ผู้เรียกต้องโหลดใหม่ทั้งหมด)"""
+    with _watch_cond:
+        if seq < _watch_seq - len(_watch_events):
+            return None
+        return [dict(e) for e in _watch_events if e['seq'] > seq]
+
+def watched_files(folder):
+    """รายชื่อไฟล์ในโฟลเดอร์ — จาก snapshot ของ watcher ถ้าเฝ้าอยู่ ไม่งั้น os.listdir"""
+    with _watch_cond:
+        files = _watch_snapshot.get(os.path.normpath(folder)) if _watch_started else None
+        if files is not None:
+            return list(files)
+    files = [f for f in os.listdir(folder) if not f.startswith('~$') and not f.endswith('.tmp')]
+    if os.path.normpath(folder) == os.path.normpath(DATA_FOLDER):
+        files += [name for name in apl_store_files() if name not in files]
+    return files
+
+def _watch_loop(interval):
+    while True:
+        if _watch_wakeup.wait(interval):
+            _watch_wakeup.clear()
+            time.sleep(0.2)  # รวม event ที่มาติด ๆ กัน (เช่น Excel บันทึกไฟล์หลายขั้น)
+        try:
+            events = rescan_folders()
+            if events:
+                print(f"📂 ไฟล์เปลี่ยน {len(events)} รายการ (seq {events[-1]['seq']})")
+        except Exception as e:
+            print(f"❌ ตรวจโฟลเดอร์ไม่สำเร็จ: {e}")
+
+def start_data_watcher():
+    """สแกนครั้งแรก (ไม่ประกาศ event) แล้วเริ่ม thread เฝ้าโฟลเดอร์ — เรียกซ้ำได้"""
+    global _watch_started
+    with _watch_cond:
+        if _watch_started:
+            return
+        for folder in WATCH_FOLDERS:
+            _watch_snapshot[os.path.normpath(folder)] = _scan_folder(folder)
+        _watch_started = True
+
+    interval = WATCH_POLL_SECONDS
+    if Observer is not None:
+        class _WakeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                _watch_wakeup.set()
+        try:
+            observer = Observer()
+            for folder in WATCH_FOLDERS:
+                if os.path.isdir(folder):
+                    observer.schedule(_WakeHandler(), folder, recursive=False)
+            observer.daemon = True
+            observer.start()
+            interval = WATCH_SAFETY_POLL_SECONDS
+        except Exception as e:
+            print(f"⚠️ เริ่ม inotify ไม่สำเร็จ ใช้การ poll แทน: {e}")
+    threading.Thread(target=_watch_loop, args=(interval,), daemon=True).start()
+
+# === Dataset cache ===
+# แคชผลการอ่านไฟล์ (xlsx/csv) ตาม (path, mtime, size) ทั้งในหน่วยความจำและไฟล์ sidecar
+# แบบ columnar ใน cache/datasets เพื่อไม่ต้อง parse Excel ซ้ำทุก request / ทุกครั้งที่รีสตาร์ท
+_dataset_cache = OrderedDict()
+_dataset_cache_lock = threading.Lock()
+
+def get_file_version(path):
+    """คืนค่า (mtime_ns, size) ของไฟล์ ใช้เป็นเวอร์ชันของข้อมูล (partition ใน APL store ใช้ของ manifest)"""
+    partition = apl_store_partition(path)
+    st = os.stat(partition[0] if partition else path)
+    return (st.st_mtime_ns, st.st_size)
+
+def data_file_exists(path):
+    """มีไฟล์อยู่จริง หรือเป็น partition ใน APL store"""
+    return os.path.exists(path) or apl_store_partition(path) is not None
+
+def tmp_path_for(path, suffix='.tmp'):
+    """ชื่อไฟล์ชั่วคราวสำหรับเขียนแล้ว os.replace — ไม่ชนกันระหว่าง thread / process"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+def save_frame(df, base_path):
+    """บันทึก DataFrame เป็น Parquet ถ้าทำได้และอ่านกลับได้ตรงกัน ไม่งั้นใช้ pickle"""
+    tmp_path = tmp_path_for(base_path + '.parquet')
+    try:
+        df.to_parquet(tmp_path)
+        if pd.read_parquet(tmp_path).dtypes.equals(df.dtypes):
+            os.replace(tmp_path, base_path + '.parquet')
+            return base_path + '.parquet'
+    except Exception:
+        pass
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    tmp_path = tmp_path_for(base_path + '.pkl')
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, base_path + '.pkl')
+    return base_path + '.pkl'
+
+def load_frame(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+def read_js_dataset(path):
+    """อ่านไฟล์ static/js แบบ `window.XXX_raw = [ ... ];` เป็น DataFrame"""
+    with open(path, encoding='utf-8-sig') as fh:
+        text = fh.read()
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        return pd.DataFrame()
+    return pd.DataFrame(json.loads(text[start:end + 1]))
 
-    Q1 = df[uph_col].quantile(0.25)
-    Q3 = df[uph_col].quantile(0.75)
-    IQR = Q3 - Q1
-    lower = Q1 - 1.5 * IQR
-    upper = Q3 + 1.5 * IQR
-    return ((df[uph_col] < lower) | (df[uph_col] > upper)).sum() > 0
+def _dataset_sidecar_prefix(path, read_kwargs):
+    key = os.path.normcase(os.path.abspath(path)) + '|' + repr(read_kwargs)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(DATASET_CACHE_FOLDER, f"{safe_filename(os.path.basename(path))}_{digest}")
+
+def _read_dataset_file(path, version, options, read_kwargs):
+    """อ่านไฟล์จริง — ใช้ sidecar ของ version นี้ถ้ามี ไม่งั้น parse แล้วบันทึก sidecar (ลบ sidecar ของ version เก่า)"""
+    prefix = _dataset_sidecar_prefix(path, options)
+    sidecar_base = f"{prefix}__{version[0]}_{version[1]}"
+
+    for sidecar in (sidecar_base + '.parquet', sidecar_base + '.pkl'):
+        if os.path.exists(sidecar):
+            try:
+                return load_frame(sidecar)
+            except Exception as e:
+                print(f"⚠️ อ่านแคช {sidecar} ไม่ได้: {e}")
+                os.remove(sidecar)
+
+    if path.lower().endswith('.csv'):
+        df = pd.read_csv(path, **read_kwargs)
+    elif path.lower().endswith('.js'):
+        df = read_js_dataset(path)
+    else:
+        df = pd.read_excel(path, **read_kwargs)
 
-def apply_iqr(df):
-    """Apply IQR Method one time."""
+    try:
+        saved = save_frame(df, sidecar_base)
+        for old in glob.glob(glob.escape(prefix) + '__*'):
+            if old != saved:
+                os.remove(old)
+    except Exception as e:
+        print(f"⚠️ บันทึกแคชของ {path} ไม่สำเร็จ: {e}")
+    return df
+
+def read_dataset(path, **read_kwargs):
+    """อ่านไฟล์ xlsx/csv (หรือ partition ใน APL store) ผ่านแคช คืนค่าเป็นสำเนา DataFrame ที่แก้ไขได้อิสระ"""
+    partition = apl_store_partition(path)
+    version = get_file_version(path)
+    options = tuple(sorted(read_kwargs.items()))
+    key = (os.path.normcase(os.path.abspath(path)), options)
+
+    with _dataset_cache_lock:
+        hit = _dataset_cache.get(key)
+        if hit and hit[0] == version:
+            _dataset_cache.move_to_end(key)
+            return hit[1].copy()
+
+    if partition is not None:
+        df = load_apl_partition(*partition[1])  # part ใน store เป็น Parquet/pickle อยู่แล้ว ไม่ต้องมี sidecar
+    else:
+        df = _read_dataset_file(path, version, options, read_kwargs)
+
+    with _dataset_cache_lock:
+        _dataset_cache[key] = (version, df)
+        _dataset_cache.move_to_end(key)
+        while len(_dataset_cache) > DATASET_CACHE_MAX_ENTRIES:
+            _dataset_cache.popitem(last=False)
+
+    return df.copy()
+
+@on_data_change
+def _invalidate_datasets(events):
+    changed = {e['path'] for e in events if e['kind'] != 'added'}
+    with _dataset_cache_lock:
+        for key in [k for k in _dataset_cache if k[0] in changed]:
+            del _dataset_cache[key]
+
+OUTLIER_MIN_ROWS = 15
+OUTLIER_LABEL_SMALL = 'ไม่ตัด (ข้อมูลน้อย)'
+
+def find_uph_column(df):
     col_map = {col.lower(): col for col in df.columns}
     if 'uph' not in col_map:
         raise KeyError("ไม่พบคอลัมน์ UPH ในข้อมูล")
-    uph_col = col_map['uph']
+    return col_map['uph']
+
+def _grouped_quantiles(codes, values, n_groups, qs):
+    """Quantile แบบ linear ของแต่ละกลุ่ม (สูตรเดียวกับ Series.quantile / np.percentile)"""
+    if not len(values):
+        return [np.full(n_groups, np.nan) for _ in qs]
+
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    empty = counts == 0
+    last = np.maximum(counts - 1, 0)
+
+    results = []
+    for q in qs:
+        virtual = (counts - 1) * q
+        prev = np.floor(virtual)
+        gamma = virtual - prev
+        prev = prev.astype(np.int64)
+        above = virtual >= counts - 1
+        prev = np.where(above | empty, last, prev)
+        nxt = np.where(above | empty, last, prev + 1)
+
+        a = sorted_values[np.minimum(starts + prev, len(sorted_values) - 1)]
+        b = sorted_values[np.minimum(starts + nxt, len(sorted_values) - 1)]
+        diff = b - a
+        result = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+        result[empty] = np.nan
+        results.append(result)
+    return results
+
+def _iqr_bounds(codes, values, rows, n_groups):
+    q1, q3 = _grouped_quantiles(codes[rows], values[rows], n_groups, (0.25, 0.75))
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+def _has_outlier(codes, values, rows, lower, upper, n_groups):
+    c = codes[rows]
+    v = values[rows]
+    outside = (v < lower[c]) | (v > upper[c])
+    return np.bincount(c, weights=outside, minlength=n_groups) > 0
+
+def remove_outliers_grouped(df, group_cols, max_iter=20):
+    """ตัด Outlier แบบวน Z-Score ±3 → IQR ของทุกกลุ่มพร้อมกัน
+
+    ให้ผลเหมือนการเรียก remove_outliers_auto ทีละกลุ่ม: แถวที่เหลือ, ลำดับแถว
+    (เรียงตามกลุ่มที่พบก่อน) และค่า Outlier_Method ตรงกันทุกแถว
+    """
+    uph_col = find_uph_column(df)
+    uph = pd.to_numeric(df[uph_col], errors='coerce')
+    values = uph.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    if group_cols:
+        codes = df.groupby(group_cols, sort=False, dropna=True).ngroup()
+        codes = codes.fillna(-1).to_numpy(dtype=np.int64)
+    else:
+        codes = np.zeros(len(df), dtype=np.int64)
 
-    Q1 = df[uph_col].quantile(0.25)
-    Q3 = df[uph_col].quantile(0.75)
-    IQR = Q3 - Q1
-    lower = Q1 - 1.5 * IQR
-    upper = Q3 + 1.5 * IQR
-    filtered = df[(df[uph_col] >= lower) & (df[uph_col] <= upper)].copy()
-    filtered['Outlier_Method'] = 'IQR'
-    return filtered
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes = np.where(valid, codes, 0)
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
 
-def remove_outliers_auto(df_model, max_iter=20):
-    col_map = {col.lower(): col for col in df_model.columns}
-    if 'uph' not in col_map:
-        raise KeyError("ไม่พบคอลัมน์ UPH ในข้อมูล")
-    uph_col = col_map['uph']
+    sizes = np.bincount(codes[valid], minlength=n_groups)
+    labels = np.empty(n_groups, dtype=object)
+    labels[sizes < OUTLIER_MIN_ROWS] = OUTLIER_LABEL_SMALL
+    pending = sizes >= OUTLIER_MIN_ROWS
+    keep = valid.copy()
 
-    df_model[uph_col] = pd.to_numeric(df_model[uph_col], errors='coerce')
-    df_model = df_model.dropna(subset=[uph_col])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(max_iter):
+            if not pending.any():
+                break
+            rows = keep & pending[codes]
 
-    if len(df_model) < 15:  
-        df_model['Outlier_Method'] = 'ไม่ตัด (ข้อมูลน้อย)'
-        return df_model
+            # Z-Score ±3 (ถ้า std = 0 ไม่ตัดแถวไหนเลย)
+            c = codes[rows]
+            v = values[rows]
+            count = np.bincount(c, minlength=n_groups)
+            mean = np.bincount(c, weights=v, minlength=n_groups) / count
+            std = np.sqrt(np.bincount(c, weights=(v - mean[c]) ** 2, minlength=n_groups) / (count - 1))
+            z = (v - mean[c]) / std[c]
+            z_rows = rows.copy()
+            z_rows[rows] = (std[c] == 0) | ((z >= -3) & (z <= 3))
 
-    current_df = df_model.copy()
+            lower, upper = _iqr_bounds(codes, values, z_rows, n_groups)
+            z_has_outlier = _has_outlier(codes, values, z_rows, lower, upper, n_groups)
+            iqr_rows = z_rows & (values >= lower[codes]) & (values <= upper[codes])
 
-    for i in range(max_iter):
-        print(f"=== รอบที่ {i+1} ===")
-        z_df = apply_zscore(current_df)
-        if not has_outlier(z_df):
-            z_df['Outlier_Method'] = f'Z-Score Loop ×{i+1}'
-            return z_df
+            lower, upper = _iqr_bounds(codes, values, iqr_rows, n_groups)
+            iqr_has_outlier = _has_outlier(codes, values, iqr_rows, lower, upper, n_groups)
 
-        iqr_df = apply_iqr(z_df)
-        if not has_outlier(iqr_df):
-            iqr_df['Outlier_Method'] = f'IQR Loop ×{i+1}'
-            return iqr_df
+            done_z = pending & ~z_has_outlier
+            done_iqr = pending & z_has_outlier & ~iqr_has_outlier
+            labels[done_z] = f'Z-Score Loop ×{i+1}'
+            labels[done_iqr] = f'IQR Loop ×{i+1}'
 
-        current_df = iqr_df
+            keep = np.where(pending[codes], np.where(done_z[codes], z_rows, iqr_rows), keep)
+            pending = pending & z_has_outlier & iqr_has_outlier
 
-    current_df['Outlier_Method'] = f'IQR-Z-Score Loop ×{max_iter}+'
-    return current_df
+    labels[pending] = f'IQR-Z-Score Loop ×{max_iter}+'
 
-def remove_outliers(df):
-    col_map = {col.lower(): col for col in df.columns}
+    positions = np.flatnonzero(keep)
+    positions = positions[np.argsort(codes[positions], kind='stable')]
 
-    model_col = None
+    result = df.iloc[positions].copy()
+    result[uph_col] = uph.iloc[positions]
+    result['Outlier_Method'] = labels[codes[positions]]
+    return result
+
+def remove_outliers_auto(df_model, max_iter=20):
+    return remove_outliers_grouped(df_model, [], max_iter=max_iter)
+
+def find_model_column(df):
+    col_map = {col.lower(): col for col in df.columns}
     if 'machine model' in col_map:
-        model_col = col_map['machine model']
+        return col_map['machine model']
     elif 'machine_model' in col_map:
-        model_col = col_map['machine_model']
-    else:
-        raise KeyError("ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในข้อมูล")
+        return col_map['machine_model']
+    raise KeyError("ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในข้อมูล")
 
-    return pd.concat([
-        remove_outliers_auto(df[df[model_col] == model])
-        for model in df[model_col].unique()
-    ])
+def remove_outliers(df):
+    return remove_outliers_grouped(df, [find_model_column(df)])
 
 def load_data_by_type(filetype_keyword):
-    files = [f for f in os.listdir(DATA_FOLDER) 
+    files = [f for f in watched_files(DATA_FOLDER) 
              if f.lower().endswith(('.csv', '.xlsx')) and filetype_keyword.lower() in f.lower() and not f.startswith('~$')]
 
     combined_df = pd.DataFrame()
@@ -141,9 +544,9 @@ def load_data_by_type(filetype_keyword):
         file_path = os.path.join(DATA_FOLDER, f)
         try:
             if f.endswith('.csv'):
-                df = pd.read_csv(file_path, encoding='utf-8-sig')
+                df = read_dataset(file_path, encoding='utf-8-sig')
             else:
-                df = pd.read_excel(file_path)
+                df = read_dataset(file_path)
             df['Source_File'] = f
             combined_df = pd.concat([combined_df, df], ignore_index=True)
         except Exception as e:
@@ -155,9 +558,9 @@ def process_uph_data(filetype='wb', filepath=None):
     try:
         if filepath:
             if filepath.endswith('.csv'):
-                df = pd.read_csv(filepath, encoding="utf-8-sig")
+                df = read_dataset(filepath, encoding="utf-8-sig")
             else:
-                df = pd.read_excel(filepath)
+                df = read_dataset(filepath)
         else:
             df = load_data_by_type(filetype)
 
@@ -192,13 +595,16 @@ def process_uph_data(filetype='wb', filepath=None):
     except Exception as e:
         print(f"❌ General Error: {e}")
 
+def list_nobump_files():
+    if not os.path.isdir(NOBUMP_FOLDER):
+        return []
+    return [f for f in watched_files(NOBUMP_FOLDER)
+            if ('wire' in f.lower() or 'data' in f.lower() or 'pnp' in f.lower())
+            and f.endswith(('.xlsx', '.xls'))
+            and not f.startswith('~$')]
+
 def load_all_nobump_data():
-    print(f"📂 ไฟล์ในโฟลเดอร์ temp: {os.listdir('temp')}")
-    
-    files = [f for f in os.listdir('temp') 
-             if ('wire' in f.lower() or 'data' in f.lower() or 'pnp' in f.lower()) 
-             and f.endswith(('.xlsx', '.xls')) 
-             and not f.startswith('~$')]
+    files = list_nobump_files()
 
     print(f"🔎 ไฟล์ที่ตรงเงื่อนไข: {files}")
 
@@ -207,9 +613,9 @@ def load_all_nobump_data():
 
     for file in files:
         try:
-            file_path = os.path.join('temp', file)
+            file_path = os.path.join(NOBUMP_FOLDER, file)
             print(f"🔍 กำลังโหลดไฟล์: {file}")
-            df = pd.read_excel(file_path)
+            df = read_dataset(file_path)
             df.columns = df.columns.str.strip().str.upper()
 
             print(f"📄 คอลัมน์ในไฟล์ '{file}': {df.columns.tolist()}")
@@ -247,138 +653,509 @@ def load_all_nobump_data():
 
     return combined_df
 
-def load_packtype_auto():
-    packtype_dir = os.path.join("data", "packtype")
-    packtype_df = pd.DataFrame()
-
-    try:
-        files = glob.glob(os.path.join(packtype_dir, "*.xlsx"))
-        if not files:
-            print("⚠️ ไม่พบไฟล์ .xlsx ใน data/packtype/")
-            return pd.DataFrame(columns=["bom_no", "assy_pack_type"])
-
-        all_data = []
-        for file in files:
+def load_wire_nobump_data():
+    """ตาราง NO_BUMP ของหน้า display_data: ไฟล์แรกใน temp ที่ชื่อมีทั้ง wire และ data (ไม่รวม pnp) — None ถ้าไม่มี"""
+    for fname in list_nobump_files():
+        if "wire" in fname.lower() and "data" in fname.lower():
             try:
-                df = pd.read_excel(file)
-                if 'bom_no' in df.columns and 'assy_pack_type' in df.columns:
-                    df = df[['bom_no', 'assy_pack_type']].dropna()
-                    df['bom_no'] = df['bom_no'].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
-                    df['assy_pack_type'] = df['assy_pack_type'].astype(str).str.strip()
-                    all_data.append(df)
-                    print(f"✅ โหลดไฟล์: {os.path.basename(file)} — แถว: {len(df)}")
-                else:
-                    print(f"⚠️ ไฟล์ {os.path.basename(file)} ไม่มีคอลัมน์ 'bom_no' หรือ 'assy_pack_type'")
+                df = read_dataset(os.path.join(NOBUMP_FOLDER, fname))
             except Exception as e:
-                print(f"❌ โหลดไฟล์ {os.path.basename(file)} ล้มเหลว: {e}")
+                print(f"❌ เกิดข้อผิดพลาดกับไฟล์ '{fname}': {e}")
+                return None
+            df.columns = df.columns.str.strip().str.upper()
+            df['BOM_NO'] = df['BOM_NO'].astype(str)
+            return df
+    return None
 
-        if all_data:
-            packtype_df = pd.concat(all_data, ignore_index=True).drop_duplicates()
-            print(f"📦 รวมข้อมูลทั้งหมด: {len(packtype_df)} แถว จาก {len(files)} ไฟล์")
-        else:
-            print("⚠️ ไม่มีข้อมูลที่ตรงเงื่อนไขเลยในไฟล์ทั้งหมด")
+# === Reference data service ===
+# ตาราง packtype / package code / NO_BUMP โหลดครั้งเดียวไว้ในหน่วยความจำ และโหลดใหม่อัตโนมัติ
+# เมื่อไฟล์ในโฟลเดอร์เปลี่ยน (ดูจาก signature ของ mtime/size) ทุก route ใช้ lookup แบบ dict ตาม BOM
+_reference_data = None
+_reference_signature = None
+_reference_lock = threading.Lock()
+_reference_signature_lock = threading.Lock()
+
+def _folder_signature(folder, files):
+    signature = []
+    for f in sorted(files):
+        try:
+            signature.append((f,) + get_file_version(os.path.join(folder, f)))
+        except OSError:
+            continue
+    return tuple(signature)
+
+def _list_reference_files(folder):
+    if not os.path.isdir(folder):
+        return []
+    return [f for f in watched_files(folder) if f.endswith(('.xlsx', '.xls')) and not f.startswith('~$')]
+
+def reference_signature():
+    """signature ของไฟล์อ้างอิงทั้งหมด — ขณะที่ watcher ทำงานใช้ค่าที่คำนวณไว้จนกว่าจะมี event ของโฟลเดอร์อ้างอิง"""
+    global _reference_signature
+    seq = data_change_seq()
+    with _reference_signature_lock:
+        if _watch_started and _reference_signature is not None:
+            return _reference_signature
+
+    signature = (
+        _folder_signature(PACKTYPE_FOLDER, _list_reference_files(PACKTYPE_FOLDER)),
+        _folder_signature(PACKAGECODE_FOLFER, _list_reference_files(PACKAGECODE_FOLFER)),
+        _folder_signature(NOBUMP_FOLDER, list_nobump_files()),
+    )
+    with _reference_signature_lock:
+        # เก็บไว้เฉพาะเมื่อไม่มี event ระหว่างคำนวณ
+        if _watch_started and data_change_seq() == seq:
+            _reference_signature = signature
+    return signature
+
+REFERENCE_FOLDERS = {os.path.normpath(f) for f in [PACKTYPE_FOLDER, PACKAGECODE_FOLFER, NOBUMP_FOLDER]}
+
+@on_data_change
+def _invalidate_reference_signature(events):
+    global _reference_signature
+    if any(e['folder'] in REFERENCE_FOLDERS for e in events):
+        with _reference_signature_lock:
+            _reference_signature = None
+
+def load_reference_table(folder, value_col):
+    """โหลดคอลัมน์ bom_no + value_col จากทุกไฟล์ในโฟลเดอร์ (BOM ซ้ำใช้แถวแรก)"""
+    dfs = []
+    for f in _list_reference_files(folder):
+        try:
+            df = read_dataset(os.path.join(folder, f))
+            df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
+            if 'bom_no' in df.columns and value_col in df.columns:
+                df = df[['bom_no', value_col]].dropna()
+                df['bom_no'] = df['bom_no'].astype(str).str.strip().str.upper()
+                df[value_col] = df[value_col].astype(str).str.strip()
+                dfs.append(df)
+        except Exception as e:
+            print(f"❌ โหลด {value_col} จาก {f} ไม่สำเร็จ: {e}")
 
-    except Exception as e:
-        print(f"❌ เกิดข้อผิดพลาด: {e}")
+    if not dfs:
+        return pd.DataFrame(columns=['bom_no', value_col])
+    return pd.concat(dfs, ignore_index=True).drop_duplicates(subset='bom_no').reset_index(drop=True)
 
-    return packtype_df
+def _build_reference_data(signature):
+    packtype_df = load_reference_table(PACKTYPE_FOLDER, 'assy_pack_type')
+    packagecode_df = load_reference_table(PACKAGECODE_FOLFER, 'package_code')
 
-def load_packagecode_auto():
-    packagecode_dir = os.path.join("data", "package code")
-    packagecode_df = pd.DataFrame()
+    nobump_df = load_all_nobump_data()
+    # ค่าแรกที่ไม่ว่างของแต่ละคอลัมน์ต่อ BOM (เหมือน dropna().iloc[0] เดิม) — key คือ BOM_NO ตามที่อ่านได้
+    # dict เทียบ key ด้วย == เหมือน nobump_df['BOM_NO'] == bom เดิม (ไม่ strip / ไม่ตัด .0 / ไม่แปลงตัวพิมพ์)
+    nobump_first = nobump_df.groupby('BOM_NO', sort=False)[['NO_BUMP', 'NUMBER_REQUIRED']].first()
+    wire_df = load_wire_nobump_data()
+
+    return {
+        'signature': signature,
+        'version': hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:12],
+        'packtype': packtype_df,
+        'package_code': packagecode_df,
+        'nobump': nobump_df,
+        'packtype_map': dict(zip(packtype_df['bom_no'], packtype_df['assy_pack_type'])),
+        'package_code_map': dict(zip(packagecode_df['bom_no'], packagecode_df['package_code'])),
+        'nobump_map': {
+            bom: (row.NO_BUMP, row.NUMBER_REQUIRED)
+            for bom, row in zip(nobump_first.index, nobump_first.itertuples(index=False))
+        },
+        # display_data ใช้ไฟล์ wire data ไฟล์เดียว (BOM_NO เป็น str) — แยกจาก nobump_map ที่รวมทุกไฟล์
+        'wire_nobump': None if wire_df is None else {
+            'empty': wire_df.iloc[0:0],
+            'groups': dict(list(wire_df.groupby('BOM_NO', sort=False))),
+        },
+    }
 
+def get_reference_data():
+    """คืนค่าตารางอ้างอิงล่าสุด โหลดใหม่เฉพาะเมื่อไฟล์ในโฟลเดอร์อ้างอิงเปลี่ยน"""
+    global _reference_data
+    signature = reference_signature()
+    with _reference_lock:
+        if _reference_data is None or _reference_data['signature'] != signature:
+            print("📦 โหลดตารางอ้างอิง (packtype / package code / NO_BUMP)")
+            _reference_data = _build_reference_data(signature)
+        return _reference_data
+
+def lookup_nobump(bom, refs=None):
+    """คืนค่า (NO_BUMP, NUMBER_REQUIRED) ของ BOM ถ้าไม่มีข้อมูลคืน None"""
+    refs = refs or get_reference_data()
+    values = refs['nobump_map'].get(bom)
+    if values is None:
+        return None, None
+    return tuple(None if pd.isna(v) else v for v in values)
+
+def warm_reference_data():
     try:
-        files = glob.glob(os.path.join(packagecode_dir, "*.xlsx"))
-        if not files:
-            print("⚠️ ไม่พบไฟล์ .xlsx ใน data/package code/")
-            return pd.DataFrame(columns=["bom_no", "package_code"])
+        get_reference_data()
+    except Exception as e:
+        print(f"❌ โหลดตารางอ้างอิงไม่สำเร็จ: {e}")
+
+# === HTTP caching ===
+# หน้ารายงาน/ไฟล์ export ที่คำนวณจากไฟล์ใน data ตอบพร้อม ETag ที่มาจาก version ของไฟล์ต้นทาง
+# (+ ตารางอ้างอิง + พารามิเตอร์ของ request) ถ้าไม่มีอะไรเปลี่ยนตอบ 304 โดยไม่คำนวณใหม่
+# และบีบอัด response ที่เป็นข้อความขนาดใหญ่ (HTML/JSON) ตาม Accept-Encoding
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+
+def _code_version():
+    """version ของโค้ด + template — เปลี่ยนเมื่อ deploy ใหม่ เพื่อไม่ให้ ETag เก่าใช้กับหน้าที่หน้าตาเปลี่ยน"""
+    paths = [os.path.abspath(__file__)] + glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', '*.html'))
+    return hashlib.sha1(repr(sorted(
+        (os.path.basename(p), os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths if os.path.exists(p)
+    )).encode('utf-8')).hexdigest()[:12]
+
+CODE_VERSION = _code_version()
+
+def choose_encoding(accept_encoding, size):
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
 
-        all_data = []
-        for file in files:
+def encode_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+def _add_vary(response, header):
+    values = {v.strip().lower() for v in response.headers.get('Vary', '').split(',') if v.strip()}
+    if header.lower() not in values:
+        response.headers['Vary'] = ', '.join(filter(None, [response.headers.get('Vary'), header]))
+
+def conditional_on(inputs):
+    """decorator: inputs() คืน (รายการ path ของไฟล์ต้นทาง, ค่าอื่นที่มีผลต่อผลลัพธ์)
+
+    ETag = hash ของ (version โค้ด, version ไฟล์ต้นทาง, ค่าอื่น, method + path + query + form)
+    GET/HEAD ที่ส่ง If-None-Match ตรงกันจะได้ 304 โดยไม่เรียก view — ไม่ใช้ If-Modified-Since เพราะ Last-Modified
+    มาจาก mtime ของไฟล์ต้นทางอย่างเดียว ไม่รวมตารางอ้างอิง / version โค้ด (ตอบ 304 ทั้งที่ผลเปลี่ยนได้)
+    ETag ติดให้เฉพาะ response 200 — view ต้องตอบข้อผิดพลาดด้วย status 4xx/5xx ไม่ให้ผลที่ผิดพลาดถูกตอบซ้ำเป็น 304
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
             try:
-                df = pd.read_excel(file)
-
-                df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
-
-                if 'bom_no' in df.columns and 'package_code' in df.columns:
-                    df = df[['bom_no', 'package_code']].dropna()
-                    df['bom_no'] = df['bom_no'].astype(str).str.strip().str.replace(r'\.0$', '', regex=True).str.upper()
-                    df['package_code'] = df['package_code'].astype(str).str.strip()
-                    all_data.append(df)
-                    print(f"✅ โหลดไฟล์: {os.path.basename(file)} — แถว: {len(df)}")
-                else:
-                    print(f"⚠️ ไฟล์ {os.path.basename(file)} ไม่มีคอลัมน์ 'bom_no' หรือ 'package_code'")
+                paths, extra = inputs()
+                versions = [(os.path.basename(p),) + get_file_version(p) for p in paths if data_file_exists(p)]
             except Exception as e:
-                print(f"❌ โหลดไฟล์ {os.path.basename(file)} ล้มเหลว: {e}")
-
-        if all_data:
-            packagecode_df = pd.concat(all_data, ignore_index=True).drop_duplicates(subset="bom_no")
-            print(f"📦 รวมข้อมูลทั้งหมด: {len(packagecode_df)} แถว จาก {len(all_data)} ไฟล์ที่โหลดได้")
+                print(f"⚠️ คำนวณ ETag ของ {request.path} ไม่สำเร็จ: {e}")
+                return view(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((
+                CODE_VERSION, versions, extra, request.method, request.full_path,
+                sorted(request.form.items(multi=True)),
+            )).encode('utf-8')).hexdigest()[:20]
+            last_modified = None
+            if versions:
+                last_modified = datetime.fromtimestamp(max(v[1] for v in versions) // 10**9, tz=timezone.utc)
+
+            if request.method in ('GET', 'HEAD'):
+                if request.if_none_match and request.if_none_match.contains_weak(etag):
+                    response = app.response_class(status=304)
+                    response.set_etag(etag, weak=True)
+                    _add_vary(response, 'Accept-Encoding')
+                    return response
+
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                # weak ETag เพราะ body อาจถูกบีบอัดต่างกันตาม Accept-Encoding
+                response.set_etag(etag, weak=True)
+                if last_modified:
+                    response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """บีบอัด response ข้อความที่ใหญ่กว่า COMPRESS_MIN_BYTES (ไฟล์ที่ส่งแบบ stream/send_file ไม่แตะ)"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    body = response.get_data()
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), len(body))
+    _add_vary(response, 'Accept-Encoding')
+    if encoding:
+        response.set_data(encode_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def data_folder_inputs():
+    """ไฟล์ต้นทางทั้งหมดในโฟลเดอร์ data (สำหรับหน้าที่รวมทุกไฟล์)"""
+    return [
+        os.path.join(DATA_FOLDER, f) for f in sorted(watched_files(DATA_FOLDER))
+        if f.endswith(('.xlsx', '.csv')) and not f.startswith('~$')
+    ], None
+
+# === Artifact store ===
+# ไฟล์ที่ระบบสร้างไว้ชั่วคราว (ไฟล์ export ใน cache/exports / ผล box stats ใน cache/box_stats) ถูกติดตามใน index ในหน่วยความจำ
+# ต่อไฟล์: ขนาด / ลำดับการใช้ (LRU) / วันหมดอายุ (TTL แบบต่ออายุเมื่อถูกใช้) / refs (กำลังสร้างหรือกำลังส่ง — ห้ามลบ)
+# ลบเมื่อหมดอายุหรือขนาดรวมเกิน ARTIFACT_MAX_MB โดยไม่ต้อง list โฟลเดอร์ซ้ำ (สแกนครั้งเดียวตอนเริ่ม)
+ARTIFACT_FOLDERS = [EXPORT_CACHE_FOLDER, BOX_STATS_FOLDER]
+_artifacts = OrderedDict()  # path -> {'size', 'ttl', 'expires', 'queued', 'refs'}
+_artifact_expiry = []  # heap ของ (expires, path) — หนึ่ง entry ต่อไฟล์
+_artifact_bytes = 0
+_artifact_lock = threading.Lock()
+
+def _artifact_entry(path, ttl, expires=None):
+    """(ต้องถือ _artifact_lock) คืน entry ของ path สร้างใหม่ถ้ายังไม่มี"""
+    entry = _artifacts.get(path)
+    if entry is None:
+        expires = expires or time.time() + ttl
+        entry = {'size': 0, 'ttl': ttl, 'expires': expires, 'queued': expires, 'refs': 0}
+        _artifacts[path] = entry
+        heapq.heappush(_artifact_expiry, (expires, path))
+    return entry
+
+def _remove_artifact(path):
+    """(ต้องถือ _artifact_lock) ลบไฟล์และ entry"""
+    global _artifact_bytes
+    entry = _artifacts.pop(path)
+    _artifact_bytes -= entry['size']
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"❌ ลบ {path} ไม่สำเร็จ: {e}")
+
+def _evict_artifacts():
+    """(ต้องถือ _artifact_lock) ลบไฟล์ที่ไม่ได้ใช้นานสุดจนขนาดรวมไม่เกินงบ (ข้ามไฟล์ที่มี refs)"""
+    over = _artifact_bytes - ARTIFACT_MAX_MB * 1024 * 1024
+    victims = []
+    for path, entry in _artifacts.items():
+        if over <= 0:
+            break
+        if entry['refs'] == 0 and entry['size']:
+            victims.append(path)
+            over -= entry['size']
+    for path in victims:
+        _remove_artifact(path)
+
+def register_artifact(path, ttl=ARTIFACT_TTL_SECONDS, last_used=None):
+    """บันทึกไฟล์ที่เพิ่งสร้าง/เขียนใหม่เข้า store (ย้ายไปท้าย LRU) แล้วลบไฟล์เก่าถ้าเกินงบ"""
+    global _artifact_bytes
+    size = os.path.getsize(path)
+    expires = (last_used or time.time()) + ttl
+    with _artifact_lock:
+        entry = _artifact_entry(path, ttl, expires)
+        _artifacts.move_to_end(path)
+        _artifact_bytes += size - entry['size']
+        entry.update(size=size, ttl=ttl, expires=expires)
+        _evict_artifacts()
+
+def _artifact_ttl(path):
+    if os.path.dirname(os.path.normpath(path)) == os.path.normpath(EXPORT_CACHE_FOLDER):
+        return EXPORT_TTL_SECONDS
+    return ARTIFACT_TTL_SECONDS
+
+def touch_artifact(path):
+    """บอกว่าไฟล์ถูกใช้ (ต่ออายุ + ย้ายไปท้าย LRU) คืน False ถ้าไม่มีไฟล์
+
+    แต่ละ process มี index ของตัวเอง — ไฟล์ที่ process อื่นสร้างไว้ถูกรับเข้า store ส่วนไฟล์ที่ถูกลบไปแล้วถูกเอาออก
+    """
+    with _artifact_lock:
+        entry = _artifacts.get(path)
+        if entry is not None:
+            if not entry['size']:
+                return False  # กำลังสร้างอยู่
+            if not os.path.exists(path):
+                _remove_artifact(path)
+                return False
+            _artifacts.move_to_end(path)
+            entry['expires'] = time.time() + entry['ttl']
+            return True
+    try:
+        register_artifact(path, _artifact_ttl(path))  # ไฟล์เขียนแบบ .tmp + os.replace จึงครบเสมอถ้ามีอยู่
+    except OSError:
+        return False
+    return True
+
+def acquire_artifact(path, ttl=ARTIFACT_TTL_SECONDS):
+    """กันไม่ให้ไฟล์ถูกลบระหว่างสร้าง/ส่ง — ต้องเรียก release_artifact ทุกครั้ง"""
+    with _artifact_lock:
+        _artifact_entry(path, ttl)['refs'] += 1
+
+def release_artifact(path):
+    with _artifact_lock:
+        entry = _artifacts.get(path)
+        if entry is None:
+            return
+        entry['refs'] -= 1
+        if entry['refs'] == 0 and not entry['size']:
+            del _artifacts[path]  # สร้างไม่สำเร็จ
         else:
-            print("⚠️ ไม่มีข้อมูลที่ตรงเงื่อนไขเลยในไฟล์ทั้งหมด")
-
-    except Exception as e:
-        print(f"❌ เกิดข้อผิดพลาด: {e}")
-
-    return packagecode_df
-
-def cleanup_old_images(used_filenames, folder='static'):
-    for fname in os.listdir(folder):
-        if fname.endswith(('.png', '.jpg', '.jpeg')) and fname not in used_filenames:
+            _evict_artifacts()
+
+def sweep_artifacts():
+    """ลบไฟล์ที่หมดอายุ — ดูเฉพาะหัว heap (ไม่สแกนโฟลเดอร์) คืนจำนวนไฟล์ที่ลบ"""
+    now = time.time()
+    removed = 0
+    with _artifact_lock:
+        while _artifact_expiry and _artifact_expiry[0][0] <= now:
+            queued, path = heapq.heappop(_artifact_expiry)
+            entry = _artifacts.get(path)
+            if entry is None or entry['queued'] != queued:
+                continue
+            if entry['expires'] > now or entry['refs']:
+                # ถูกใช้หลังเข้าคิว / กำลังใช้อยู่ → เลื่อนไปตามวันหมดอายุใหม่
+                entry['queued'] = max(entry['expires'], now + 1)
+                heapq.heappush(_artifact_expiry, (entry['queued'], path))
+                continue
+            if entry['size']:
+                _remove_artifact(path)
+                removed += 1
+            else:
+                del _artifacts[path]
+    return removed
+
+def load_existing_artifacts():
+    """รับไฟล์ที่สร้างไว้จากการรันครั้งก่อนเข้า store (ตามลำดับ mtime) และลบไฟล์ .tmp ที่ค้าง
+
+    .tmp ที่เพิ่งเขียนอาจเป็นของ process อื่นที่กำลังทำงาน จึงลบเฉพาะที่เก่ากว่า ARTIFACT_SWEEP_SECONDS
+    """
+    found = []
+    for folder in ARTIFACT_FOLDERS:
+        for entry in os.scandir(folder):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.tmp'):
+                try:
+                    if time.time() - entry.stat().st_mtime > ARTIFACT_SWEEP_SECONDS:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
             try:
-                os.remove(os.path.join(folder, fname))
-                print(f"🗑 ลบภาพ: {fname}")
-            except Exception as e:
-                print(f"❌ ลบภาพ {fname} ไม่สำเร็จ: {e}")
-
-def get_used_filenames_somehow():
-    return ['boxplot_after.png', 'boxplot_before.png']
+                found.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+    for mtime, path in sorted(found):
+        try:
+            register_artifact(path, _artifact_ttl(path), last_used=mtime)
+        except OSError:
+            pass  # process อื่นลบไปแล้ว
+    sweep_artifacts()
 
-def auto_cleanup():
+def _artifact_sweeper():
     while True:
-        used_filenames = get_used_filenames_somehow()
-        cleanup_old_images(used_filenames, folder='static')
-        time.sleep(60)
+        time.sleep(ARTIFACT_SWEEP_SECONDS)
+        try:
+            removed = sweep_artifacts() + clear_spilled_frame_results(FRAME_RESULT_TTL_SECONDS)
+            if removed:
+                print(f"🗑 ลบไฟล์ชั่วคราวที่หมดอายุ {removed} ไฟล์")
+        except Exception as e:
+            print(f"❌ ลบไฟล์ชั่วคราวไม่สำเร็จ: {e}")
+
+# === Package-code UPH rollup ===
+# เก็บค่าสรุปต่อไฟล์ (sum / count / sum ของกำลังสอง ของ UPH ต่อ Package code) ไว้ใน cache/uph_rollup.json
+# อ่านใหม่เฉพาะไฟล์ที่เปลี่ยน แล้วรวม partial ของทุกไฟล์เป็นค่าเฉลี่ยต่อ Package code
+UPH_ROLLUP_PATH = os.path.join(CACHE_FOLDER, 'uph_rollup.json')
+_uph_rollup = None
+_uph_rollup_lock = threading.Lock()
+
+def package_uph_partials(path):
+    """คืน [[package code, sum, count, sum_sq], ...] ของ UPH ในไฟล์ (ไฟล์ที่ไม่มีคอลัมน์คืน list ว่าง)"""
+    df = read_dataset(path)
+    df.columns = df.columns.str.strip()
+    if 'Package code' not in df.columns or 'UPH' not in df.columns:
+        return []
+
+    df = df[df['Package code'].notna()]
+    df = df[df['Package code'] != '#N/A']
+    uph = pd.to_numeric(df['UPH'], errors='coerce')
+    keep = uph.notna()
+    codes, uph = df['Package code'][keep], uph[keep]
+
+    grouped = uph.groupby(codes)
+    sums, counts = grouped.sum(), grouped.count()
+    sum_sq = (uph * uph).groupby(codes).sum()
+    return [list(row) for row in zip(sums.index.tolist(), sums.tolist(), counts.tolist(), sum_sq.tolist())]
+
+def _load_uph_rollup():
+    try:
+        with open(UPH_ROLLUP_PATH, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def _save_uph_rollup(rollup):
+    tmp_path = tmp_path_for(UPH_ROLLUP_PATH)
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(rollup, fh, ensure_ascii=False)
+    os.replace(tmp_path, UPH_ROLLUP_PATH)
+
+def get_uph_partials():
+    """คืน {ชื่อไฟล์: partials} ของไฟล์ใน DATA_FOLDER (ตามลำดับ list_data_files) โดยคำนวณใหม่เฉพาะไฟล์ที่เปลี่ยน"""
+    global _uph_rollup
+    files = list_data_files()
+
+    with _uph_rollup_lock:
+        if _uph_rollup is None:
+            _uph_rollup = _load_uph_rollup()
+
+        changed = False
+        for fname in files:
+            fpath = os.path.join(DATA_FOLDER, fname)
+            try:
+                version = list(get_file_version(fpath))
+            except OSError:
+                continue
 
-threading.Thread(target=auto_cleanup, daemon=True).start()
+            entry = _uph_rollup.get(fname)
+            if entry and entry.get('version') == version:
+                continue
 
-def process_all_files_in_data():
-    all_data = []
+            entry = {'version': version, 'partials': []}
+            try:
+                entry['partials'] = package_uph_partials(fpath)
+            except Exception as e:
+                print(f"❌ Error loading {fname}: {e}")
+                entry['error'] = str(e)
+            _uph_rollup[fname] = entry
+            changed = True
 
-    for fname in os.listdir(DATA_FOLDER):
-        if fname.endswith(('.xlsx', '.csv')) and not fname.startswith('~$'):
-            fpath = os.path.join(DATA_FOLDER, fname)
+        for fname in [f for f in _uph_rollup if f not in files]:
+            del _uph_rollup[fname]
+            changed = True
 
+        if changed:
             try:
-                if fname.endswith('.xlsx'):
-                    df = pd.read_excel(fpath)
-                else:
-                    df = pd.read_csv(fpath)
-
-                df.columns = df.columns.str.strip()
+                _save_uph_rollup(_uph_rollup)
+            except OSError as e:
+                print(f"⚠️ บันทึก UPH rollup ไม่สำเร็จ: {e}")
 
-                if 'Package code' in df.columns and 'UPH' in df.columns:
-                    df = df[df['Package code'].notna()]
-                    df = df[df['Package code'] != '#N/A']
-                    df['UPH'] = pd.to_numeric(df['UPH'], errors='coerce')
-                    df = df[df['UPH'].notna()]
+        return {f: _uph_rollup[f]['partials'] for f in files if f in _uph_rollup}
 
-                    all_data.append(df[['Package code', 'UPH']])
-            except Exception as e:
-                print(f"❌ Error loading {fname}: {e}")
+@on_data_change
+def _invalidate_uph_rollup(events):
+    with _uph_rollup_lock:
+        if _uph_rollup is None:
+            return
+        for e in events:
+            if e['folder'] == os.path.normpath(DATA_FOLDER):
+                _uph_rollup.pop(e['file'], None)
 
-    if not all_data:
+def process_all_files_in_data():
+    """ค่าเฉลี่ย UPH ต่อ Package code ของทุกไฟล์ใน data (รวมจาก partial ต่อไฟล์)"""
+    rows = [row for partials in get_uph_partials().values() for row in partials]
+    if not rows:
         return pd.DataFrame(columns=['Package code', 'UPH'])
 
-    combined_df = pd.concat(all_data, ignore_index=True)
-
-    grouped = combined_df.groupby('Package code')['UPH'].mean().reset_index()
+    totals = pd.DataFrame(rows, columns=['Package code', 'sum', 'count', 'sum_sq']).groupby('Package code')[['sum', 'count']].sum()
+    grouped = (totals['sum'] / totals['count']).reset_index()
     grouped.columns = ['Package code', 'UPH']
     grouped = grouped.sort_values(by='UPH', ascending=False)
 
     return grouped
 
 @app.route("/uph_by_package_code")
+@conditional_on(data_folder_inputs)
 def uph_by_package_code():
     result_df = process_all_files_in_data()
     return result_df.to_html(index=False, float_format="%.2f")
@@ -405,33 +1182,381 @@ def show_operations():
 
     return render_template('show_operations.html', tables=tables if tables else None)
 
-generated_files = []
+# === Shared state ===
+# สถานะที่ต้องเห็นตรงกันทุก process (รายชื่อไฟล์ APL ที่สร้าง / งานดึง APL / event ของหน้าเว็บ) เก็บใน SQLite ที่ cache/state.db
+# แทนตัวแปร global — รันหลาย worker (serve_production / gunicorn) แล้ว request ไปตก process ไหนก็ได้ผลเดียวกัน
+# แต่ละ thread เปิด connection ของตัวเอง (ใช้ข้าม fork ไม่ได้ จึงผูกกับ pid ด้วย)
+_state_local = threading.local()
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generated_files (name TEXT PRIMARY KEY, created REAL);
+CREATE TABLE IF NOT EXISTS apl_jobs (id TEXT PRIMARY KEY, job_key TEXT, status TEXT, created REAL, updated REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS apl_jobs_key ON apl_jobs (job_key, status);
+CREATE TABLE IF NOT EXISTS apl_events (seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, data TEXT, created REAL);
+"""
+
+def state_db():
+    """connection ของ thread นี้ไปยัง state.db (autocommit — ใช้ BEGIN IMMEDIATE เองเมื่อต้องอ่าน-แล้ว-เขียน)"""
+    conn = getattr(_state_local, 'conn', None)
+    if conn is None or _state_local.pid != os.getpid():
+        os.makedirs(os.path.dirname(STATE_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(STATE_DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(STATE_SCHEMA)
+        _state_local.conn, _state_local.pid = conn, os.getpid()
+    return conn
+
+def list_generated_files():
+    return [row[0] for row in state_db().execute('SELECT name FROM generated_files ORDER BY created, rowid')]
+
+def add_generated_file(filename):
+    """เพิ่มชื่อไฟล์ คืน True ถ้าเป็นไฟล์ใหม่"""
+    cur = state_db().execute('INSERT OR IGNORE INTO generated_files (name, created) VALUES (?, ?)', (filename, time.time()))
+    return cur.rowcount > 0
+
+# === APL event stream ===
+# แจ้งไฟล์ APL ใหม่และงานดึง APL ที่จบแล้วแบบ push (Server-Sent Events) แทนการ poll /check_new_files ทุก 5 วินาที
+# แต่ละ event มีเลข seq — browser ที่หลุดแล้วต่อใหม่ส่ง Last-Event-ID มาเพื่อรับเฉพาะ event ที่พลาดไป
+# event เก็บใน state.db: process เดียวกันปลุก stream ทันทีผ่าน condition ส่วน event จาก process อื่นเห็นภายใน APL_EVENT_POLL_SECONDS
+APL_EVENT_HISTORY = 200
+APL_EVENT_KEEPALIVE_SECONDS = 15
+APL_EVENT_POLL_SECONDS = 1
+APL_EVENT_STREAM_SECONDS = 300  # ปิด stream เป็นระยะให้ browser ต่อใหม่ ไม่ให้ถือ thread ไว้ตลอด
+# stream หนึ่งถือ thread ของ server ตลอดที่เปิด — จำกัดจำนวนต่อ process ให้เหลือ thread ไว้ตอบ request อื่น
+# เกินแล้วตอบ stream ว่างที่มีแค่ retry: ให้ browser ต่อใหม่ภายหลัง (EventSource ไม่ต่อใหม่เองถ้าได้ 503)
+APL_EVENT_MAX_STREAMS = max(1, WEB_THREADS // 4)
+APL_EVENT_BUSY_RETRY_MS = 30000
+_apl_event_cond = threading.Condition()
+_apl_stream_slots = threading.BoundedSemaphore(APL_EVENT_MAX_STREAMS)
+
+def publish_apl_event(kind, data):
+    """ส่ง event ('file' / 'job') ให้ทุก stream ที่เปิดอยู่ (ทุก process)"""
+    db = state_db()
+    seq = db.execute('INSERT INTO apl_events (kind, data, created) VALUES (?, ?, ?)',
+                     (kind, json.dumps(data, ensure_ascii=False), time.time())).lastrowid
+    db.execute('DELETE FROM apl_events WHERE seq <= ?', (seq - APL_EVENT_HISTORY,))
+    with _apl_event_cond:
+        _apl_event_cond.notify_all()
+
+def latest_apl_event_seq():
+    return state_db().execute('SELECT COALESCE(MAX(seq), 0) FROM apl_events').fetchone()[0]
+
+def apl_events_since(seq):
+    rows = state_db().execute('SELECT seq, kind, data FROM apl_events WHERE seq > ? ORDER BY seq', (seq,))
+    return [{'seq': s, 'kind': kind, 'data': json.loads(data)} for s, kind, data in rows]
+
+def _sse_message(event):
+    return f"id: {event['seq']}\nevent: {event['kind']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+def _apl_event_stream(seq):
+    yield "retry: 3000\n\n"
+    now = time.time()
+    deadline = now + APL_EVENT_STREAM_SECONDS
+    last_sent = now
+    while time.time() < deadline:
+        events = apl_events_since(seq)
+        if not events:
+            if time.time() - last_sent >= APL_EVENT_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            with _apl_event_cond:
+                _apl_event_cond.wait(timeout=APL_EVENT_POLL_SECONDS)
+            continue
+        for event in events:
+            yield _sse_message(event)
+            seq = event['seq']
+        last_sent = time.time()
+
+@app.route("/apl_events")
+def apl_events():
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        seq = int(last_id)
+    except (TypeError, ValueError):
+        seq = latest_apl_event_seq()  # ต่อครั้งแรก รับเฉพาะ event ใหม่
+
+    slots = _apl_stream_slots
+    if not slots.acquire(blocking=False):
+        response = app.response_class(f"retry: {APL_EVENT_BUSY_RETRY_MS}\n\n", mimetype='text/event-stream')
+    else:
+        response = app.response_class(_apl_event_stream(seq), mimetype='text/event-stream')
+        # คืน slot เมื่อ server ปิด response (stream จบ / client หลุด) — ใช้ได้แม้ generator ยังไม่เริ่ม
+        response.call_on_close(slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route("/url")
 def url():
-    return render_template("select_bom.html", files=generated_files)
+    return render_template("select_bom.html", files=list_generated_files())
+
+def register_generated_file(filename):
+    rescan_folders([DATA_FOLDER])
+    if filename and add_generated_file(filename):
+        publish_apl_event('file', {'file': filename})
+        print(f"\u2705 ไฟล์ใหม่: {filename}")
 
 @app.route("/notify_apl_done", methods=["POST"])
 def notify_apl_done():
     data = request.get_json()
-    filename = data.get("filename")
-    if filename and filename not in generated_files:
-        generated_files.append(filename)
-        print(f"\u2705 ไฟล์ใหม่: {filename}")
+    register_generated_file(data.get("filename"))
     return jsonify({"status": "ok"})
 
 @app.route("/check_new_files")
 def check_new_files():
-    return jsonify({"files": generated_files})
+    return jsonify({"files": list_generated_files()})
 
 @app.route("/mock_add_file")
 def mock_add_file():
     test_filename = "APL_test_file.xlsx"
-    if test_filename not in generated_files:
-        generated_files.append(test_filename)
+    if add_generated_file(test_filename):
+        publish_apl_event('file', {'file': test_filename})
         print(f"✅ Mock เพิ่มไฟล์: {test_filename}")
     return f"เพิ่มไฟล์ {test_filename} เรียบร้อย"
 
+# === Dataset API ===
+# ส่งข้อมูลรายไตรมาส (เดิมอยู่ใน static/js/*.js เป็นตัวแปร window) เป็น JSON แบบ columnar ที่บีบอัดแล้ว
+# แหล่งข้อมูล: APL store → static/js → data/APL_*.xlsx  พร้อม ETag, เลือกคอลัมน์ และจำกัดจำนวนแถว
+JS_DATASET_FOLDER = 'static/js'
+JS_OPERATION_KEYS = {
+    "DIE ATTACH": "DIE",
+    "DIE ATTACH MAP": "DIEMAP",
+    "LEAD BOND ROV": "WB",
+    "PKG PICK PLACE": "PNP",
+}
+_encoded_cache = OrderedDict()
+_encoded_cache_lock = threading.Lock()
+ENCODED_CACHE_MAX_ENTRIES = 64
+
+def dataset_source(plant, year_quarter, operation):
+    """หาแหล่งข้อมูลของ (plant, quarter, operation) คืน (ชื่อแหล่ง, version, ฟังก์ชันโหลด) หรือ None"""
+    manifest = _load_apl_manifest(apl_partition_dir(plant, year_quarter, operation))
+    store_path = os.path.join(DATA_FOLDER, apl_filename(plant, year_quarter, operation))
+    if manifest and manifest['parts']:
+        # อ่านผ่าน read_dataset (ชื่อ APL_*.xlsx ใน data) — ใช้แคชเดียวกับหน้ารายงาน
+        return ('apl_store', manifest['data_seq'], lambda: read_dataset(store_path))
+
+    key = JS_OPERATION_KEYS.get(operation)
+    js_path = os.path.join(JS_DATASET_FOLDER, f"{key}{year_quarter}.js") if key else None
+    if js_path and os.path.exists(js_path) and os.path.getsize(js_path) > 0:
+        return ('js', list(get_file_version(js_path)), lambda: read_dataset(js_path))
+
+    if os.path.exists(store_path):
+        return ('xlsx', list(get_file_version(store_path)), lambda: read_dataset(store_path))
+    return None
+
+def frame_to_columnar(df):
+    """DataFrame → {'columns': [...], 'data': {col: [...]}} (NaN เป็น null)"""
+    data = {}
+    for col in df.columns:
+        series = df[col]
+        data[str(col)] = series.astype(object).where(series.notna(), None).tolist()
+    return {'columns': [str(c) for c in df.columns], 'data': data}
+
+def cached_response(etag, build_body, mimetype):
+    """ตอบพร้อม ETag / 304 และบีบอัดตาม Accept-Encoding — เก็บ body ที่บีบอัดแล้วไว้ตาม (etag, encoding)"""
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    accept = request.headers.get('Accept-Encoding', '')
+    with _encoded_cache_lock:
+        raw = _encoded_cache.get((etag, None))
+    if raw is None:
+        raw = build_body()
+    encoding = choose_encoding(accept, len(raw))
+
+    with _encoded_cache_lock:
+        body = _encoded_cache.get((etag, encoding))
+    if body is None:
+        body = encode_body(raw, encoding)
+        with _encoded_cache_lock:
+            _encoded_cache[(etag, None)] = raw
+            _encoded_cache[(etag, encoding)] = body
+            while len(_encoded_cache) > ENCODED_CACHE_MAX_ENTRIES:
+                _encoded_cache.popitem(last=False)
+
+    response = app.response_class(body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etag)
+    return response
+
+@app.route("/api/dataset")
+def dataset_api():
+    plant = request.args.get("plant")
+    year_quarter = request.args.get("year_quarter")
+    operation = request.args.get("operation")
+    if not all([plant, year_quarter, operation]):
+        return jsonify({"error": "Missing parameters"}), 400
+
+    source = dataset_source(plant, year_quarter, operation)
+    if source is None:
+        return jsonify({"error": "ไม่พบข้อมูล"}), 404
+    source_name, version, load = source
+
+    columns = [c for c in request.args.get("columns", "").split(",") if c]
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = request.args.get("limit", type=int)
+    fmt = request.args.get("format", "columnar")
+
+    etag = hashlib.sha1(repr((source_name, version, plant, year_quarter, operation,
+                              columns, offset, limit, fmt)).encode('utf-8')).hexdigest()
+
+    def build_body():
+        df = load()
+        total = len(df)
+        if columns:
+            df = df[[c for c in columns if c in df.columns]]
+        df = df.iloc[offset:offset + limit] if limit is not None else df.iloc[offset:]
+        payload = frame_to_columnar(df) if fmt == "columnar" else {
+            'records': df.astype(object).where(df.notna(), None).to_dict(orient='records')}
+        payload.update({'source': source_name, 'total': total, 'offset': offset, 'rows': len(df)})
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+    return cached_response(etag, build_body, 'application/json')
+
+def mock_apl_api():
+    """API จำลองของ RTMS ApiAutoUph สำหรับทดสอบ — ลงทะเบียน route เฉพาะเมื่อตั้ง APL_MOCK_API=1
+    (แล้วตั้ง APL_API_URL=http://localhost:8080/mock_apl_api/data)
+
+    สร้างข้อมูลรายชั่วโมงตั้งแต่ต้น quarter ถึงปัจจุบันแบบ deterministic รองรับพารามิเตอร์ since
+    """
+    year_quarter = request.args.get("year_quarter", "")
+    operation = request.args.get("operation", "")
+    match = re.match(r"(\d{4})Q([1-4])$", year_quarter)
+    if not match:
+        return jsonify([])
+
+    start = pd.Timestamp(year=int(match.group(1)), month=3 * int(match.group(2)) - 2, day=1)
+    end = min(start + pd.offsets.QuarterBegin(startingMonth=1), pd.Timestamp.now().floor('h'))
+    since = request.args.get(APL_API_SINCE_PARAM or "since")
+    if since:
+        try:
+            since_ts = pd.Timestamp(since)
+        except (ValueError, TypeError):
+            since_ts = pd.NaT
+        if pd.isna(since_ts):
+            return jsonify({"error": f"since ไม่ถูกต้อง: {since}"}), 400
+        if since_ts.tzinfo is not None:
+            since_ts = since_ts.tz_convert(None)
+        start = max(start, since_ts.floor('h'))
+
+    rows = []
+    for ts in pd.date_range(start, end, freq='h', inclusive='left'):
+        for bom_no, model in [("MOCK-BOM-1", "WB3100"), ("MOCK-BOM-2", "ASM AERO IHAWK")]:
+            seed = int(hashlib.md5(f"{ts}{bom_no}".encode()).hexdigest()[:6], 16)
+            rows.append({
+                "date_time_start": ts.isoformat(),
+                "bom_no": bom_no,
+                "operation": operation,
+                "optn_code": "MOCK",
+                "Machine_Model": model,
+                "UPH": 1000 + seed % 500,
+            })
+    return jsonify(rows)
+
+if APL_MOCK_API:
+    app.add_url_rule("/mock_apl_api/data", view_func=mock_apl_api)
+
+# === Facet index ===
+# ค่า distinct ของ bom_no / operation / optn_code (เรียงแล้ว พร้อมจำนวนแถว) ต่อไฟล์
+# เก็บเป็น JSON ใน cache/facets ตามเวอร์ชันของไฟล์ ใช้เติม dropdown โดยไม่ต้องอ่าน workbook
+_facet_cache = {}
+_facet_cache_lock = threading.Lock()
+
+def build_file_facets(path):
+    if path.endswith('.csv'):
+        df = read_dataset(path, encoding="utf-8-sig")
+    else:
+        df = read_dataset(path)
+    df.columns = df.columns.str.strip().str.lower()
+
+    facets = {}
+    for col in FACET_COLUMNS:
+        if col in df.columns:
+            counts = df[col].dropna().astype(str).value_counts()
+            facets[col] = [[value, int(counts[value])] for value in sorted(counts.index)]
+    return facets
+
+def get_file_facets(filename):
+    """คืนค่า {คอลัมน์: [[ค่า, จำนวนแถว], ...]} ของไฟล์ใน DATA_FOLDER"""
+    path = os.path.join(DATA_FOLDER, filename)
+    version = list(get_file_version(path))
+
+    with _facet_cache_lock:
+        hit = _facet_cache.get(filename)
+    if hit and hit[0] == version:
+        return hit[1]
+
+    facet_path = os.path.join(FACET_CACHE_FOLDER, safe_filename(filename) + '.json')
+    facets = None
+    try:
+        with open(facet_path, encoding='utf-8') as fh:
+            stored = json.load(fh)
+        if stored.get('version') == version:
+            facets = stored['facets']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if facets is None:
+        facets = build_file_facets(path)
+        try:
+            tmp_path = tmp_path_for(facet_path)
+            with open(tmp_path, 'w', encoding='utf-8') as fh:
+                json.dump({'file': filename, 'version': version, 'facets': facets}, fh, ensure_ascii=False)
+            os.replace(tmp_path, facet_path)
+        except OSError as e:
+            print(f"⚠️ บันทึก facet ของ {filename} ไม่สำเร็จ: {e}")
+
+    with _facet_cache_lock:
+        _facet_cache[filename] = (version, facets)
+    return facets
+
+@on_data_change
+def _invalidate_facets(events):
+    with _facet_cache_lock:
+        for e in events:
+            if e['folder'] == os.path.normpath(DATA_FOLDER):
+                _facet_cache.pop(e['file'], None)
+
+def facet_values(facets, col):
+    return [value for value, _ in facets.get(col, [])]
+
+def resolve_data_file(display_name):
+    file_map = {
+        os.path.splitext(f)[0]: f
+        for f in watched_files(DATA_FOLDER)
+        if f.lower().endswith(('.csv', '.xlsx')) and not f.startswith('~$')
+    }
+    return file_map.get(display_name)
+
+@app.route("/get_file_facets")
+def get_file_facets_route():
+    file_display_name = request.args.get('file')
+    if not file_display_name:
+        return jsonify({"error": "Missing file name"}), 400
+
+    selected_file = resolve_data_file(file_display_name)
+    if not selected_file:
+        return jsonify({"error": f"File '{file_display_name}' not found"}), 404
+
+    try:
+        facets = get_file_facets(selected_file)
+    except Exception as e:
+        print(f"❌ Exception Occurred: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        col: [{"value": value, "count": count} for value, count in values]
+        for col, values in facets.items()
+    })
+
 @app.route("/get_bom_list")
 def get_bom_list():
     try:
@@ -441,37 +1566,19 @@ def get_bom_list():
 
         print(f"📌 Requested File: {file_display_name}")
 
-        file_map = {
-            os.path.splitext(f)[0]: f 
-            for f in os.listdir(DATA_FOLDER) 
-            if f.lower().endswith(('.csv', '.xlsx')) and not f.startswith('~$')
-}
-        selected_file_exact = file_map.get(file_display_name)
+        selected_file = resolve_data_file(file_display_name)
 
-        if not selected_file_exact:
+        if not selected_file:
             print("❌ File not found in mapping!")
             return jsonify({"error": f"File '{file_display_name}' not found"}), 404
 
-        selected_file = selected_file_exact
-
-        if not selected_file:
-            return jsonify({"error": "File not found"}), 404
+        facets = get_file_facets(selected_file)
 
-        file_path = os.path.join(DATA_FOLDER, selected_file)
-
-        if selected_file.endswith('.csv'):
-            df = pd.read_csv(file_path, encoding="utf-8-sig")
-        else:
-            df = pd.read_excel(file_path)
-
-        df.columns = df.columns.str.strip().str.lower()
-
-        if 'bom_no' not in df.columns:
+        if 'bom_no' not in facets:
             print("❌ 'bom_no' column not found!")
             return jsonify({"error": "Missing 'bom_no' column in the file."}), 400
 
-        df.dropna(subset=['bom_no'], inplace=True)
-        bom_list = sorted(df['bom_no'].astype(str).unique())
+        bom_list = facet_values(facets, 'bom_no')
 
         print(f"✅ BOM List Found: {bom_list}")
         return jsonify(bom_list)
@@ -482,14 +1589,16 @@ def get_bom_list():
     
 def get_latest_data_file(folder='data'):
     """คืนค่าชื่อไฟล์ล่าสุดในโฟลเดอร์ที่กำหนด"""
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(('.csv', '.xlsx'))]
+    files = [os.path.join(folder, f) for f in watched_files(folder) if f.endswith(('.csv', '.xlsx'))]
     if not files:
         return None
-    latest_file = max(files, key=os.path.getmtime)
+    latest_file = max(files, key=lambda f: get_file_version(f)[0])
     return latest_file
 
 def get_user_selected_file(user_selected_name=None, file_type_filter=None):
-    all_files = glob.glob(os.path.join(DATA_FOLDER, "*.csv")) + glob.glob(os.path.join(DATA_FOLDER, "*.xlsx"))
+    data_files = watched_files(DATA_FOLDER)
+    all_files = ([os.path.join(DATA_FOLDER, f) for f in data_files if f.endswith('.csv')] +
+                 [os.path.join(DATA_FOLDER, f) for f in data_files if f.endswith('.xlsx')])
 
     if file_type_filter:
         all_files = [f for f in all_files if file_type_filter.upper() in os.path.basename(f).upper()]
@@ -509,48 +1618,6 @@ def clean_filename_part(s):
         return ''
     return str(s).replace('\r', '').replace('\n', '').replace('_x000D_', '').strip()
 
-def save_plots(df_before, df_after, data_type):
-    plots_before = []
-    plots_after = []
-
-    df_before_type = df_before[df_before['data_type'] == data_type]
-    df_after_type = df_after[df_after['data_type'] == data_type]
-
-    model_col = None
-    for col in df_before_type.columns:
-        if col.strip().lower().replace(" ", "_") == 'machine_model':
-            model_col = col
-            break
-    if not model_col:
-        raise KeyError("ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในข้อมูล")    
-    
-    for model in df_before_type[model_col].unique():
-        clean_model = clean_filename_part(model).replace('/', '_').replace(' ', '_')
-
-        df_model_before = df_before_type[df_before_type[model_col] == model]
-        if not df_model_before.empty:
-            filename_before = f"boxplot_before_{data_type}_{clean_model}.png"
-            plt.figure(figsize=(6, 4))
-            df_model_before.boxplot(column='uph')
-            plt.title(f"before  Outlier - {model}")
-            plt.tight_layout()
-            plt.savefig(os.path.join('static', filename_before))
-            plt.close()
-            plots_before.append(filename_before)
-
-        df_model_after = df_after_type[df_after_type[model_col] == model]
-        if not df_model_after.empty:
-            filename_after = f"boxplot_after_{data_type}_{clean_model}.png"
-            plt.figure(figsize=(6, 4))
-            df_model_after.boxplot(column='uph')
-            plt.title(f"after  Outlier - {model}")
-            plt.tight_layout()
-            plt.savefig(os.path.join('static', filename_after))
-            plt.close()
-            plots_after.append(filename_after)
-
-    return plots_before, plots_after
-
 def merge_data(before_data, after_data, data_type=None):
     if data_type:
         before_data = [d for d in before_data if d.get('Data_Type') == data_type]
@@ -585,40 +1652,210 @@ def is_pnp_file(filename):
     return 'pnp' in filename.lower()
 
 def get_nobump_data(bom_no, file_type):
-    for fname in os.listdir("temp"):
-        if "wire" in fname.lower() and "data" in fname.lower():
-            df = pd.read_excel(os.path.join("temp", fname))
-            df.columns = df.columns.str.strip().str.upper()
-            df['BOM_NO'] = df['BOM_NO'].astype(str)
-
-            filtered = df[df['BOM_NO'] == bom_no]
+    wire = get_reference_data()['wire_nobump']
+    if wire is not None:
+        filtered = wire['groups'].get(bom_no, wire['empty'])
 
-            if file_type == 'WB':
-                if 'NO_BUMP' in filtered.columns and 'NUMBER_REQUIRED' in filtered.columns:
-                    return filtered[['NO_BUMP', 'NUMBER_REQUIRED']]
-                else:
-                    return pd.DataFrame({'NO_BUMP': [0], 'NUMBER_REQUIRED': [0]})
-            else: 
-                if 'NO_BUMP' in filtered.columns and 'NUMBER_REQUIRED_DA' in filtered.columns:
-                    return filtered[['NO_BUMP', 'NUMBER_REQUIRED_DA']]
-                else:
-                    return pd.DataFrame({'NO_BUMP': [0], 'NUMBER_REQUIRED_DA': [1]})  # DA default = 1 unit
+        if file_type == 'WB':
+            if 'NO_BUMP' in filtered.columns and 'NUMBER_REQUIRED' in filtered.columns:
+                return filtered[['NO_BUMP', 'NUMBER_REQUIRED']]
+            else:
+                return pd.DataFrame({'NO_BUMP': [0], 'NUMBER_REQUIRED': [0]})
+        else:
+            if 'NO_BUMP' in filtered.columns and 'NUMBER_REQUIRED_DA' in filtered.columns:
+                return filtered[['NO_BUMP', 'NUMBER_REQUIRED_DA']]
+            else:
+                return pd.DataFrame({'NO_BUMP': [0], 'NUMBER_REQUIRED_DA': [1]})  # DA default = 1 unit
 
     if file_type == 'WB':
         return pd.DataFrame({'NO_BUMP': [0], 'NUMBER_REQUIRED': [0]})
     else:
         return pd.DataFrame({'NO_BUMP': [0], 'NUMBER_REQUIRED_DA': [1]})
 
+# === Box statistics ===
+# สถิติสำหรับวาด boxplot ฝั่ง browser (ค่าเดียวกับที่ matplotlib ใช้วาด) แทนการสร้าง PNG ทุก request
+def box_stats(values):
+    values = np.asarray(values, dtype=float)
+    stats = cbook.boxplot_stats(values, whis=1.5)[0]
+    return {
+        'n': int(len(values)),
+        'mean': float(stats['mean']),
+        'q1': float(stats['q1']),
+        'med': float(stats['med']),
+        'q3': float(stats['q3']),
+        'whislo': float(stats['whislo']),
+        'whishi': float(stats['whishi']),
+        'fliers': [float(v) for v in stats['fliers']],
+    }
+
+def model_box_stats(df_before, df_after, model_col):
+    """box stats ต่อรุ่นเครื่อง ก่อน/หลังตัด Outlier ตามลำดับรุ่นที่พบในข้อมูล"""
+    after_groups = dict(list(df_after.groupby(model_col, sort=False)['uph'])) if not df_after.empty else {}
+    result = []
+    for model, uph_before in df_before.groupby(model_col, sort=False)['uph']:
+        result.append({
+            'model': str(model),
+            'before': box_stats(uph_before),
+            'after': box_stats(after_groups[model]) if model in after_groups else None,
+        })
+    return result
+
+# === Box statistics cache ===
+# ผลของ /box_stats เก็บเป็น JSON ใน cache/box_stats ชื่อไฟล์มาจาก hash ของ input ทั้งหมด
+# (version ไฟล์ต้นทาง + ตารางอ้างอิง + bom / operation + version โค้ด) — input เดิมใช้ผลเดิมได้ทุกผู้ใช้และทุก process
+# โดยไม่ต้องโหลดไฟล์และตัด Outlier ซ้ำ ไฟล์อยู่ใน artifact store (หมดอายุ / ลบตาม LRU เหมือนไฟล์ export)
+def box_stats_cache_path(selected_file, bom, operation):
+    """path ของผล box stats สำหรับ input ชุดนี้ (raise OSError ถ้าไม่มีไฟล์ต้นทาง)"""
+    version = get_file_version(os.path.join('data', selected_file))
+    key = (selected_file, version, get_reference_data()['version'], bom, operation, CODE_VERSION)
+    return os.path.join(BOX_STATS_FOLDER, hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:24] + '.json')
+
+def load_cached_box_stats(path):
+    if not touch_artifact(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None  # ถูกลบระหว่างอ่าน — คำนวณใหม่
+
+def save_cached_box_stats(path, payload):
+    acquire_artifact(path)
+    try:
+        tmp_path = tmp_path_for(path)
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(payload, fh, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        register_artifact(path)
+    finally:
+        release_artifact(path)
+
+def resolve_display_file(selected_file):
+    """ชื่อไฟล์ที่หน้า display_data จะใช้ (ไม่ระบุ = ไฟล์ล่าสุด, เติมนามสกุลให้ถ้าไม่มี)"""
+    if not selected_file:
+        latest_file = get_latest_data_file()
+        if latest_file is None:
+            raise ValueError("ไม่พบไฟล์ข้อมูลในโฟลเดอร์ data")
+        selected_file = os.path.basename(latest_file)
+
+    if not selected_file.endswith(('.xlsx', '.csv')):
+        if data_file_exists(os.path.join('data', selected_file + '.xlsx')):
+            selected_file += '.xlsx'
+        elif data_file_exists(os.path.join('data', selected_file + '.csv')):
+            selected_file += '.csv'
+    return selected_file
+
+def display_inputs():
+    """ไฟล์ต้นทางของ display_data / box_stats + version ตารางอ้างอิง (NO_BUMP มีผลกับ UPH ของ WB)"""
+    selected_file = request.values.get('csv_file') or request.values.get('file')
+    return [os.path.join('data', resolve_display_file(selected_file))], get_reference_data()['version']
+
+def load_display_frame(selected_file, selected_bom=None, selected_operation=None):
+    """โหลด + clean + กรองข้อมูลของหน้า display_data
+
+    คืน (df_filtered, model_col, data_type, selected_file) — ข้อผิดพลาดที่แจ้งผู้ใช้ได้ raise ValueError
+    """
+    def clean_text(s):
+        if pd.isna(s):
+            return s
+        return str(s).replace('\r', '').replace('\n', '').replace('_x000D_', '').strip()
+
+    selected_file = resolve_display_file(selected_file)
+    file_path = os.path.join('data', selected_file)
+    if not data_file_exists(file_path):
+        raise ValueError(f"ไม่พบไฟล์: {file_path}")
+
+    if selected_file.endswith('.csv'):
+        df_raw = read_dataset(file_path, encoding="utf-8-sig")
+    else:
+        df_raw = read_dataset(file_path)
+
+    df_raw.columns = df_raw.columns.str.strip().str.lower()
+    df_raw['uph'] = pd.to_numeric(df_raw['uph'], errors='coerce')
+    df_raw.dropna(subset=['uph'], inplace=True)
+
+    if 'bom_no' in df_raw.columns:
+        df_raw['bom_no'] = df_raw['bom_no'].astype(str)
+
+    model_col = None
+    for col in df_raw.columns:
+        if col.strip().lower().replace(" ", "_") == 'machine_model':
+            model_col = col
+            break
+    if not model_col:
+        raise ValueError("ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในข้อมูล")
+
+    for col in [model_col, 'bom_no', 'operation']:
+        if col in df_raw.columns:
+            df_raw[col] = df_raw[col].apply(clean_text)
+
+    df_filtered = df_raw.copy()
+    if selected_bom and 'bom_no' in df_filtered.columns:
+        df_filtered = df_filtered[df_filtered['bom_no'] == selected_bom]
+    if selected_operation and 'operation' in df_filtered.columns:
+        df_filtered = df_filtered[df_filtered['operation'] == selected_operation]
+
+    filename_lower = selected_file.lower()
+    if 'wb' in filename_lower or 'lead' in filename_lower:
+        data_type = 'wb'
+    elif 'da' in filename_lower or 'die' in filename_lower:
+        data_type = 'die'
+    elif 'pnp' in filename_lower or 'pgk' in filename_lower:
+        data_type = 'pnp'
+    else:
+        data_type = 'unknown'
+
+    if data_type == 'pnp':
+        if 'package_code' in df_filtered.columns:
+            df_filtered['package_code'] = (
+                df_filtered['package_code'].astype(str)
+                .str.strip()
+                .replace({'#N/A': '', 'nan': ''})
+            )
+            pkg_counts = df_filtered[df_filtered['package_code'] != ''].groupby('package_code')['bom_no'].nunique()
+            shared_pkg_codes = pkg_counts[pkg_counts > 1].index
+            if not shared_pkg_codes.empty:
+                df_filtered = df_filtered[
+                    df_filtered['package_code'].isin(shared_pkg_codes) |
+                    (df_filtered['package_code'] == '')
+                ]
+
+    return df_filtered, model_col, data_type, selected_file
+
+@app.route("/box_stats")
+@conditional_on(display_inputs)
+def box_stats_route():
+    selected_bom, selected_operation = request.args.get('bom'), request.args.get('operation')
+    try:
+        cache_path = box_stats_cache_path(resolve_display_file(request.args.get('file')), selected_bom, selected_operation)
+    except (ValueError, OSError):
+        cache_path = None  # ไม่มีไฟล์ — load_display_frame แจ้ง error ด้านล่าง
+    payload = load_cached_box_stats(cache_path) if cache_path else None
+    if payload is not None:
+        return jsonify(payload)
+
+    try:
+        df_filtered, model_col, data_type, selected_file = load_display_frame(
+            request.args.get('file'), selected_bom, selected_operation)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+
+    df_clean = remove_outliers(df_filtered.copy()) if not df_filtered.empty else pd.DataFrame()
+    payload = {
+        'file': selected_file,
+        'data_type': data_type,
+        'models': model_box_stats(df_filtered, df_clean, model_col),
+    }
+    if cache_path:
+        save_cached_box_stats(cache_path, payload)
+    return jsonify(payload)
+
 @app.route("/display_data", methods=['GET', 'POST'])
+@conditional_on(display_inputs)
 def display_data():
     try:
         global csv_file_map
 
-        def clean_text(s):
-            if pd.isna(s):
-                return s
-            return str(s).replace('\r', '').replace('\n', '').replace('_x000D_', '').strip()
-
         if request.method == 'POST':
             selected_file = request.form.get('csv_file')
             selected_bom = request.form.get('bom')
@@ -628,80 +1865,14 @@ def display_data():
             selected_bom = request.args.get('bom')
             selected_operation = request.args.get('operation')
 
-        if not selected_file:
-            latest_file = get_latest_data_file()
-            if latest_file is None:
-                return "ไม่พบไฟล์ข้อมูลในโฟลเดอร์ data"
-            selected_file = os.path.basename(latest_file)
-
-        if not selected_file.endswith(('.xlsx', '.csv')):
-            if os.path.exists(os.path.join('data', selected_file + '.xlsx')):
-                selected_file += '.xlsx'
-            elif os.path.exists(os.path.join('data', selected_file + '.csv')):
-                selected_file += '.csv'
-
-        file_path = os.path.join('data', selected_file)
-        if not os.path.exists(file_path):
-            return f"ไม่พบไฟล์: {file_path}"
-
-        if selected_file.endswith('.csv'):
-            df_raw = pd.read_csv(file_path, encoding="utf-8-sig")
-        else:
-            df_raw = pd.read_excel(file_path)
-
-        df_raw.columns = df_raw.columns.str.strip().str.lower()
-        df_raw['uph'] = pd.to_numeric(df_raw['uph'], errors='coerce')
-        df_raw.dropna(subset=['uph'], inplace=True)
-
-        if 'bom_no' in df_raw.columns:
-            df_raw['bom_no'] = df_raw['bom_no'].astype(str)
-
-        model_col = None
-        for col in df_raw.columns:
-            if col.strip().lower().replace(" ", "_") == 'machine_model':
-                model_col = col
-                break
-        if not model_col:
-            return "ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในข้อมูล"
-
-        for col in [model_col, 'bom_no', 'operation']:
-            if col in df_raw.columns:
-                df_raw[col] = df_raw[col].apply(clean_text)
-
-        df_filtered = df_raw.copy()
-        if selected_bom and 'bom_no' in df_filtered.columns:
-            df_filtered = df_filtered[df_filtered['bom_no'] == selected_bom]
-        if selected_operation and 'operation' in df_filtered.columns:
-            df_filtered = df_filtered[df_filtered['operation'] == selected_operation]
-
-        filename_lower = selected_file.lower()
-        if 'wb' in filename_lower or 'lead' in filename_lower:
-            data_type = 'wb'
-        elif 'da' in filename_lower or 'die' in filename_lower:
-            data_type = 'die'
-        elif 'pnp' in filename_lower or 'pgk' in filename_lower:
-            data_type = 'pnp'
-        else:
-            data_type = 'unknown'
-
-        if data_type == 'pnp':
-            if 'package_code' in df_filtered.columns:
-                df_filtered['package_code'] = (
-                    df_filtered['package_code'].astype(str)
-                    .str.strip()
-                    .replace({'#N/A': '', 'nan': ''})
-                )
-                pkg_counts = df_filtered[df_filtered['package_code'] != ''].groupby('package_code')['bom_no'].nunique()
-                shared_pkg_codes = pkg_counts[pkg_counts > 1].index
-                if not shared_pkg_codes.empty:
-                    df_filtered = df_filtered[
-                        df_filtered['package_code'].isin(shared_pkg_codes) |
-                        (df_filtered['package_code'] == '')
-                    ]
+        try:
+            df_filtered, model_col, data_type, selected_file = load_display_frame(selected_file, selected_bom, selected_operation)
+        except ValueError as e:
+            return str(e), 404
 
         def process(df_part, data_type, model_col):
             if df_part.empty:
-                return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), [], [], pd.DataFrame()
+                return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), [], pd.DataFrame()
 
             df_part['data_type'] = data_type
 
@@ -745,41 +1916,10 @@ def display_data():
             else:
                 package_summary = pd.DataFrame()
 
-            boxplots_before, boxplots_after = save_plots(df_part, df_clean, data_type, model_col)
-            return summary_before, summary_after, df_clean, boxplots_before, boxplots_after, package_summary
-
-        def save_plots(df_before_type, df_after_type, data_type, model_col):
-            plots_before = []
-            plots_after = []
-
-            for model in df_before_type[model_col].unique():
-                clean_model = clean_filename_part(model).replace('/', '_').replace(' ', '_')
-
-                df_model_before = df_before_type[df_before_type[model_col] == model]
-                if not df_model_before.empty:
-                    filename_before = f"boxplot_before_{data_type}_{clean_model}.png"
-                    plt.figure(figsize=(6, 4))
-                    df_model_before.boxplot(column='uph')
-                    plt.title(f"Before Outlier - {model}")
-                    plt.tight_layout()
-                    plt.savefig(os.path.join('static', filename_before))
-                    plt.close()
-                    plots_before.append(filename_before)
-
-                df_model_after = df_after_type[df_after_type[model_col] == model]
-                if not df_model_after.empty:
-                    filename_after = f"boxplot_after_{data_type}_{clean_model}.png"
-                    plt.figure(figsize=(6, 4))
-                    df_model_after.boxplot(column='uph')
-                    plt.title(f"After Outlier - {model}")
-                    plt.tight_layout()
-                    plt.savefig(os.path.join('static', filename_after))
-                    plt.close()
-                    plots_after.append(filename_after)
-
-            return plots_before, plots_after
-
-        summary_before, summary_after, df_clean, boxplots_before, boxplots_after, package_summary = process(df_filtered, data_type, model_col)
+            model_stats = model_box_stats(df_part, df_clean, model_col)
+            return summary_before, summary_after, df_clean, model_stats, package_summary
+
+        summary_before, summary_after, df_clean, model_stats, package_summary = process(df_filtered, data_type, model_col)
 
         summary_before_html = summary_before.to_html(classes='table table-bordered', index=False) if not summary_before.empty else "ไม่มีข้อมูล"
         summary_after_html = summary_after.to_html(classes='table table-bordered', index=False) if not summary_after.empty else "ไม่มีข้อมูล"
@@ -804,11 +1944,10 @@ def display_data():
                                summary_after=summary_after_html,
                                data=summary_cleaned_html,
                                efficiency_table=package_summary_html,
-                               boxplots_before=boxplots_before,
-                               boxplots_after=boxplots_after)
+                               box_stats=model_stats)
 
     except Exception as e:
-        return f"เกิดข้อผิดพลาด: {str(e)}"
+        return f"เกิดข้อผิดพลาด: {str(e)}", 500
     
 @app.route('/js/<path:filename>')
 def serve_js(filename):
@@ -832,6 +1971,181 @@ def main():
         operations=operations
     )
 
+def build_apl_url(plant, year_quarter, operation, since=None):
+    # 👇 ถ้า operation เป็น "LEAD BOND ROV_WB" ให้ใช้แค่ "LEAD BOND ROV" เรียก API
+    actual_operation = operation.split("_WB")[0] if operation.endswith("_WB") else operation
+
+    encoded_operation = urllib.parse.quote(actual_operation)
+    url = (
+        f"{APL_API_URL}"
+        f"?plant={plant}&year_quarter={year_quarter}&operation={encoded_operation}"
+    )
+    if since is not None and APL_API_SINCE_PARAM:
+        url += f"&{APL_API_SINCE_PARAM}={urllib.parse.quote(since.isoformat())}"
+    return url
+
+# === APL fetch jobs ===
+# การดึง APL (เรียก RTMS API + รวมไฟล์ Excel) ทำใน thread pool เบื้องหลัง ไม่ค้าง request ของ Flask
+# หน้าเว็บส่งงานที่ /apl_jobs แล้วถามสถานะจนเสร็จ จากนั้นดาวน์โหลดผ่านลิงก์ของงาน
+# งานรันใน process ที่รับคำสั่ง แต่สถานะเก็บในตาราง apl_jobs ของ state.db — ถามสถานะ/ดาวน์โหลดจาก process ไหนก็ได้
+APL_JOB_STALE_SECONDS = 3600  # งานที่ยังไม่จบแต่ไม่มีความคืบหน้านานเกินนี้ ถือว่า process ที่รันหายไปแล้ว
+_apl_pool = ThreadPoolExecutor(max_workers=APL_JOB_WORKERS, thread_name_prefix='apl')
+
+def _apl_job_key(plant, year_quarter, operation):
+    return json.dumps([plant, year_quarter, operation], ensure_ascii=False)
+
+def _apl_job_row(row):
+    job = json.loads(row[0])
+    if job['status'] in ('queued', 'running') and time.time() - row[1] > APL_JOB_STALE_SECONDS:
+        job.update(status='error', error="งานถูกยกเลิก (server ถูกรีสตาร์ท)")
+    return job
+
+def get_apl_job(job_id):
+    row = state_db().execute('SELECT data, updated FROM apl_jobs WHERE id = ?', (job_id,)).fetchone()
+    return _apl_job_row(row) if row else None
+
+def _save_apl_job(db, job):
+    db.execute('INSERT OR REPLACE INTO apl_jobs (id, job_key, status, created, updated, data) VALUES (?, ?, ?, ?, ?, ?)',
+               (job['id'], _apl_job_key(job['plant'], job['year_quarter'], job['operation']), job['status'],
+                job['created'], time.time(), json.dumps(job, ensure_ascii=False)))
+
+def _apl_job_view(job):
+    view = {k: v for k, v in job.items() if k != 'path'}
+    view['status_url'] = url_for('apl_job_status', job_id=job['id'])
+    if job['status'] == 'done':
+        view['download_url'] = url_for('apl_job_download', job_id=job['id'])
+    return view
+
+def _update_apl_job(job_id, **fields):
+    db = state_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT data FROM apl_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is not None:
+            job = json.loads(row[0])
+            job.update(fields)
+            _save_apl_job(db, job)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+def _run_apl_job(job_id):
+    job = get_apl_job(job_id)
+    _update_apl_job(job_id, status='running', started=time.time())
+    try:
+        # ดึงเฉพาะข้อมูลที่ใหม่กว่า watermark (เวลา date_time_start ล่าสุดที่มีแล้ว) ยกเว้นสั่ง full
+        since = None if job['full'] else apl_watermark(job['plant'], job['year_quarter'], job['operation'])
+        _update_apl_job(job_id, since=since.isoformat() if since is not None else None)
+        success, filepath = run_apl(
+            build_apl_url(job['plant'], job['year_quarter'], job['operation'], since),
+            job['plant'], job['year_quarter'], job['operation'],  # ส่ง operation เดิมไว้ใช้ตั้งชื่อไฟล์
+            progress=lambda stage: _update_apl_job(job_id, progress=stage),
+            since=since,
+        )
+    except Exception as e:
+        success, filepath = False, None
+        print(f"❌ งาน APL {job_id} ล้มเหลว: {e}")
+
+    if success:
+        filename = os.path.basename(filepath)
+        _update_apl_job(job_id, status='done', progress='done', path=filepath, filename=filename, finished=time.time())
+        register_generated_file(filename)
+        publish_apl_event('job', {'id': job_id, 'status': 'done', 'filename': filename})
+    else:
+        _update_apl_job(job_id, status='error', error="ไม่สามารถโหลดข้อมูลได้", finished=time.time())
+        publish_apl_event('job', {'id': job_id, 'status': 'error'})
+
+def _trim_apl_jobs(db):
+    db.execute("""DELETE FROM apl_jobs WHERE id IN (
+                      SELECT id FROM apl_jobs WHERE status IN ('done', 'error') ORDER BY created DESC LIMIT -1 OFFSET ?)""",
+               (APL_JOB_HISTORY,))
+
+def submit_apl_job(plant, year_quarter, operation, full=False):
+    """ส่งงานดึง APL เข้า queue (ถ้ามีงานเดียวกันที่ยังไม่จบ ใช้งานเดิม — รวมถึงงานของ process อื่น) คืน job dict
+
+    full=True ดึงทั้ง quarter โดยไม่ใช้ watermark
+    """
+    db = state_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute("""SELECT data, updated FROM apl_jobs WHERE job_key = ? AND status IN ('queued', 'running')
+                            ORDER BY created DESC LIMIT 1""", (_apl_job_key(plant, year_quarter, operation),)).fetchone()
+        if row is not None:
+            job = _apl_job_row(row)
+            if job['status'] != 'error':
+                db.execute('COMMIT')
+                return job
+
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'id': job_id,
+            'plant': plant,
+            'year_quarter': year_quarter,
+            'operation': operation,
+            'full': bool(full),
+            'status': 'queued',
+            'progress': 'queued',
+            'filename': None,
+            'error': None,
+            'created': time.time(),
+        }
+        _save_apl_job(db, job)
+        _trim_apl_jobs(db)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    _apl_pool.submit(_run_apl_job, job_id)
+    return job
+
+def _apl_job_params():
+    source = request.get_json(silent=True) or request.values
+    full = str(source.get("full", "")).lower() in ("1", "true", "yes")
+    return source.get("plant"), source.get("year_quarter"), source.get("operation"), full
+
+@app.route("/apl_jobs", methods=["POST"])
+def create_apl_job():
+    plant, year_quarter, operation, full = _apl_job_params()
+    if not all([plant, year_quarter, operation]):
+        return jsonify({"error": "Missing parameters"}), 400
+
+    job = submit_apl_job(plant, year_quarter, operation, full)
+    return jsonify(_apl_job_view(job)), 202
+
+@app.route("/apl_jobs/<job_id>")
+def apl_job_status(job_id):
+    job = get_apl_job(job_id)
+    if job is None:
+        return jsonify({"error": "ไม่พบงาน"}), 404
+    return jsonify(_apl_job_view(job))
+
+@app.route("/apl_jobs/<job_id>/download")
+def apl_job_download(job_id):
+    job = get_apl_job(job_id)
+    if job is None:
+        return "❌ ไม่พบงาน", 404
+    if job['status'] != 'done':
+        return jsonify(_apl_job_view(job)), 409
+
+    filepath = export_apl_xlsx(job['plant'], job['year_quarter'], job['operation'])
+    if filepath is None:
+        return "❌ ไม่พบข้อมูล", 404
+    return send_export_artifact(filepath, apl_filename(job['plant'], job['year_quarter'], job['operation']))
+
+@app.route("/apl_export")
+def apl_export():
+    plant = request.args.get("plant")
+    year_quarter = request.args.get("year_quarter")
+    operation = request.args.get("operation")
+    if not all([plant, year_quarter, operation]):
+        return "❌ Missing parameters", 400
+
+    filepath = export_apl_xlsx(plant, year_quarter, operation)
+    if filepath is None:
+        return "❌ ไม่พบข้อมูล", 404
+    return send_export_artifact(filepath, apl_filename(plant, year_quarter, operation))
+
 @app.route("/download_apl_excel")
 def download_apl_excel():
     plant = request.args.get("plant")
@@ -841,115 +2155,526 @@ def download_apl_excel():
     if not all([plant, year_quarter, operation]):
         return "❌ Missing parameters", 400
 
-    # 👇 ถ้า operation เป็น "LEAD BOND ROV_WB" ให้ใช้แค่ "LEAD BOND ROV" เรียก API
-    actual_operation = operation.split("_WB")[0] if operation.endswith("_WB") else operation
+    # ไม่รอ API แล้ว — ส่งงานเข้า queue และคืนสถานะงาน (ใช้ status_url / download_url ต่อ)
+    job = submit_apl_job(plant, year_quarter, operation)
+    return jsonify(_apl_job_view(job)), 202
+
+# === APL store ===
+# ข้อมูล APL เก็บแบบ append-only ต่อ partition (plant / quarter / operation) ใน apl_store
+# แต่ละครั้งที่ดึงเขียน part ใหม่หนึ่งไฟล์ (Parquet / pickle) ไม่ต้องอ่าน-เขียน xlsx ทั้งไฟล์
+# part จะถูกรวม (compaction) เมื่อมีมากเกิน — partition ที่มีข้อมูลแสดงในโฟลเดอร์ data เป็น APL_*.xlsx (ไม่มีไฟล์จริง)
+# watcher / get_file_version / read_dataset อ่านจาก manifest และ part โดยตรง ส่วน xlsx สร้างเฉพาะตอนดาวน์โหลด (cache/exports)
+@contextlib.contextmanager
+def apl_partition_lock(part_dir):
+    """ล็อก partition ข้าม thread และ process (ไฟล์ .lock ใน partition) — ครอบการอ่าน-แก้-เขียน manifest การอ่าน part และการลบ part"""
+    os.makedirs(part_dir, exist_ok=True)
+    with open(os.path.join(part_dir, '.lock'), 'a+b') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK รอแค่ ~10 วินาที
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
 
-    encoded_operation = urllib.parse.quote(actual_operation)
-    base_api_url = (
-        f"http://th3sroeeeng4/RTMSAPI/ApiAutoUph/api/data"
-        f"?plant={plant}&year_quarter={year_quarter}&operation={encoded_operation}"
-    )
+def apl_filename(plant, year_quarter, operation):
+    return f"APL_{plant}_{year_quarter}_{operation.replace(' ', '_')}.xlsx"
 
-    success, filepath = run_apl(base_api_url, plant, year_quarter, operation)  # ส่ง operation เดิมไว้ใช้ตั้งชื่อไฟล์
+def apl_partition_dir(plant, year_quarter, operation):
+    return os.path.join(APL_STORE_FOLDER, safe_filename(plant), safe_filename(year_quarter), safe_filename(operation))
 
-    if success:
-        return send_file(filepath, as_attachment=True)
-    else:
-        return "❌ ไม่สามารถโหลดข้อมูลได้", 500
+_apl_store_index = {}  # path ของ manifest -> (version ของ manifest, (plant, quarter, operation) หรือ None ถ้ายังไม่มี part)
+_apl_store_names = {}  # ชื่อไฟล์ใน data -> path ของ manifest
+_apl_store_lock = threading.Lock()
 
-def run_apl(full_url, plant, year_quarter, operation):
+def apl_store_files():
+    """{ชื่อไฟล์ใน data: (version ของ manifest, (plant, quarter, operation))} ของทุก partition ที่มีข้อมูล
+
+    อ่าน manifest ใหม่เฉพาะตัวที่เปลี่ยน (ตาม mtime / size)
+    """
+    files = {}
+    with _apl_store_lock:
+        manifests = glob.glob(os.path.join(glob.escape(APL_STORE_FOLDER), '*', '*', '*', 'manifest.json'))
+        for manifest_path in manifests:
+            try:
+                st = os.stat(manifest_path)
+            except OSError:
+                continue
+            version = (st.st_mtime_ns, st.st_size)
+            hit = _apl_store_index.get(manifest_path)
+            if hit is None or hit[0] != version:
+                manifest = _load_apl_manifest(os.path.dirname(manifest_path))
+                partition = None
+                if manifest and manifest['parts']:
+                    partition = (manifest['plant'], manifest['year_quarter'], manifest['operation'])
+                hit = _apl_store_index[manifest_path] = (version, partition)
+            if hit[1] is not None:
+                files[apl_filename(*hit[1])] = hit
+        for manifest_path in set(_apl_store_index) - set(manifests):
+            del _apl_store_index[manifest_path]
+        _apl_store_names.clear()
+        _apl_store_names.update({name: manifest_path for manifest_path, (_, partition) in _apl_store_index.items()
+                                 if partition is not None for name in [apl_filename(*partition)]})
+    return files
+
+def apl_store_partition(path):
+    """ถ้า path เป็นไฟล์ APL_*.xlsx ในโฟลเดอร์ data ที่มี partition ใน store คืน (path ของ manifest, (plant, quarter, operation))"""
+    name = os.path.basename(path)
+    if not name.startswith('APL_') or os.path.normcase(os.path.abspath(os.path.dirname(path))) != \
+            os.path.normcase(os.path.abspath(DATA_FOLDER)):
+        return None
+    with _apl_store_lock:
+        manifest_path = _apl_store_names.get(name)
+    if manifest_path is None or not os.path.exists(manifest_path):
+        apl_store_files()  # partition ใหม่ (อาจมาจาก process อื่น) หรือถูกลบ
+        with _apl_store_lock:
+            manifest_path = _apl_store_names.get(name)
+        if manifest_path is None:
+            return None
+    with _apl_store_lock:
+        hit = _apl_store_index.get(manifest_path)
+    return (manifest_path, hit[1]) if hit else None
+
+def _apl_manifest_path(part_dir):
+    return os.path.join(part_dir, 'manifest.json')
+
+def _load_apl_manifest(part_dir):
+    try:
+        with open(_apl_manifest_path(part_dir), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+def _save_apl_manifest(part_dir, manifest):
+    tmp_path = tmp_path_for(_apl_manifest_path(part_dir))
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, _apl_manifest_path(part_dir))
+
+def _write_apl_part(part_dir, manifest, df):
+    manifest['seq'] += 1
+    part = os.path.basename(save_frame(df.reset_index(drop=True), os.path.join(part_dir, f"part-{manifest['seq']:06d}")))
+    manifest['parts'].append(part)
+    return part
+
+def apl_times(values):
+    """แปลง date_time_start เป็น datetime (naive) สำหรับเทียบ watermark — ค่าที่แปลงไม่ได้เป็น NaT"""
+    times = pd.to_datetime(pd.Series(values), errors='coerce', format='mixed')
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_convert(None)
+    return times
+
+def _advance_apl_watermark(manifest, df):
+    latest = apl_times(df['date_time_start']).max() if 'date_time_start' in df.columns and len(df) else pd.NaT
+    if pd.isna(latest):
+        return
+    current = pd.Timestamp(manifest['watermark']) if manifest.get('watermark') else None
+    if current is None or latest > current:
+        manifest['watermark'] = latest.isoformat()
+
+def _dedupe_apl(df):
+    return df.drop_duplicates(subset=APL_KEY_COLUMNS, keep='last').reset_index(drop=True)
+
+def _read_apl_parts(part_dir, manifest):
+    frames = [load_frame(os.path.join(part_dir, part)) for part in manifest['parts']]
+    if not frames:
+        return pd.DataFrame(columns=APL_COLUMNS)
+    return _dedupe_apl(pd.concat(frames, ignore_index=True))
+
+def _open_apl_partition(plant, year_quarter, operation):
+    """โหลด manifest ของ partition (สร้างใหม่ถ้ายังไม่มี — ถ้ามี xlsx เดิมใน data/ ใช้เป็น part แรก)"""
+    part_dir = apl_partition_dir(plant, year_quarter, operation)
+    manifest = _load_apl_manifest(part_dir)
+    if manifest is not None:
+        return part_dir, manifest
+
+    os.makedirs(part_dir, exist_ok=True)
+    manifest = {'plant': plant, 'year_quarter': year_quarter, 'operation': operation,
+                'seq': 0, 'data_seq': 0, 'parts': [], 'watermark': None}
+    legacy_path = os.path.join(DATA_FOLDER, apl_filename(plant, year_quarter, operation))
+    if os.path.exists(legacy_path):
+        df_legacy = pd.read_excel(legacy_path)
+        _write_apl_part(part_dir, manifest, df_legacy)
+        _advance_apl_watermark(manifest, df_legacy)
+        manifest['data_seq'] = manifest['seq']
+        print(f"📦 ย้าย {legacy_path} เข้า APL store")
+    _save_apl_manifest(part_dir, manifest)
+    return part_dir, manifest
+
+def compact_apl_partition(part_dir, manifest):
+    """(ต้องถือ apl_partition_lock) รวมทุก part เป็นไฟล์เดียว (ตัดแถวซ้ำ เก็บค่าล่าสุด) แล้วลบ part เก่า"""
+    old_parts = list(manifest['parts'])
+    df = _read_apl_parts(part_dir, manifest)
+    manifest['parts'] = []
+    _write_apl_part(part_dir, manifest, df)
+    _save_apl_manifest(part_dir, manifest)
+    for part in old_parts:
+        try:
+            os.remove(os.path.join(part_dir, part))
+        except OSError:
+            pass
+    print(f"🗜 Compact APL {part_dir}: {len(old_parts)} part → 1 ({len(df)} แถว)")
+
+def append_apl_rows(plant, year_quarter, operation, df_new):
+    """เพิ่มแถวเป็น part ใหม่ คืน True ถ้า partition มีข้อมูล (รวมข้อมูลเดิมเมื่อไม่มีแถวใหม่)"""
+    with apl_partition_lock(apl_partition_dir(plant, year_quarter, operation)):
+        part_dir, manifest = _open_apl_partition(plant, year_quarter, operation)
+        if df_new.empty:
+            return bool(manifest['parts'])
+        _write_apl_part(part_dir, manifest, df_new)
+        _advance_apl_watermark(manifest, df_new)
+        manifest['data_seq'] = manifest['seq']
+        _save_apl_manifest(part_dir, manifest)
+        print(f"✅ เพิ่ม {len(df_new)} แถวใน {part_dir}")
+
+        if len(manifest['parts']) > APL_COMPACT_PARTS:
+            compact_apl_partition(part_dir, manifest)
+        return True
+
+def apl_watermark(plant, year_quarter, operation):
+    """date_time_start ล่าสุดที่มีใน store ของ partition นี้ (None ถ้ายังไม่มีข้อมูล)"""
+    with apl_partition_lock(apl_partition_dir(plant, year_quarter, operation)):
+        part_dir, manifest = _open_apl_partition(plant, year_quarter, operation)
+        if 'watermark' not in manifest:
+            # manifest รุ่นก่อนยังไม่มี watermark — คำนวณจากข้อมูลที่มีครั้งเดียว
+            manifest['watermark'] = None
+            if manifest['parts']:
+                _advance_apl_watermark(manifest, _read_apl_parts(part_dir, manifest))
+            _save_apl_manifest(part_dir, manifest)
+    return pd.Timestamp(manifest['watermark']) if manifest['watermark'] else None
+
+def load_apl_partition(plant, year_quarter, operation):
+    with apl_partition_lock(apl_partition_dir(plant, year_quarter, operation)):
+        part_dir, manifest = _open_apl_partition(plant, year_quarter, operation)
+        return _read_apl_parts(part_dir, manifest)
+
+def apl_export_path(plant, year_quarter, operation, data_seq):
+    """path ของไฟล์ export ใน cache/exports — ชื่อขึ้นกับ data_seq จึงสร้างใหม่เฉพาะเมื่อมีข้อมูลเพิ่ม"""
+    name = os.path.splitext(apl_filename(plant, year_quarter, operation))[0]
+    digest = hashlib.sha1(repr((plant, year_quarter, operation, data_seq)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(EXPORT_CACHE_FOLDER, f"{safe_filename(name)}_{digest}.xlsx")
+
+def export_apl_xlsx(plant, year_quarter, operation):
+    """xlsx ของ partition สำหรับดาวน์โหลด (ใช้ไฟล์เดิมถ้าข้อมูลไม่เปลี่ยน) คืน path (None ถ้าไม่มีข้อมูล)"""
+    with apl_partition_lock(apl_partition_dir(plant, year_quarter, operation)):
+        part_dir, manifest = _open_apl_partition(plant, year_quarter, operation)
+        if not manifest['parts']:
+            return None
+        export_path = apl_export_path(plant, year_quarter, operation, manifest['data_seq'])
+        if touch_artifact(export_path):
+            return export_path
+        df = _read_apl_parts(part_dir, manifest)
+
+    output = BytesIO()
+    df.to_excel(output, index=False)
+    acquire_artifact(export_path, EXPORT_TTL_SECONDS)
+    try:
+        tmp_path = tmp_path_for(export_path)
+        with open(tmp_path, 'wb') as fh:
+            fh.write(output.getvalue())
+        os.replace(tmp_path, export_path)
+        register_artifact(export_path, EXPORT_TTL_SECONDS)
+    finally:
+        release_artifact(export_path)
+    print(f"✅ สร้าง {export_path} จาก APL store ({len(df)} แถว)")
+    return export_path
+
+# === APL HTTP ===
+# ใช้ session เดียว (keep-alive + retry) สำหรับทุกงาน และอ่าน JSON array แบบทีละ object
+# จาก stream ลงบัฟเฟอร์ต่อคอลัมน์ ไม่ต้องเก็บทั้ง response text และ list of dict ในหน่วยความจำ
+APL_STREAM_CHUNK = 64 * 1024
+_apl_session = None
+_apl_session_lock = threading.Lock()
+
+def get_apl_session():
+    global _apl_session
+    with _apl_session_lock:
+        if _apl_session is None:
+            retry = Retry(total=APL_API_RETRIES, backoff_factor=1,
+                          status_forcelist=[502, 503, 504], allowed_methods=['GET'])
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=APL_JOB_WORKERS)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _apl_session = session
+        return _apl_session
+
+def iter_json_array(chunks):
+    """คืน element ของ JSON array ระดับบนสุดทีละตัวจาก chunk ของ bytes (UTF-8)
+
+    ตรวจรูปแบบเข้มเท่า json.loads — ขาด comma / comma เกิน / ไม่มี ']' / มีข้อมูลต่อท้าย → ValueError
+    (response ที่ถูกตัดกลางทางจึงไม่ถูกเก็บเป็นผลสำเร็จบางส่วน)
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buf = ''
+    pos = 0
+    # start = รอ '[' / first = รอค่าแรกหรือ ']' / value = รอค่า (หลัง ',') / sep = รอ ',' หรือ ']' / done = จบ array แล้ว
+    state = 'start'
+    chunks = iter(chunks)
+    eof = False
+
+    while True:
+        if not eof:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                buf = buf[pos:] + text_decoder.decode(b'', final=True)
+            else:
+                buf = buf[pos:] + text_decoder.decode(chunk)
+            pos = 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos >= len(buf):
+                break
+            ch = buf[pos]
+            if state == 'done':
+                raise ValueError(f"มีข้อมูลต่อท้าย JSON array: {ch!r}")
+            if state == 'start':
+                if ch != '[':
+                    raise ValueError(f"Unexpected data format: เริ่มด้วย {ch!r} แทน '['")
+                state = 'first'
+                pos += 1
+            elif state == 'sep':
+                if ch == ',':
+                    state = 'value'
+                elif ch == ']':
+                    state = 'done'
+                else:
+                    raise ValueError(f"JSON array: ต้องการ ',' หรือ ']' แต่พบ {ch!r}")
+                pos += 1
+            elif ch == ']' and state == 'first':
+                state = 'done'
+                pos += 1
+            elif ch in ',]':
+                raise ValueError(f"JSON array: ต้องการค่าแต่พบ {ch!r}")
+            else:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    break
+                tail = end
+                while tail < len(buf) and buf[tail] in '0123456789+-.eE':
+                    tail += 1
+                if tail >= len(buf) and not eof:
+                    break  # ค่าที่อยู่ท้ายบัฟเฟอร์อาจยังไม่ครบ (เช่นตัวเลข "1." / "1e") รอ chunk ถัดไป
+                pos = end
+                state = 'sep'
+                yield item
+
+        if eof:
+            if state != 'done':
+                raise ValueError("JSON array ไม่สมบูรณ์")
+            return
+
+def read_apl_columns(chunks, columns=APL_COLUMNS):
+    """อ่าน JSON array ของแถว APL ลงบัฟเฟอร์ต่อคอลัมน์ คืน (buffers, คอลัมน์ที่พบ, จำนวนแถว)
+
+    คอลัมน์ตัวเลข (APL_NUMERIC_COLUMNS) เก็บใน array('d') แล้วคืนเป็น numpy float64 (ค่าว่าง = NaN)
+    ถ้าพบค่าที่ไม่ใช่ตัวเลข คอลัมน์นั้นกลับเป็น list ของ object (ค่าว่างเป็น None) — คอลัมน์ข้อความเป็น list
+    ที่ใช้ str object เดียวต่อค่าที่ซ้ำกัน (BOM / operation / model ซ้ำกันเกือบทุกแถว)
+    """
+    numeric = {col: array('d') for col in columns if col in APL_NUMERIC_COLUMNS}
+    buffers = {col: [] for col in columns if col not in numeric}
+    interned = {col: {} for col in columns if col not in numeric and col != APL_TIME_COLUMN}
+    nan = float('nan')
+    seen = set()
+    count = 0
+    for row in iter_json_array(chunks):
+        if not isinstance(row, dict):
+            raise ValueError(f"Unexpected row format: {type(row)}")
+        seen.update(col for col in columns if col in row)
+        for col in columns:
+            value = row.get(col)
+            buf = numeric.get(col)
+            if buf is not None:
+                if value is None:
+                    buf.append(nan)
+                    continue
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    buf.append(value)
+                    continue
+                buffers[col] = [None if v != v else v for v in buf]  # JSON ไม่มี NaN — NaN คือค่าว่าง
+                del numeric[col]
+            elif isinstance(value, str) and col in interned:
+                value = interned[col].setdefault(value, value)
+            buffers[col].append(value)
+        count += 1
+
+    for col, buf in numeric.items():
+        buffers[col] = np.frombuffer(buf, dtype=np.float64)
+    return {col: buffers[col] for col in columns}, seen, count
+
+def run_apl(full_url, plant, year_quarter, operation, progress=None, since=None):
+    report = progress or (lambda stage: None)
     try:
+        report('fetching')
         print(f"🌐 Fetching: {full_url}")
-        response = requests.get(full_url, headers={"Accept": "application/json"})
+        with get_apl_session().get(full_url, headers={"Accept": "application/json"},
+                                   stream=True, timeout=APL_API_TIMEOUT) as response:
+            print(f"🔎 Status: {response.status_code}")
 
-        print(f"🔎 Status: {response.status_code}")
-        print(f"🧾 Raw Response Text (first 300 chars): {response.text[:300]}")
+            if response.status_code != 200:
+                print(f"🧾 Raw Response Text (first 300 chars): {response.text[:300]}")
+                print(f"❌ API Error: {response.status_code}")
+                return False, None
 
-        if response.status_code == 200:
+            report('parsing')
             try:
-                data = response.json()
-            except Exception as json_err:
+                columns, seen_cols, row_count = read_apl_columns(response.iter_content(chunk_size=APL_STREAM_CHUNK))
+            except ValueError as json_err:
                 print(f"❌ JSON decode error: {json_err}")
                 return False, None
 
-            if not isinstance(data, list):
-                print(f"⚠️ Unexpected data format: {type(data)}")
-                return False, None
+        print(f"✅ Loaded {row_count} rows")
 
-            df_new = pd.DataFrame(data)
-
-            print(f"✅ Loaded {len(df_new)} rows")
+        # ตรวจว่าคอลัมน์ครบไหม
+        missing_cols = [col for col in APL_COLUMNS if col not in seen_cols]
+        if missing_cols:
+            print(f"❌ Missing columns in data: {missing_cols}")
+            return False, None
 
-            # ตรวจว่าคอลัมน์ครบไหม
-            required_cols = ['date_time_start', 'bom_no', 'operation', 'optn_code', 'Machine_Model', 'UPH']
-            missing_cols = [col for col in required_cols if col not in df_new.columns]
-            if missing_cols:
-                print(f"❌ Missing columns in data: {missing_cols}")
-                return False, None
+        df_new = pd.DataFrame(columns, columns=APL_COLUMNS)
 
-            df_new = df_new[required_cols]
-
-            os.makedirs("data", exist_ok=True)
-            filename = f"APL_{plant}_{year_quarter}_{operation.replace(' ', '_')}.xlsx"
-            save_path = os.path.join("data", filename)
-
-            if os.path.exists(save_path):
-                df_old = pd.read_excel(save_path)
-                df_combined = pd.concat([df_old, df_new], ignore_index=True)
-                df_combined = df_combined.drop_duplicates(
-                    subset=['date_time_start', 'bom_no', 'operation', 'optn_code', 'Machine_Model'],
-                    keep='last'
-                )
-                df_combined.to_excel(save_path, index=False)
-                print(f"✅ Updated and saved: {save_path}")
-            else:
-                df_new.to_excel(save_path, index=False)
-                print(f"✅ Saved new APL to: {save_path}")
+        if since is not None:
+            # เก็บเฉพาะแถวที่ไม่เก่ากว่า watermark (เวลาเท่ากันอาจเป็นแถวใหม่ — แถวซ้ำจะถูกตัดตอนรวม)
+            times = apl_times(df_new['date_time_start'])
+            df_new = df_new[(times.isna() | (times >= since)).to_numpy()]
+            print(f"🕒 ข้อมูลใหม่ตั้งแต่ {since}: {len(df_new)} แถว")
 
-            return True, save_path
-        else:
-            print(f"❌ API Error: {response.status_code}")
+        report('saving')
+        if not append_apl_rows(plant, year_quarter, operation, df_new):
+            print("❌ ไม่มีข้อมูล APL ของ partition นี้")
             return False, None
+        # หน้ารายงานอ่าน partition ผ่านชื่อ APL_*.xlsx ในโฟลเดอร์ data (ไม่ต้องสร้างไฟล์จริง)
+        return True, os.path.join(DATA_FOLDER, apl_filename(plant, year_quarter, operation))
 
     except Exception as e:
         print(f"❌ Exception during API call: {e}")
         return False, None
     
-@app.route("/", methods=['GET', 'POST'])
-def select_bom():
-    all_files = [f for f in os.listdir(DATA_FOLDER)
-                 if f.endswith(('.csv', '.xlsx')) and not f.startswith('~$')]
+# === File classification index ===
+# เก็บผลการจัดกลุ่มไฟล์ (wb / da / pnp) ต่อเวอร์ชันของไฟล์ไว้ใน cache/file_index.json
+# หน้าแรกจึงไม่ต้องเปิด workbook ทุกครั้ง จะอ่านเฉพาะไฟล์ใหม่หรือไฟล์ที่ถูกแก้ไข
+_file_index = None
+_file_index_lock = threading.Lock()
+
+def list_data_files():
+    return [f for f in watched_files(DATA_FOLDER)
+            if f.endswith(('.csv', '.xlsx')) and not f.startswith('~$')]
+
+def classify_data_file(path):
+    """อ่าน 10 แถวแรกแล้วดูว่าเป็นข้อมูล WB / PNP / DA"""
+    if apl_store_partition(path) is not None:
+        df = read_dataset(path).head(10)
+    elif path.endswith('.csv'):
+        df = pd.read_csv(path, nrows=10)
+    else:
+        df = pd.read_excel(path, nrows=10)
 
-    wb_files, da_files, pnp_files = [], [], []
+    content = ' '.join(df.astype(str).fillna('').values.ravel()).upper()
+    return {
+        'wb': any(k in content for k in ['WB', 'LEAD']),
+        'pnp': any(k in content for k in ['PNP', 'PKG']),
+        'da': any(k in content for k in ['DA', 'DIE']),
+    }
 
-    for file in all_files:
-        path = os.path.join(DATA_FOLDER, file)
-        try:
-            if file.endswith('.csv'):
-                df = pd.read_csv(path, nrows=10)
-            else:
-                df = pd.read_excel(path, nrows=10)
+def _load_file_index():
+    try:
+        with open(FILE_INDEX_PATH, encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def _save_file_index(index):
+    tmp_path = tmp_path_for(FILE_INDEX_PATH)
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(index, fh, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, FILE_INDEX_PATH)
+
+def get_file_index():
+    """คืนค่า {ชื่อไฟล์: entry} ของไฟล์ใน DATA_FOLDER โดยอัปเดตเฉพาะไฟล์ที่เปลี่ยน"""
+    global _file_index
+    files = list_data_files()
+
+    with _file_index_lock:
+        if _file_index is None:
+            _file_index = _load_file_index()
+
+        changed = False
+        for file in files:
+            path = os.path.join(DATA_FOLDER, file)
+            try:
+                version = list(get_file_version(path))
+            except OSError:
+                continue
 
-            content = ' '.join(df.astype(str).fillna('').values.ravel()).upper()
+            entry = _file_index.get(file)
+            if entry and entry.get('version') == version:
+                continue
 
-            if any(k in content for k in ['WB', 'LEAD']):
-                wb_files.append(file)
-            if any(k in content for k in ['PNP', 'PKG']):
-                pnp_files.append(file)
-            if any(k in content for k in ['DA', 'DIE']):
-                da_files.append(file)
+            entry = {'version': version, 'display_name': os.path.splitext(file)[0],
+                     'wb': False, 'pnp': False, 'da': False}
+            try:
+                entry.update(classify_data_file(path))
+            except Exception as e:
+                print(f"❌ Error reading {file}: {e}")
+                entry['error'] = str(e)
+            _file_index[file] = entry
+            changed = True
 
-        except Exception as e:
-            print(f"❌ Error reading {file}: {e}")
+        for file in [f for f in _file_index if f not in files]:
+            del _file_index[file]
+            changed = True
+
+        if changed:
+            try:
+                _save_file_index(_file_index)
+            except OSError as e:
+                print(f"⚠️ บันทึก file index ไม่สำเร็จ: {e}")
+
+        return {f: dict(_file_index[f]) for f in files if f in _file_index}
+
+@on_data_change
+def _invalidate_file_index(events):
+    with _file_index_lock:
+        if _file_index is None:
+            return
+        for e in events:
+            if e['folder'] == os.path.normpath(DATA_FOLDER):
+                _file_index.pop(e['file'], None)
+
+@app.route("/", methods=['GET', 'POST'])
+def select_bom():
+    file_index = get_file_index()
+
+    wb_files = [f for f, entry in file_index.items() if entry['wb']]
+    da_files = [f for f, entry in file_index.items() if entry['da']]
+    pnp_files = [f for f, entry in file_index.items() if entry['pnp']]
 
     # รวมไฟล์ทั้งหมดที่อยู่ในกลุ่มต่าง ๆ ไว้ใน other_files
-    other_files = list(set(wb_files + da_files + pnp_files))
+    other_files = [f for f, entry in file_index.items() if entry['wb'] or entry['da'] or entry['pnp']]
 
     # เตรียมชื่อแสดงผล
-    wb_display_names = [os.path.splitext(f)[0] for f in wb_files]
-    da_display_names = [os.path.splitext(f)[0] for f in da_files]
-    pnp_display_names = [os.path.splitext(f)[0] for f in pnp_files]
-    other_display_names = [os.path.splitext(f)[0] for f in other_files]
+    wb_display_names = [file_index[f]['display_name'] for f in wb_files]
+    da_display_names = [file_index[f]['display_name'] for f in da_files]
+    pnp_display_names = [file_index[f]['display_name'] for f in pnp_files]
+    other_display_names = [file_index[f]['display_name'] for f in other_files]
 
     # แมปชื่อที่แสดงกับชื่อไฟล์จริง
     csv_file_map = {
@@ -967,19 +2692,12 @@ def select_bom():
     selected_plant = None
     selected_year_quarter = None
     selected_panel = None
+    apl_job = None
     bom_list, operation_list, optn_code_list = [], [], []
 
     def read_bom_list(filename):
-        full_path = os.path.join(DATA_FOLDER, filename)
-        if filename.endswith('.csv'):
-            df = pd.read_csv(full_path)
-        else:
-            df = pd.read_excel(full_path)
-        df.columns = df.columns.str.strip().str.lower()
-        bom = df['bom_no'].dropna().unique().tolist() if 'bom_no' in df.columns else []
-        operation = df['operation'].dropna().unique().tolist() if 'operation' in df.columns else []
-        optn_code = df['optn_code'].dropna().unique().tolist() if 'optn_code' in df.columns else []
-        return bom, operation, optn_code
+        facets = get_file_facets(filename)
+        return facet_values(facets, 'bom_no'), facet_values(facets, 'operation'), facet_values(facets, 'optn_code')
 
     if request.method == 'POST':
         selected_plant = request.form.get('plant')
@@ -1021,14 +2739,9 @@ def select_bom():
             bom_list, operation_list, optn_code_list = read_bom_list(selected_file)
 
             if selected_plant and selected_year_quarter and selected_bom and selected_operation:
-                safe_operation = selected_operation.replace(" ", "%20")
-                base_url = f"http://th3sroeeeng4/RTMSAPI/ApiAutoUph/api/data?plant={selected_plant}&year_quarter={selected_year_quarter}&operation={safe_operation}"
-
-                try:
-                    run_apl(base_url, selected_bom)
-                    flash("✅ APL fetched and saved successfully!", "success")
-                except Exception as e:
-                    flash(f"❌ Failed to fetch APL: {e}", "danger")
+                # ส่งงานดึง APL เข้า queue เหมือน /download_apl_excel (URL จาก APL_API_URL) ไม่รอ API ใน request
+                apl_job = _apl_job_view(submit_apl_job(selected_plant, selected_year_quarter, selected_operation))
+                flash(f"⏳ ส่งงานดึง APL แล้ว (job {apl_job['id']})", "info")
 
     return render_template(
         "select_bom.html",
@@ -1074,10 +2787,11 @@ def select_bom():
 
         selected_plant=selected_plant,
         selected_year_quarter=selected_year_quarter,
+        apl_job=apl_job,
     )
 
 def get_csv_file_map():
-    files = [f for f in os.listdir(DATA_FOLDER) if f.endswith('.csv') or f.endswith('.xlsx')]
+    files = [f for f in watched_files(DATA_FOLDER) if f.endswith('.csv') or f.endswith('.xlsx')]
     # สมมติชื่อแสดงคือชื่อไฟล์เหมือนกัน
     csv_file_map = {f: f for f in files}
     return csv_file_map
@@ -1093,16 +2807,162 @@ def clean_text(s):
         return s.strip().replace('\r', '').replace('\n', '')
     return s
 
+def normalize_model(models):
+    """รวมทุกรุ่นที่มีคำว่า WB3100 เป็น WB3100"""
+    return models.where(~models.astype(str).str.contains('WB3100', regex=False), 'WB3100')
+
+def summarize_bom_models(df, model_col):
+    """สรุป UPH หลังตัด Outlier ต่อ (BOM, Normalized Model) ของทั้งไฟล์ในรอบเดียว
+
+    df ต้อง clean คอลัมน์ bom_no / model / UPH แล้ว คืนค่าหนึ่งแถวต่อ (bom_no, Normalized Model)
+    เรียงตาม BOM และตามลำดับรุ่นที่พบก่อนภายใน BOM พร้อมค่าระดับ BOM
+    (จำนวนแถวก่อน/หลังตัด, operation / optn_code แรกที่ไม่ว่าง, มีรุ่น NX-116 หรือไม่)
+    """
+    df_clean = remove_outliers_grouped(df, ['bom_no', model_col])
+    df_clean['Normalized Model'] = normalize_model(df_clean[model_col])
+
+    stats = (
+        df_clean.groupby(['bom_no', 'Normalized Model'], sort=False)
+        .agg(mean=('UPH', 'mean'), rows_after=('UPH', 'size'), first_method=('Outlier_Method', 'first'))
+        .reset_index()
+    )
+
+    per_bom = df.groupby('bom_no', sort=False)
+    bom_info = pd.DataFrame({'count_before': per_bom.size()})
+    bom_info['count_after'] = df_clean.groupby('bom_no', sort=False).size().reindex(bom_info.index, fill_value=0)
+    for col in ['operation', 'optn_code']:
+        bom_info[col] = per_bom[col].first() if col in df.columns else ""
+    bom_info = bom_info.fillna({'operation': "", 'optn_code': ""})
+
+    stats = stats.join(bom_info, on='bom_no')
+    is_nx116 = stats['Normalized Model'].astype(str).str.upper().str.contains('NX-116')
+    stats['has_nx116'] = is_nx116.groupby(stats['bom_no']).transform('any')
+
+    return stats.sort_values('bom_no', kind='stable').reset_index(drop=True)
+
+def resolve_model_packtype(df, packtype_map):
+    """หา assy_pack_type ต่อรุ่นเครื่อง (คอลัมน์ model) ด้วยการ join กับ packtype_map ครั้งเดียว
+
+    ใช้ BOM แรก (ตามลำดับที่พบในไฟล์) ของรุ่นนั้นที่มีใน packtype_map
+    รุ่น NX-116 เป็น TUBE เสมอ ถ้าไม่พบคืน "ไม่พบ packtype"
+    """
+    pairs = df[['model', 'bom_no']].dropna().drop_duplicates()
+    pairs = pairs.assign(assy_pack_type=pairs['bom_no'].map(packtype_map))
+    first_hit = pairs.dropna(subset=['assy_pack_type']).drop_duplicates(subset='model')
+
+    models = pd.Index(df['model'].dropna().unique())
+    result = pd.Series(first_hit['assy_pack_type'].to_numpy(), index=first_hit['model'].to_numpy(), dtype=object)
+    result = result.reindex(models)
+    result = result.where(result.notna() & (result != ""), "ไม่พบ packtype")
+    result[np.asarray(models.astype(str).str.upper().str.contains('NX-116', regex=False), dtype=bool)] = "TUBE"
+    return result
+
+# === BOM summary cache ===
+# ผลสรุปของไฟล์ (ตัด Outlier ต่อ BOM / รวมตาม Package code) ใช้ร่วมกันระหว่าง all_boms และ export_all_boms_excel
+# key = (ไฟล์, version ไฟล์, version ตารางอ้างอิง) — กด export หลังดูหน้า all_boms จึงไม่ต้องอ่านไฟล์และคำนวณใหม่
+# ค่าใน cache ห้ามแก้ไข (route ต้อง copy/assign ก่อนเปลี่ยน)
+SUMMARY_CACHE_MAX_ENTRIES = 8
+_summary_cache = OrderedDict()
+_summary_cache_lock = threading.Lock()
+
+def _build_bom_summary(file_path, refs):
+    def clean_text(s):
+        if pd.isna(s):
+            return s
+        return str(s).replace('\r', '').replace('\n', '').replace('_x000D_', '').strip()
+
+    if file_path.endswith('.csv'):
+        df = read_dataset(file_path, encoding="utf-8-sig")
+    else:
+        df = read_dataset(file_path)
+    df.columns = [col.strip() for col in df.columns]
+
+    model_col = next((col for col in df.columns if col.lower().replace("_", " ") == "machine model"), None)
+    summary = {
+        'model_col': model_col,
+        'has_bom': 'bom_no' in df.columns,
+        'has_uph': 'UPH' in df.columns,
+        'kind': None,
+        'package_stats': None,
+        'package_packtype': None,
+        'stats': None,
+    }
+    if not model_col or not summary['has_uph']:
+        return summary
+
+    df['UPH'] = pd.to_numeric(df['UPH'], errors='coerce')
+    df[model_col] = df[model_col].apply(clean_text)
+
+    if 'Package code' in df.columns:
+        # ไฟล์ที่มี Package code สรุปตาม (package_code, model) โดยไม่ตัด Outlier
+        pkg = pd.DataFrame({
+            'package_code': df['Package code'].astype(str).str.strip(),
+            'model': df[model_col],
+            'uph': df['UPH'],
+        })
+        if summary['has_bom']:
+            pkg['bom_no'] = df['bom_no']
+        pkg = pkg.dropna(subset=['package_code', 'model', 'uph'])
+        summary['kind'] = 'package'
+        summary['package_stats'] = pkg.groupby(['package_code', 'model'])['uph'].agg(['mean', 'std', 'count']).reset_index()
+        if summary['has_bom']:
+            summary['package_packtype'] = resolve_model_packtype(pkg, refs['packtype_map'])
+    elif summary['has_bom']:
+        df['bom_no'] = df['bom_no'].astype(str).apply(clean_text).str.upper()
+        df = df.dropna(subset=['UPH', model_col, 'bom_no'])
+        summary['kind'] = 'bom'
+        summary['stats'] = summarize_bom_models(df, model_col)
+    return summary
+
+def get_bom_summary(selected_file, refs=None):
+    """คืนผลสรุปของไฟล์ใน data (คำนวณครั้งเดียวต่อ version ไฟล์ + version ตารางอ้างอิง)"""
+    refs = refs or get_reference_data()
+    file_path = os.path.join(DATA_FOLDER, selected_file)
+    key = (file_path, get_file_version(file_path), refs['version'])
+
+    with _summary_cache_lock:
+        summary = _summary_cache.get(key)
+        if summary is not None:
+            _summary_cache.move_to_end(key)
+            return summary
+
+    print(f"🧮 สรุปข้อมูลไฟล์ {selected_file}")
+    summary = _build_bom_summary(file_path, refs)
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        # version เก่าของไฟล์เดียวกันไม่ถูกใช้อีก
+        for old in [k for k in _summary_cache if k[0] == file_path and k != key]:
+            del _summary_cache[old]
+        while len(_summary_cache) > SUMMARY_CACHE_MAX_ENTRIES:
+            _summary_cache.popitem(last=False)
+    return summary
+
+@on_data_change
+def _invalidate_bom_summaries(events):
+    changed = {e['path'] for e in events}
+    with _summary_cache_lock:
+        for key in [k for k in _summary_cache if os.path.normcase(os.path.abspath(k[0])) in changed]:
+            del _summary_cache[key]
+
+def all_boms_inputs():
+    """หน้า all_boms ขึ้นกับรายชื่อไฟล์ใน data, ไฟล์ที่เลือก และตารางอ้างอิง packtype / package code"""
+    paths, _ = data_folder_inputs()
+    names = [os.path.basename(p) for p in paths]
+    selected_file = request.values.get('csv_file')
+    if selected_file:
+        paths = [p for p in paths if os.path.basename(p) == selected_file]
+    return paths, (names, get_reference_data()['version'])
+
 @app.route("/all_boms", methods=['GET', 'POST'])
+@conditional_on(all_boms_inputs)
 def all_boms():
-    nobump_df = load_all_nobump_data()
-
     csv_files = sorted([
-        f for f in os.listdir(DATA_FOLDER)
+        f for f in watched_files(DATA_FOLDER)
         if f.endswith(('.csv', '.xlsx')) and not f.startswith('~$')
     ])
 
     selected_file = None
+    error = None
     summary_wb = []
     summary_da = []
     summary_pnp = []
@@ -1113,84 +2973,26 @@ def all_boms():
     def is_pnp_file(filename):
         return 'pnp' in filename.lower()
 
-    def clean_text(s):
-        if pd.isna(s):
-            return s
-        return str(s).replace('\r', '').replace('\n', '').replace('_x000D_', '').strip()
-
-    packtype_df = pd.DataFrame()
-    try:
-        dfs = []
-        for f in os.listdir('packtype'):
-            if f.endswith(('.xlsx', '.xls')) and not f.startswith('~$'):
-                df = pd.read_excel(os.path.join('packtype', f))
-                df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
-                if 'bom_no' in df.columns and 'assy_pack_type' in df.columns:
-                    df = df[['bom_no', 'assy_pack_type']].dropna()
-                    df['bom_no'] = df['bom_no'].astype(str).str.strip().str.upper()
-                    df['assy_pack_type'] = df['assy_pack_type'].astype(str).str.strip()
-                    dfs.append(df)
-        if dfs:
-            packtype_df = pd.concat(dfs, ignore_index=True).drop_duplicates(subset='bom_no')
-    except Exception as e:
-        print(f"❌ โหลด packtype ไม่สำเร็จ: {e}")
+    refs = get_reference_data()
+    packtype_map = refs['packtype_map']
+    packagecode_map = refs['package_code_map']
 
-    packagecode_df = pd.DataFrame()
-    try:
-        dfs = []
-        for f in os.listdir('package code'):
-            if f.endswith(('.xlsx', '.xls')) and not f.startswith('~$'):
-                df = pd.read_excel(os.path.join('package code', f))
-                df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
-                if 'bom_no' in df.columns and 'package_code' in df.columns:
-                    df = df[['bom_no', 'package_code']].dropna()
-                    df['bom_no'] = df['bom_no'].astype(str).str.strip().str.upper()
-                    df['package_code'] = df['package_code'].astype(str).str.strip()
-                    dfs.append(df)
-        if dfs:
-            packagecode_df = pd.concat(dfs, ignore_index=True).drop_duplicates(subset='bom_no')
-    except Exception as e:
-        print(f"❌ โหลด package_code ไม่สำเร็จ: {e}")
-
-    if request.method == 'POST':
-        selected_file = request.form.get('csv_file')
+    if request.values.get('csv_file'):
+        selected_file = request.values.get('csv_file')
         if selected_file and selected_file in csv_files:
-            file_path = os.path.join(DATA_FOLDER, selected_file)
             try:
-                if selected_file.endswith('.csv'):
-                    df = pd.read_csv(file_path, encoding="utf-8-sig")
-                else:
-                    df = pd.read_excel(file_path)
-
-                df.columns = [col.strip() for col in df.columns]
+                summary = get_bom_summary(selected_file, refs)
+                if not summary['model_col']:
+                    return "ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในไฟล์", 400
+                if not summary['has_uph']:
+                    raise KeyError('UPH')
 
-                model_col = next((col for col in df.columns if col.lower().replace("_", " ") == "machine model"), None)
-                if not model_col:
-                    return "ไม่พบคอลัมน์ Machine Model หรือ Machine_Model ในไฟล์"
-
-                df['UPH'] = pd.to_numeric(df['UPH'], errors='coerce')
-                df[model_col] = df[model_col].apply(clean_text)
-
-                if {'bom_no', 'Package code', model_col, 'UPH'}.issubset(df.columns):
-                    df.rename(columns={'Package code': 'package_code', model_col: 'model', 'UPH': 'uph'}, inplace=True)
-                    df['model'] = df['model'].apply(clean_text)
-                    df['package_code'] = df['package_code'].astype(str).str.strip()
-                    df['uph'] = pd.to_numeric(df['uph'], errors='coerce')
-                    df.dropna(subset=['package_code', 'model', 'uph'], inplace=True)
-
-                    grouped = df.groupby(['package_code', 'model'])['uph'].agg(['mean', 'std', 'count']).round(2).reset_index()
+                if summary['kind'] == 'package' and summary['has_bom']:
+                    grouped = summary['package_stats'].round(2)
+                    grouped['assy_pack_type'] = summary['package_packtype'].reindex(grouped['model']).to_numpy()
 
                     for _, row in grouped.iterrows():
-                        assy_pack_val = "TUBE" if "NX-116" in row["model"].upper() else ""
-                        if not assy_pack_val:
-                            matched_bom = df[df['model'] == row['model']]['bom_no'].dropna().unique()
-                            for bom_candidate in matched_bom:
-                                match_pack = packtype_df[packtype_df['bom_no'] == bom_candidate]['assy_pack_type']
-                                if not match_pack.empty:
-                                    assy_pack_val = match_pack.iloc[0]
-                                    break
-                            if not assy_pack_val:
-                                assy_pack_val = "ไม่พบ packtype"
+                        assy_pack_val = row['assy_pack_type']
 
                         summary_pnp.append({
                             "bom": "",
@@ -1221,91 +3023,62 @@ def all_boms():
                     )
 
                 # ✅ กรณีปกติ (มี bom_no)
-                df['bom_no'] = df['bom_no'].astype(str).apply(clean_text).str.upper()
-                df.dropna(subset=['UPH', model_col, 'bom_no'], inplace=True)
-
-                for bom in sorted(df['bom_no'].unique()):
-                    df_bom = df[df['bom_no'] == bom]
-                    df_clean = remove_outliers(df_bom)
+                if not summary['has_bom']:
+                    raise KeyError('bom_no')
 
-                    operation_val = df_bom['operation'].dropna().iloc[0] if 'operation' in df_bom.columns and not df_bom['operation'].dropna().empty else ""
-                    optn_code_val = df_bom['optn_code'].dropna().iloc[0] if 'optn_code' in df_bom.columns and not df_bom['optn_code'].dropna().empty else ""
-
-                    df_clean['Normalized Model'] = df_clean[model_col].apply(
-                        lambda x: 'WB3100' if 'WB3100' in x else x
-                    )
+                if is_wb_file(selected_file):
+                    file_type = 'WB'
+                elif is_pnp_file(selected_file):
+                    file_type = 'PNP'
+                else:
+                    file_type = 'DA'
 
-                    summary_after = df_clean.groupby("Normalized Model")["UPH"].agg(['mean']).round(2)
-                    bom_nobump_df = nobump_df[nobump_df['BOM_NO'] == bom]
+                stats = summary['stats'].assign(mean_after=summary['stats']['mean'].round(2))
 
-                    if is_wb_file(selected_file):
-                        file_type = 'WB'
-                    elif is_pnp_file(selected_file):
-                        file_type = 'PNP'
-                    else:
-                        file_type = 'DA'
+                for rec in stats.to_dict(orient='records'):
+                    bom = rec['bom_no']
 
                     if file_type == 'WB':
-                        no_bump_val = bom_nobump_df['NO_BUMP'].dropna().iloc[0] if not bom_nobump_df['NO_BUMP'].dropna().empty else 0
-                        number_required_val = (
-                            bom_nobump_df['NUMBER_REQUIRED'].dropna().iloc[0]
-                            if 'NUMBER_REQUIRED' in bom_nobump_df.columns and not bom_nobump_df['NUMBER_REQUIRED'].dropna().empty
-                            else 0
-                        )
-                        UNIT = adjusted_val = (no_bump_val / 2) + number_required_val if (no_bump_val or number_required_val) else 1
+                        no_bump_val, number_required_val = lookup_nobump(bom, refs)
+                        no_bump_val = no_bump_val if no_bump_val is not None else 0
+                        number_required_val = number_required_val if number_required_val is not None else 0
+                        UNIT = (no_bump_val / 2) + number_required_val if (no_bump_val or number_required_val) else 1
                     else:
                         UNIT = 1
 
-                    assy_pack_val = ""
-                    package_code_val = ""
-                    if file_type == "PNP":
-                        if any(df_clean['Normalized Model'].str.upper().str.contains("NX-116")):
-                            assy_pack_val = "TUBE"
-                        else:
-                            match_pack = packtype_df[packtype_df['bom_no'] == bom]['assy_pack_type']
-                            assy_pack_val = match_pack.iloc[0] if not match_pack.empty else "ไม่พบ packtype"
-
-                        match_code = packagecode_df[packagecode_df['bom_no'] == bom]['package_code']
-                        package_code_val = match_code.iloc[0] if not match_code.empty else "ไม่พบ package_code"
-
-                    for model in df_clean['Normalized Model'].unique():
-                        df_clean_model = df_clean[df_clean['Normalized Model'] == model]
-                        uph_mean = summary_after.loc[model]['mean'] if model in summary_after.index else 0
-
-                        no_outlier_removed = (
-                            'Outlier_Method' in df_clean_model.columns and
-                            df_clean_model['Outlier_Method'].iloc[0] == 'ไม่ตัด (ข้อมูลน้อย)'
-                        )
-                        outlier_note = f"ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: {len(df_clean_model)}" if no_outlier_removed else ""
-
-                        eff_ratio = truncate(uph_mean / UNIT, 3) if UNIT else 0
-
-                        row = {
-                            "bom": bom,
-                            "model": model,
-                            "mean_after": uph_mean,
-                            "adjusted_mean": round(UNIT, 2),
-                            "wire_per_unit": round(UNIT, 2),
-                            "efficiency_ratio": eff_ratio,
-                            "no_outlier_removed": outlier_note,
-                            "operation": operation_val,
-                            "optn_code": optn_code_val
-                        }
-
-                        if file_type == 'WB':
-                            row["wb_specific"] = "ข้อมูลเฉพาะ WB"
-                            summary_wb.append(row)
-                        elif file_type == 'PNP':
-                            row["pnp_specific"] = "ข้อมูลเฉพาะ PNP"
-                            row["assy_pack_type"] = assy_pack_val
-                            row["package_code"] = package_code_val
-                            summary_pnp.append(row)
-                        else:
-                            row["da_specific"] = "ข้อมูลเฉพาะ DA"
-                            summary_da.append(row)
+                    no_outlier_removed = rec['first_method'] == OUTLIER_LABEL_SMALL
+                    outlier_note = f"ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: {rec['rows_after']}" if no_outlier_removed else ""
+
+                    eff_ratio = truncate(rec['mean_after'] / UNIT, 3) if UNIT else 0
+
+                    row = {
+                        "bom": bom,
+                        "model": rec['Normalized Model'],
+                        "mean_after": rec['mean_after'],
+                        "adjusted_mean": round(UNIT, 2),
+                        "wire_per_unit": round(UNIT, 2),
+                        "efficiency_ratio": eff_ratio,
+                        "no_outlier_removed": outlier_note,
+                        "operation": rec['operation'],
+                        "optn_code": rec['optn_code']
+                    }
+
+                    if file_type == 'WB':
+                        row["wb_specific"] = "ข้อมูลเฉพาะ WB"
+                        summary_wb.append(row)
+                    elif file_type == 'PNP':
+                        row["pnp_specific"] = "ข้อมูลเฉพาะ PNP"
+                        row["assy_pack_type"] = "TUBE" if rec['has_nx116'] else packtype_map.get(bom, "ไม่พบ packtype")
+                        row["package_code"] = packagecode_map.get(bom, "ไม่พบ package_code")
+                        summary_pnp.append(row)
+                    else:
+                        row["da_specific"] = "ข้อมูลเฉพาะ DA"
+                        summary_da.append(row)
 
             except Exception as e:
                 print(f"❌ Error processing file {selected_file}: {e}")
+                error = f"ประมวลผลไฟล์ {selected_file} ไม่สำเร็จ: {e}"
+                summary_wb, summary_da, summary_pnp = [], [], []
 
     selected_file_display = os.path.splitext(selected_file)[0] if selected_file else None
 
@@ -1345,66 +3118,59 @@ def all_boms():
         package_aggregated=package_aggregated.to_dict(orient='records'),
         file_list=csv_files,
         selected_file=selected_file,
-        selected_file_display=selected_file_display
-    )
+        selected_file_display=selected_file_display,
+        error=error
+    ), 500 if error else 200  # หน้า error ไม่ได้ ETag (ดู conditional_on)
 
 def clean_text(s):
     if isinstance(s, str):
         return s.strip().replace('\r', '').replace('\n', '')
     return s
 
-@app.route("/export_all_boms_excel", methods=['POST'])
-def export_all_boms_excel():
-    try:
-        def clean_text(s):
-            if pd.isna(s):
-                return s
-            return str(s).replace('\r', '').replace('\n', '').replace('_x000D_', '').strip()
+def all_boms_export_path(selected_file, refs):
+    """path ของไฟล์ export ใน cache/exports — ชื่อขึ้นกับ version ไฟล์ข้อมูล ตารางอ้างอิง และโค้ด"""
+    version = get_file_version(os.path.join(DATA_FOLDER, selected_file))
+    digest = hashlib.sha1(repr((selected_file, version, refs['version'], CODE_VERSION)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(EXPORT_CACHE_FOLDER, f"{safe_filename(os.path.splitext(selected_file)[0])}_{digest}.xlsx")
 
-        def safe_first(series):
-            return series.dropna().iloc[0] if not series.dropna().empty else ""
+def send_export_artifact(path, download_name):
+    # ถือ ref ไว้ระหว่างเปิดไฟล์ (send_file เปิดไฟล์ทันที ลบทีหลังได้โดยไม่กระทบการส่ง)
+    acquire_artifact(path, EXPORT_TTL_SECONDS)
+    try:
+        return send_file(os.path.abspath(path), download_name=download_name, as_attachment=True)
+    finally:
+        release_artifact(path)
 
-        selected_file = request.form.get('csv_file')
+@app.route("/export_all_boms_excel", methods=['GET', 'POST'])
+@conditional_on(all_boms_inputs)
+def export_all_boms_excel():
+    try:
+        selected_file = request.values.get('csv_file')
         if not selected_file:
             return "No file selected", 400
 
-        file_path = os.path.join(DATA_FOLDER, selected_file)
-        if selected_file.endswith('.csv'):
-            df = pd.read_csv(file_path, encoding="utf-8-sig")
-        else:
-            df = pd.read_excel(file_path)
+        refs = get_reference_data()
+        download_name = f"{os.path.splitext(selected_file)[0]}_summary.xlsx"
+        export_path = all_boms_export_path(selected_file, refs)
+        if touch_artifact(export_path):
+            return send_export_artifact(export_path, download_name)
 
-        df.columns = [c.strip() for c in df.columns]
-        model_col = next((c for c in df.columns if c.lower().replace("_", " ") == "machine model"), None)
-        if not model_col:
+        summary = get_bom_summary(selected_file, refs)
+        if not summary['model_col']:
             return "ไม่พบคอลัมน์ Machine Model", 400
-        df[model_col] = df[model_col].apply(clean_text)
-
-        has_bom = 'bom_no' in df.columns
-        has_pkg = 'Package code' in df.columns
-        has_uph = 'UPH' in df.columns
-        if not has_uph:
+        if not summary['has_uph']:
             return "ไม่พบคอลัมน์ UPH", 400
-        df['UPH'] = pd.to_numeric(df['UPH'], errors='coerce')
 
         file_type = 'WB' if 'wb' in selected_file.lower() else 'PNP' if 'pnp' in selected_file.lower() else 'DA'
 
         summary_wb, summary_da, summary_pnp = [], [], []
 
-        if has_bom:
-            df['bom_no'] = df['bom_no'].astype(str).apply(clean_text).str.upper()
-
-        if has_pkg:
-            df['package_code'] = df['Package code'].astype(str).str.strip()
-            df['Normalized Model'] = df[model_col].apply(clean_text)
-            df.dropna(subset=['package_code', 'Normalized Model', 'UPH'], inplace=True)
-
-            grouped = df.groupby(['package_code', 'Normalized Model'])['UPH'].agg(['mean']).reset_index()
-            for _, row in grouped.iterrows():
-                assy_pack_val = "TUBE" if "NX-116" in row['Normalized Model'].upper() else "ไม่พบ packtype"
+        if summary['kind'] == 'package':
+            for _, row in summary['package_stats'].iterrows():
+                assy_pack_val = "TUBE" if "NX-116" in row['model'].upper() else "ไม่พบ packtype"
                 summary_pnp.append({
                     "bom": "",
-                    "model": row['Normalized Model'],
+                    "model": row['model'],
                     "optn_code": "",
                     "operation": "",
                     "Wire Per Hour": round(row['mean'], 2),
@@ -1414,51 +3180,27 @@ def export_all_boms_excel():
                     "assy_pack_type": assy_pack_val,
                     "package_code": row['package_code']
                 })
-        elif has_bom:
-            nobump_df = load_all_nobump_data()
-            packtype_df, package_code_df = pd.DataFrame(), pd.DataFrame()
+        elif summary['kind'] == 'bom':
+            packtype_map = refs['packtype_map']
+            package_code_map = refs['package_code_map']
 
-            try:
-                packtype_df = pd.concat([
-                    pd.read_excel(os.path.join('packtype', f))[['bom_no', 'assy_pack_type']]
-                    .dropna().assign(
-                        bom_no=lambda x: x['bom_no'].astype(str).str.strip().str.upper(),
-                        assy_pack_type=lambda x: x['assy_pack_type'].astype(str).str.strip()
-                    )
-                    for f in os.listdir('packtype')
-                    if f.endswith(('.xlsx', '.xls')) and not f.startswith('~$')
-                ], ignore_index=True).drop_duplicates(subset='bom_no')
-            except: pass
+            stats = summary['stats'].sort_values(['bom_no', 'Normalized Model'], kind='stable')
 
-            try:
-                package_code_df = pd.concat([
-                    pd.read_excel(os.path.join('package code', f))[['bom_no', 'package_code']]
-                    .dropna().assign(
-                        bom_no=lambda x: x['bom_no'].astype(str).str.strip().str.upper(),
-                        package_code=lambda x: x['package_code'].astype(str).str.strip()
-                    )
-                    for f in os.listdir('package code')
-                    if f.endswith(('.xlsx', '.xls')) and not f.startswith('~$')
-                ], ignore_index=True).drop_duplicates(subset='bom_no')
-            except: pass
-
-            df.dropna(subset=['UPH', model_col, 'bom_no'], inplace=True)
-
-            for bom in sorted(df['bom_no'].unique()):
-                df_bom = df[df['bom_no'] == bom]
-                df_clean = remove_outliers(df_bom)
-                df_clean['Normalized Model'] = df_clean[model_col].apply(lambda x: 'WB3100' if 'WB3100' in x else x)
-                summary = df_clean.groupby('Normalized Model')['UPH'].agg(['mean']).reset_index()
-
-                count_before = len(df_bom)
-                count_after = len(df_clean)
+            for rec in stats.to_dict(orient='records'):
+                bom = rec['bom_no']
+                count_before = rec['count_before']
+                count_after = rec['count_after']
                 if count_before < 15:
                     no_outlier_removed = f"ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: {count_before}"
                 else:
                     no_outlier_removed = f"ตัด Outlier — ก่อน: {count_before} หลัง: {count_after}"
 
-                no_bump_val = safe_first(nobump_df[nobump_df['BOM_NO'] == bom]['NO_BUMP']) if file_type == 'WB' else 0
-                number_required_val = safe_first(nobump_df[nobump_df['BOM_NO'] == bom]['NUMBER_REQUIRED']) if file_type == 'WB' else 0
+                if file_type == 'WB':
+                    no_bump_val, number_required_val = lookup_nobump(bom, refs)
+                    no_bump_val = no_bump_val if no_bump_val is not None else ""
+                    number_required_val = number_required_val if number_required_val is not None else ""
+                else:
+                    no_bump_val, number_required_val = 0, 0
 
                 try:
                     no_bump_val = float(no_bump_val) if no_bump_val else 0
@@ -1466,32 +3208,28 @@ def export_all_boms_excel():
                 except:
                     no_bump_val, number_required_val = 0, 0
 
-                UNIT = adjusted_val = (no_bump_val / 2) + number_required_val if (no_bump_val or number_required_val) else 1
+                UNIT = (no_bump_val / 2) + number_required_val if (no_bump_val or number_required_val) else 1
 
-                for _, row in summary.iterrows():
-                    model = row['Normalized Model']
-                    mean_uph = row['mean']
-                    eff_ratio = round(mean_uph / UNIT, 3)
+                mean_uph = rec['mean']
+                result = {
+                    "bom": bom,
+                    "model": rec['Normalized Model'],
+                    "optn_code": rec['optn_code'],
+                    "operation": rec['operation'],
+                    "Wire Per Hour": round(mean_uph, 2),
+                    "wire_per_unit": round(UNIT, 2),
+                    "UPH": round(mean_uph / UNIT, 3),
+                    "no_outlier_removed": no_outlier_removed
+                }
 
-                    result = {
-                        "bom": bom,
-                        "model": model,
-                        "optn_code": safe_first(df_bom['optn_code']) if 'optn_code' in df_bom else "",
-                        "operation": safe_first(df_bom['operation']) if 'operation' in df_bom else "",
-                        "Wire Per Hour": round(mean_uph, 2),
-                        "wire_per_unit": round(UNIT, 2),
-                        "UPH": eff_ratio,
-                        "no_outlier_removed": no_outlier_removed
-                    }
-
-                    if file_type == 'WB':
-                        summary_wb.append(result)
-                    elif file_type == 'PNP':
-                        result["assy_pack_type"] = safe_first(packtype_df[packtype_df['bom_no'] == bom]['assy_pack_type']) if bom in packtype_df['bom_no'].values else "ไม่พบ packtype"
-                        result["package_code"] = safe_first(package_code_df[package_code_df['bom_no'] == bom]['package_code']) if bom in package_code_df['bom_no'].values else "ไม่พบ package_code"
-                        summary_pnp.append(result)
-                    else:
-                        summary_da.append(result)
+                if file_type == 'WB':
+                    summary_wb.append(result)
+                elif file_type == 'PNP':
+                    result["assy_pack_type"] = packtype_map.get(bom, "ไม่พบ packtype")
+                    result["package_code"] = package_code_map.get(bom, "ไม่พบ package_code")
+                    summary_pnp.append(result)
+                else:
+                    summary_da.append(result)
 
         output = BytesIO()
         with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
@@ -1502,8 +3240,16 @@ def export_all_boms_excel():
             if summary_pnp:
                 pd.DataFrame(summary_pnp).to_excel(writer, sheet_name='PNP Summary', index=False)
 
-        output.seek(0)
-        return send_file(output, download_name=f"{os.path.splitext(selected_file)[0]}_summary.xlsx", as_attachment=True)
+        acquire_artifact(export_path, EXPORT_TTL_SECONDS)
+        try:
+            tmp_path = tmp_path_for(export_path)
+            with open(tmp_path, 'wb') as fh:
+                fh.write(output.getvalue())
+            os.replace(tmp_path, export_path)
+            register_artifact(export_path, EXPORT_TTL_SECONDS)
+        finally:
+            release_artifact(export_path)
+        return send_export_artifact(export_path, download_name)
 
     except Exception as e:
         return f"Error exporting summary: {e}", 500
@@ -1512,21 +3258,285 @@ def standardize_columns(df):
     df.columns = [str(c).strip() for c in df.columns]
     return df
 
+def propagate_cuc_speed(df, op_col, machine_col):
+    """คืน SPEED ของแต่ละแถว PRO = Speed ของ CUC ล่าสุด (ที่ไม่ว่าง) ก่อนหน้าบนเครื่องเดียวกัน
+
+    ใช้ forward-fill ต่อเครื่องครั้งเดียว (linear) แทนการกรอง df.loc[:i - 1] ทุกแถว
+    แถวอื่น / PRO ที่ไม่พบ CUC ก่อนหน้าเป็น None
+    """
+    cuc_speed = df['Speed'].where(df[op_col] == 'CUC')
+    last_speed = cuc_speed.groupby(df[machine_col], sort=False).ffill()
+    last_speed = last_speed.where((df[op_col] == 'PRO') & last_speed.notna())
+    return pd.Series([v if pd.notna(v) else None for v in last_speed.astype(object)], index=df.index, dtype=object)
+
+FRAME_ERROR_OPS = ['ERRSET', 'ERRRCV', 'ERRCLR', 'DMC', 'DMW']
+
+def compute_strip_groups(df, op_col, time_col, step_col, machine_col):
+    """แบ่งกลุ่ม strip ของแถว PRO และคำนวณ Group / sec / min / Reverse / Average / Data Point ลง df
+
+    กลุ่มต่อเนื่องของ PRO (ข้าม step ว่าง) ตัดเมื่อเปลี่ยนเครื่องหรือเจอ step = 1
+    แล้วแยกย่อยตามวัน ใช้ตัวนับ error สะสมและ parse เวลาครั้งเดียวทั้งคอลัมน์ (df ต้อง reset_index แล้ว)
+    """
+    pro = df[(df[op_col] == 'PRO') & df[step_col].notna()]
+    if pro.empty:
+        return
+
+    steps = pro[step_col]
+    machines = pro[machine_col]
+    # เริ่มกลุ่มใหม่เมื่อเป็นแถวแรก / เปลี่ยนเครื่อง / แถวก่อนหน้าเป็น step = 1
+    starts = ~(machines == machines.shift()) | steps.shift().eq(1)
+    strip_id = starts.cumsum()
+    strip_size = strip_id.map(strip_id.value_counts())
+
+    rows = pd.DataFrame({'strip': strip_id, 'date': df.loc[pro.index, 'DateOnly'], 'step': steps})
+    rows = rows[(strip_size > 1) & rows['date'].notna()]
+    if rows.empty:
+        return
+
+    # กลุ่มย่อยตาม (strip, วัน) — เลขกลุ่มนับแยกต่อวันตามลำดับ strip
+    subs = rows.groupby(['strip', 'date']).size()
+    subs = subs[subs >= 2].to_frame('size')
+    if subs.empty:
+        return
+    subs['number'] = subs.groupby(level='date').cumcount() + 1
+    subs['name'] = [f"Group {n} ({d})" for (_, d), n in zip(subs.index, subs['number'])]
+    subs['sub_id'] = np.arange(len(subs))
+
+    rows = rows.join(subs, on=['strip', 'date'], how='inner').sort_values('sub_id', kind='stable')
+    sub_ids = rows['sub_id'].to_numpy()
+    pos = rows.index.to_numpy()
+
+    is_last = rows['sub_id'].ne(rows['sub_id'].shift(-1)).to_numpy()
+    last_step = pd.Series(rows['step'].to_numpy()[is_last], index=rows['sub_id'].to_numpy()[is_last])
+    valid = (rows['sub_id'].map(last_step) == 1).to_numpy()
+
+    df.loc[pos[~valid], 'Group'] = ("Invalid " + rows['name'][~valid]).to_numpy()
+    df.loc[pos[valid], 'Group'] = rows['name'][valid].to_numpy()
+
+    # คู่ PRO ติดกันภายในกลุ่มที่ valid
+    has_prev = np.r_[False, sub_ids[1:] == sub_ids[:-1]] & valid
+    curr = pos[has_prev]
+    prev = pos[np.flatnonzero(has_prev) - 1]
+
+    step_values = df[step_col].to_numpy()
+    out_of_order = step_values[curr] > step_values[prev]
+
+    error_count = df[op_col].astype(str).str.upper().isin(FRAME_ERROR_OPS).to_numpy().cumsum()
+    machine_error = ~out_of_order & (error_count[curr] > error_count[prev])
+
+    times = pd.to_datetime(df[time_col], format='%H:%M:%S', errors='coerce')
+    t1 = times.iloc[prev].reset_index(drop=True)
+    t2 = times.iloc[curr].reset_index(drop=True)
+    timed = ~out_of_order & ~machine_error & t1.notna().to_numpy() & t2.notna().to_numpy()
+
+    for label, mask in [('Out of Order', out_of_order), ('Machine Error', machine_error)]:
+        df.loc[curr[mask], ['sec', 'min', 'Reverse']] = label
+
+    if timed.any():
+        t1, t2 = t1[timed], t2[timed]
+        delta_sec = (t2 - t1).dt.total_seconds().abs()
+        delta_str = pd.to_timedelta(delta_sec, unit='s').astype(str).str.split(' ').str[-1]
+        formula = t2.dt.time.astype(str) + " - " + t1.dt.time.astype(str) + " = " + delta_str
+        df.loc[curr[timed], 'sec'] = delta_sec.to_numpy()
+        df.loc[curr[timed], 'min'] = delta_str.to_numpy()
+        df.loc[curr[timed], 'Reverse'] = formula.to_numpy()
+
+        # ค่าเฉลี่ยต่อกลุ่ม (บวกตามลำดับแบบเดียวกับ sum() ของ list)
+        delta_group = sub_ids[has_prev][timed]
+        totals = np.bincount(delta_group, weights=delta_sec.to_numpy(), minlength=len(subs))
+        counts = np.bincount(delta_group, minlength=len(subs))
+        last_pos = pos[is_last]
+        for sub, (total, count) in enumerate(zip(totals.tolist(), counts.tolist())):
+            if count:
+                df.at[last_pos[sub], 'Average'] = f"Average-Group = {round(total / count, 4)} sec/strip"
+                df.at[last_pos[sub], 'Data Point'] = str(count)
+
+def station_zscore_keep(codes, values, limit=3):
+    """คืน mask แถวที่ |z-score| <= limit ภายในแต่ละกลุ่ม (codes จาก ngroup) แบบเดียวกับ scipy zscore
+
+    คำนวณ mean/std ทุกกลุ่มพร้อมกันด้วย bincount — กลุ่มที่ค่าใกล้ขอบ (|z| ≈ limit หรือ std ≈ 0)
+    คำนวณซ้ำด้วย zscore เพื่อให้ผลตรงกับเดิมทุกบิต
+    """
+    keep = np.zeros(len(values), dtype=bool)
+    if len(values) == 0:
+        return keep
+
+    counts = np.bincount(codes)
+    mean = np.bincount(codes, weights=values) / counts
+    dev = values - mean[codes]
+    std = np.sqrt(np.bincount(codes, weights=dev * dev) / counts)
+    eps = np.finfo(float).eps
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.abs(dev / std[codes])
+    flat = std <= eps * np.abs(mean)
+    keep = (z <= limit) & ~flat[codes]
+
+    borderline = (np.abs(z - limit) <= 1e-8 * limit) | (std <= 1e3 * eps * np.abs(mean))[codes]
+    for g in np.unique(codes[borderline]):
+        rows = np.flatnonzero(codes == g)
+        keep[rows] = np.abs(zscore(values[rows], nan_policy='omit')) <= limit
+    return keep
+
+# === Frame-stock result store ===
+# ผลของ frame_stock เก็บแยกตาม (session ผู้ใช้, ไฟล์) — หลายคนประมวลผล/export พร้อมกันได้โดยไม่ทับกัน
+# เก็บในหน่วยความจำแบบ LRU ไม่เกิน FRAME_RESULT_MEMORY_MB ผลที่ล้นงบเขียนลง cache/frame_results แล้วโหลดกลับเมื่อ export
+# โหมด production (หลาย process) เขียนผลลงดิสก์ทันทีด้วย — export ที่ไปตก process อื่นโหลดจากไฟล์ได้ และเช็ค version ไฟล์กันผลเก่า
+_frame_results = OrderedDict()  # key -> {'df': DataFrame หรือ None (อยู่บนดิสก์), 'nbytes': int, 'path': str หรือ None, 'version'}
+_frame_results_lock = threading.Lock()
+
+def frame_session_id():
+    """id ของผู้ใช้ (เก็บใน cookie session) ใช้แยกผล frame_stock ของแต่ละคน"""
+    if 'frame_sid' not in session:
+        session['frame_sid'] = uuid.uuid4().hex
+    return session['frame_sid']
+
+def _frame_result_path(key):
+    # ต่อท้ายด้วยชื่อไฟล์ต้นทาง — ลบผลของไฟล์ที่เปลี่ยนได้โดยไม่ต้องรู้ session (ดู _invalidate_frame_results)
+    return os.path.join(FRAME_RESULT_FOLDER, hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16] + '_' + safe_filename(key[1]))
+
+def _shared_frame_file(key):
+    """ไฟล์ผลของ key ที่เขียนล่าสุด (process ใดก็ได้) หรือ None"""
+    base = _frame_result_path(key)
+    found = [p for p in (base + '.parquet', base + '.pkl') if os.path.exists(p)]
+    return max(found, key=os.path.getmtime) if found else None
+
+def _drop_frame_file(entry):
+    if entry.get('path'):
+        try:
+            os.remove(entry['path'])
+        except FileNotFoundError:
+            pass  # process อื่นลบไปแล้ว
+    entry['path'] = None
+
+def _enforce_frame_budget():
+    """(ต้องถือ _frame_results_lock) ย้ายผลที่ไม่ได้ใช้นานสุดออกจากหน่วยความจำจนไม่เกินงบ — ผลล่าสุดอยู่ในหน่วยความจำเสมอ"""
+    budget = FRAME_RESULT_MEMORY_MB * 1024 * 1024
+    in_memory = sum(e['nbytes'] for e in _frame_results.values() if e['df'] is not None)
+    for key in list(_frame_results)[:-1]:
+        if in_memory <= budget:
+            break
+        entry = _frame_results[key]
+        if entry['df'] is None:
+            continue
+        in_memory -= entry['nbytes']
+        if entry['path']:  # มีสำเนาบนดิสก์อยู่แล้ว (โหมด production)
+            entry['df'] = None
+            continue
+        if FRAME_RESULT_SPILL:
+            try:
+                entry['path'] = save_frame(entry['df'], _frame_result_path(key))
+                entry['df'] = None
+                print(f"💾 ย้ายผล frame stock {key[1]} ลงดิสก์")
+                continue
+            except Exception as e:
+                print(f"❌ เขียนผล frame stock {key[1]} ลงดิสก์ไม่สำเร็จ: {e}")
+        del _frame_results[key]
+
+    spilled = [k for k, e in _frame_results.items() if e['df'] is None]
+    for key in spilled[:max(0, len(spilled) - FRAME_RESULT_MAX_SPILLED)]:
+        _drop_frame_file(_frame_results.pop(key))
+
+def store_frame_result(key, df):
+    """เก็บผล frame_stock ของ key = (session id, ชื่อไฟล์) แทนผลเดิมของ key เดียวกัน"""
+    path = version = None
+    if APP_MODE == 'production':
+        try:
+            path = save_frame(df, _frame_result_path(key))
+            version = get_file_version(path)
+        except Exception as e:
+            print(f"❌ เขียนผล frame stock {key[1]} ลงดิสก์ไม่สำเร็จ: {e}")
+            path = None
+    with _frame_results_lock:
+        old = _frame_results.pop(key, None)
+        if old and old['path'] != path:
+            _drop_frame_file(old)
+        _frame_results[key] = {'df': df, 'nbytes': int(df.memory_usage(deep=True).sum()), 'path': path, 'version': version}
+        _enforce_frame_budget()
+
+def get_frame_result(key):
+    """คืนผล frame_stock ของ key (โหลดกลับจากดิสก์ถ้าถูกย้ายออก) หรือ None — ห้ามแก้ไข DataFrame ที่ได้"""
+    shared = APP_MODE == 'production'
+    with _frame_results_lock:
+        entry = _frame_results.get(key)
+        if shared and (entry is None or entry['path']):
+            # process อื่นอาจประมวลผลใหม่ / ลบผลนี้ไปแล้ว → ยึดไฟล์บนดิสก์เป็นหลัก
+            path = _shared_frame_file(key)
+            if path is None:
+                _frame_results.pop(key, None)
+                return None
+            version = get_file_version(path)
+            if entry is None or entry['path'] != path or entry['version'] != version:
+                entry = {'df': None, 'nbytes': 0, 'path': path, 'version': version}
+                _frame_results[key] = entry
+        if entry is None:
+            return None
+        _frame_results.move_to_end(key)
+        if entry['df'] is None:
+            try:
+                entry['df'] = load_frame(entry['path'])
+            except Exception as e:
+                print(f"❌ โหลดผล frame stock {key[1]} จากดิสก์ไม่สำเร็จ: {e}")
+                del _frame_results[key]
+                return None
+            entry['nbytes'] = int(entry['df'].memory_usage(deep=True).sum())
+            if not shared:
+                _drop_frame_file(entry)
+            _enforce_frame_budget()
+        return entry['df']
+
+@on_data_change
+def _invalidate_frame_results(events):
+    """ไฟล์ log ใน uploads เปลี่ยน/ถูกลบ → ผลที่ประมวลผลจากไฟล์เดิมของทุก session ใช้ไม่ได้แล้ว"""
+    changed = {e['file'] for e in events if e['folder'] == os.path.normpath(FRAMESTOCK_FOLDER) and e['kind'] != 'added'}
+    if not changed:
+        return
+    with _frame_results_lock:
+        for key in [k for k in _frame_results if k[1] in changed]:
+            _drop_frame_file(_frame_results.pop(key))
+        if APP_MODE == 'production':
+            # ผลที่ process อื่นเขียนไว้ (ไม่อยู่ในหน่วยความจำของ process นี้)
+            suffixes = tuple('_' + safe_filename(f) + ext for f in changed for ext in ('.parquet', '.pkl'))
+            for fname in os.listdir(FRAME_RESULT_FOLDER):
+                if fname.endswith(suffixes):
+                    try:
+                        os.remove(os.path.join(FRAME_RESULT_FOLDER, fname))
+                    except OSError:
+                        pass
+
+def clear_spilled_frame_results(max_age=None):
+    """ลบไฟล์ผล frame_stock บนดิสก์ — max_age=None ลบทั้งหมด ไม่งั้นเฉพาะไฟล์ที่เก่ากว่า max_age วินาที คืนจำนวนที่ลบ
+
+    เรียกตอนเริ่ม process และจาก thread ลบไฟล์หมดอายุแบบระบุอายุ ไฟล์ที่ worker อื่นเพิ่งเขียนจึงไม่ถูกลบ
+    """
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(FRAME_RESULT_FOLDER))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if max_age is None or now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
 @app.route('/frame_stock', methods=['GET', 'POST'])
 def frame_stock():
-    global processed_df
-    files = [f for f in os.listdir(FRAMESTOCK_FOLDER) if f.endswith('.xlsx') and not f.startswith('~$')]
+    files = [f for f in watched_files(FRAMESTOCK_FOLDER) if f.endswith('.xlsx') and not f.startswith('~$')]
 
     selected_file = None
     data = []
 
     package_folder = 'package and frame stock'
-    map_file = next((f for f in os.listdir(package_folder) if f.endswith('.xlsx')), None)
+    map_file = next((f for f in watched_files(package_folder) if f.endswith('.xlsx')), None)
     item_map = {}
 
     if map_file:
         map_path = os.path.join(package_folder, map_file)
-        map_df = pd.read_excel(map_path)
+        map_df = read_dataset(map_path)
         if 'ITEM_NO' in map_df.columns and 'PACKAGE_CODE' in map_df.columns:
             item_map = dict(zip(map_df['ITEM_NO'].astype(str).str.strip(), map_df['PACKAGE_CODE'].astype(str).str.strip()))
 
@@ -1534,7 +3544,7 @@ def frame_stock():
         selected_file = request.form.get('file')
         if selected_file:
             filepath = os.path.join(FRAMESTOCK_FOLDER, selected_file)
-            df = pd.read_excel(filepath, skiprows=2)
+            df = read_dataset(filepath, skiprows=2)
             df = standardize_columns(df)
 
             op_col = 'Unnamed: 2'
@@ -1559,121 +3569,9 @@ def frame_stock():
             df['Data Point'] = ''
             df['DateOnly'] = pd.to_datetime(df['Unnamed: 0'], errors='coerce').dt.date
 
-            for i, row in df.iterrows():
-                if row[op_col] == 'PRO':
-                    machine_id = row[machine_col]
-                    cuc_rows = df.loc[:i - 1]
-                    matched_cuc = cuc_rows[
-                        (cuc_rows[op_col] == 'CUC') &
-                        (cuc_rows[machine_col] == machine_id) &
-                        (cuc_rows['Speed'].notna())
-                    ]
-                    if not matched_cuc.empty:
-                        df.at[i, 'SPEED'] = matched_cuc.iloc[-1]['Speed']
-
-            pro_df = df[df[op_col] == 'PRO']
-            pro_indices = pro_df.index.tolist()
-
-            groups = []
-            current_group = []
-            last_machine = None
-
-            for idx in pro_indices:
-                step = df.at[idx, step_col]
-                machine = df.at[idx, st_col]
-
-                if pd.isna(step):
-                    continue
-
-                if last_machine is not None and machine != last_machine:
-                    if len(current_group) > 1:
-                        groups.append(current_group.copy())
-                    current_group = []
+            df['SPEED'] = propagate_cuc_speed(df, op_col, machine_col)
 
-                current_group.append(idx)
-                last_machine = machine
-
-                if step == 1:
-                    if len(current_group) > 1:
-                        groups.append(current_group.copy())
-                    current_group = []
-                    last_machine = None
-
-            if len(current_group) > 1:
-                groups.append(current_group.copy())
-
-            error_ops = ['ERRSET', 'ERRRCV', 'ERRCLR', 'DMC', 'DMW']
-            all_deltas = []
-            group_date_tracker = {}
-
-            for group in groups:
-                if len(group) < 2:
-                    continue
-
-                group_df = df.loc[group].copy()
-                group_df['DateOnly'] = pd.to_datetime(group_df['Unnamed: 0'], errors='coerce').dt.date
-                date_groups = group_df.groupby('DateOnly')
-
-                for date, sub_df in date_groups:
-                    sub_group = sub_df.index.tolist()
-                    if len(sub_group) < 2:
-                        continue
-
-                    date_str = str(date) if pd.notnull(date) else 'Unknown'
-                    group_date_tracker.setdefault(date_str, 0)
-                    group_date_tracker[date_str] += 1
-                    group_number = group_date_tracker[date_str]
-                    group_name = f"Group {group_number} ({date_str})"
-
-                    last_step = df.at[sub_group[-1], step_col]
-                    if last_step != 1:
-                        for idx in sub_group:
-                            df.at[idx, 'Group'] = f"Invalid {group_name}"
-                        continue
-
-                    deltas = []
-                    for idx in sub_group:
-                        df.at[idx, 'Group'] = group_name
-
-                    for i in range(1, len(sub_group)):
-                        prev_idx = sub_group[i - 1]
-                        curr_idx = sub_group[i]
-
-                        step_prev = df.at[prev_idx, step_col]
-                        step_curr = df.at[curr_idx, step_col]
-
-                        if pd.notnull(step_prev) and pd.notnull(step_curr) and step_curr > step_prev:
-                            df.at[curr_idx, 'sec'] = 'Out of Order'
-                            df.at[curr_idx, 'min'] = 'Out of Order'
-                            df.at[curr_idx, 'Reverse'] = 'Out of Order'
-                            continue
-
-                        between = df.loc[prev_idx + 1: curr_idx - 1]
-                        has_error = between[op_col].astype(str).str.upper().isin(error_ops).any()
-
-                        if has_error:
-                            df.at[curr_idx, 'sec'] = 'Machine Error'
-                            df.at[curr_idx, 'min'] = 'Machine Error'
-                            df.at[curr_idx, 'Reverse'] = 'Machine Error'
-                            continue
-
-                        t1 = pd.to_datetime(df.at[prev_idx, time_col], format='%H:%M:%S', errors='coerce')
-                        t2 = pd.to_datetime(df.at[curr_idx, time_col], format='%H:%M:%S', errors='coerce')
-
-                        if pd.notnull(t1) and pd.notnull(t2):
-                            delta_sec = (t2 - t1).total_seconds()
-                            delta_str = str(pd.to_timedelta(abs(delta_sec), unit='s')).split(' ')[-1]
-                            formula = f"{t2.time()} - {t1.time()} = {delta_str}"
-                            df.at[curr_idx, 'sec'] = abs(delta_sec)
-                            df.at[curr_idx, 'min'] = delta_str
-                            df.at[curr_idx, 'Reverse'] = formula
-                            deltas.append(abs(delta_sec))
-
-                    if deltas:
-                        avg_sec = round(sum(deltas) / len(deltas), 4)
-                        df.at[sub_group[-1], 'Average'] = f"Average-Group = {avg_sec} sec/strip"
-                        df.at[sub_group[-1], 'Data Point'] = str(len(deltas))
-                        all_deltas.extend(deltas)
+            compute_strip_groups(df, op_col, time_col, step_col, st_col)
 
             df['sec'] = pd.to_numeric(df['sec'], errors='coerce')
             df['SPEED'] = pd.to_numeric(df['SPEED'], errors='coerce')
@@ -1703,38 +3601,33 @@ def frame_stock():
                 (df['SPEED'] != 0)
             ].copy()
 
-            valid_groups = all_valid.copy()
-            valid_groups['z_score'] = valid_groups.groupby(['__station__', 'SPEED'])['sec'].transform(lambda x: zscore(x, nan_policy='omit'))
-            valid_groups = valid_groups[valid_groups['z_score'].abs() <= 3]
-
-            outlier_info = {}
-            grouped_all = all_valid.groupby(['__station__', 'SPEED'])
-            grouped_valid = valid_groups.groupby(['__station__', 'SPEED'])
-
-            for group_key, group_df in grouped_all:
-                total = len(group_df)
-                filtered = len(grouped_valid.get_group(group_key)) if group_key in grouped_valid.groups else 0
-                msg = f"ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: {total}" if total < 15 else f"ตัด Outlier — ก่อน: {total} หลัง: {filtered}"
-                idx_first = group_df.index.min()
-                outlier_info[idx_first] = msg
-
+            group_cols = ['__station__', 'SPEED']
+            codes = all_valid.groupby(group_cols).ngroup().to_numpy()
+            keep = station_zscore_keep(codes, all_valid['sec'].to_numpy(dtype=float))
+            valid_groups = all_valid[keep]
+
+            # ข้อความตัด Outlier ที่แถวแรกของแต่ละ (station, SPEED)
+            per_group = pd.DataFrame({
+                'total': np.bincount(codes),
+                'filtered': np.bincount(codes, weights=keep).astype(int),
+                'idx_first': all_valid.index.to_series().groupby(codes).min().to_numpy(),
+            })
             df['outlier_removed'] = ""
-            for idx, msg in outlier_info.items():
-                df.at[idx, 'outlier_removed'] = msg
+            df.loc[per_group['idx_first'].to_numpy(), 'outlier_removed'] = [
+                f"ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: {total}" if total < 15 else f"ตัด Outlier — ก่อน: {total} หลัง: {filtered}"
+                for total, filtered in zip(per_group['total'].tolist(), per_group['filtered'].tolist())
+            ]
 
             # ==== ใช้ valid_groups ต่อ ====
-            group_cols = ['__station__', 'SPEED']
-            station_avg = valid_groups.groupby(group_cols)['sec'].mean().round(4).to_dict()
-
-            first_indices = valid_groups.groupby(group_cols).apply(lambda g: g.index.min()).reset_index(name='idx')
-            for row in first_indices.itertuples(index=False):
-                station, speed, idx = row
-                avg = station_avg.get((station, speed))
-                if avg is not None:
-                    df.at[idx, 'Average_Frame-Stock'] = f"{station}: Average = {avg} time/strip (SPEED={speed})"
+            station_stats = valid_groups.groupby(group_cols)['sec'].mean().round(4).to_frame('avg')
+            station_stats['idx'] = valid_groups.index.to_series().groupby([valid_groups[c] for c in group_cols]).min()
+            df.loc[station_stats['idx'].to_numpy(), 'Average_Frame-Stock'] = [
+                f"{station}: Average = {avg} time/strip (SPEED={speed})"
+                for (station, speed), avg in zip(station_stats.index, station_stats['avg'].tolist())
+            ]
 
             df.drop(columns=['__station__', 'DateOnly'], inplace=True)
-            processed_df = df.copy()
+            store_frame_result((frame_session_id(), selected_file), df)
             data = df.to_dict(orient='records')
 
     return render_template('index.html', files=files, data=data, selected_file=selected_file)
@@ -1748,7 +3641,7 @@ def get_types():
     if not os.path.exists(filepath):
         return jsonify([])
 
-    df = pd.read_excel(filepath)
+    df = read_dataset(filepath)
     df = standardize_columns(df)
     op_col = next((c for c in df.columns if df[c].astype(str).str.contains('PRO|CUC', na=False).any()), None)
     if not op_col:
@@ -1759,15 +3652,14 @@ def get_types():
 
 @app.route('/export_excel')
 def export_excel():
-    global processed_df
     selected_filename = request.args.get('filename')
+    if not selected_filename:
+        return "No filename provided", 400
 
+    processed_df = get_frame_result((frame_session_id(), selected_filename))
     if processed_df is None or processed_df.empty:
         return "No data to export", 400
 
-    if not selected_filename:
-        return "No filename provided", 400
-
     col_op = 'Unnamed: 2'
     col_avg_info = 'Average'
 
@@ -1807,15 +3699,14 @@ def export_excel():
 
 @app.route('/export_all_pro')
 def export_all_pro():
-    global processed_df
     selected_filename = request.args.get('filename')
+    if not selected_filename:
+        return "No filename provided", 400
 
+    processed_df = get_frame_result((frame_session_id(), selected_filename))
     if processed_df is None or processed_df.empty:
         return "No data to export", 400
 
-    if not selected_filename:
-        return "No filename provided", 400
-
     op_col = 'Unnamed: 2'
     info_col = 'Average_Info'
 
@@ -1848,9 +3739,79 @@ def export_all_pro():
         download_name='all_pro_' + selected_filename
     )
 #
+# === Process startup ===
+# import app ไม่สร้างโฟลเดอร์และไม่เริ่ม thread ใด ๆ (gunicorn import ใน process หลักก่อน fork ได้ปลอดภัย)
+# งานเบื้องหลังของแต่ละ process เริ่มใน start_services() — gunicorn เรียกใน post_fork ของแต่ละ worker
+# ส่วน waitress / server ของ werkzeug เรียกก่อนเริ่ม serve
+_services_pid = None
+_services_lock = threading.Lock()
+
+def start_services():
+    """เริ่มงานเบื้องหลังของ process นี้ครั้งเดียว: สร้างโฟลเดอร์ รับ artifact เดิม ลบผล frame_stock ที่หมดอายุ
+    thread ลบไฟล์หมดอายุ watcher และโหลดตารางอ้างอิง"""
+    global _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        _services_pid = os.getpid()
+    ensure_folders()
+    state_db()
+    load_existing_artifacts()
+    clear_spilled_frame_results(FRAME_RESULT_TTL_SECONDS)
+    threading.Thread(target=_artifact_sweeper, daemon=True).start()
+    start_data_watcher()
+    threading.Thread(target=warm_reference_data, daemon=True).start()
+
+# === Production serving ===
+# python app.py --production (หรือ APP_MODE=production) รันด้วย gunicorn: WEB_WORKERS process × WEB_THREADS thread
+# (gunicorn ดูแล worker ที่ตาย / reload ด้วย SIGHUP / ปิดแบบ graceful) — หรือรันเองด้วย gunicorn app:app ซึ่งอ่าน gunicorn.conf.py
+# ถ้าไม่มี gunicorn (เช่น Windows) ใช้ waitress แบบ process เดียว WEB_THREADS thread
+def _gunicorn_post_fork(server, worker):
+    start_services()
+
+GUNICORN_OPTIONS = {
+    'bind': '0.0.0.0:8080',
+    'workers': WEB_WORKERS,
+    'threads': WEB_THREADS,
+    'worker_class': 'gthread',
+    'timeout': 120,
+    'post_fork': _gunicorn_post_fork,
+}
+
+def serve_production(host='0.0.0.0', port=8080):
+    global APP_MODE
+    APP_MODE = os.environ['APP_MODE'] = 'production'
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        BaseApplication = None
+
+    if BaseApplication is not None:
+        class _GunicornApp(BaseApplication):
+            def load_config(self):
+                for key, value in dict(GUNICORN_OPTIONS, bind=f"{host}:{port}").items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return app
+
+        _GunicornApp().run()
+        return
+
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("❌ โหมด production ต้องติดตั้ง gunicorn หรือ waitress (pip install gunicorn / waitress)")
+    start_services()
+    serve(app, host=host, port=port, threads=WEB_THREADS)
+
 if __name__ == '__main__':
     ip = socket.gethostbyname(socket.gethostname())
     print(f"\n✅ Flask app is running on: http://{ip}:8080\n(เปิดจากเครื่องอื่นในเครือข่ายได้ด้วย IP นี้)\n")
-    app.run(debug=True, host='0.0.0.0', port=8080)
-
-#test Gun
\ No newline at end of file
+    if APP_MODE == 'production' or '--production' in sys.argv:
+        print(f"🏭 โหมด production: {WEB_WORKERS} process × {WEB_THREADS} thread")
+        serve_production(port=8080)
+    else:
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_services()  # process ลูกของ reloader ที่รับ request จริง
+        app.run(debug=True, host='0.0.0.0', port=8080)
@@ -0,0 +1,10 @@
+# ตั้งค่า gunicorn สำหรับโหมด production: gunicorn app:app (gunicorn อ่านไฟล์นี้เองเมื่อรันในโฟลเดอร์นี้)
+# ค่าทั้งหมดอยู่ใน app.GUNICORN_OPTIONS — จำนวน worker / thread ตั้งด้วย WEB_WORKERS / WEB_THREADS
+# post_fork เรียก start_services() ในแต่ละ worker (watcher / thread ลบไฟล์ / connection ของ SQLite ไม่ข้าม fork)
+import os
+
+os.environ.setdefault('APP_MODE', 'production')
+
+from app import GUNICORN_OPTIONS  # noqa: E402  (ต้องตั้ง APP_MODE ก่อน import app)
+
+globals().update(GUNICORN_OPTIONS)
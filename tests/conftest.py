@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import app  # noqa: E402  (import ไม่มี side effect — ไม่สร้างโฟลเดอร์ / thread)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """รันในโฟลเดอร์ว่าง (app ใช้ path แบบ relative) และล้างแคชระดับ module ที่อาจค้างจาก test ก่อน"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, '_dataset_cache', OrderedDict())
+    monkeypatch.setattr(app, '_summary_cache', OrderedDict())
+    monkeypatch.setattr(app, '_facet_cache', {})
+    monkeypatch.setattr(app, '_encoded_cache', OrderedDict())
+    monkeypatch.setattr(app, '_apl_store_index', {})
+    monkeypatch.setattr(app, '_apl_store_names', {})
+    monkeypatch.setattr(app, '_uph_rollup', None)
+    monkeypatch.setattr(app, '_frame_results', OrderedDict())
+    monkeypatch.setattr(app, '_state_local', threading.local())
+    monkeypatch.setattr(app, '_reference_data', None)
+    monkeypatch.setattr(app, '_reference_signature', None)
+    monkeypatch.setattr(app, '_file_index', None)
+    monkeypatch.setattr(app, '_artifacts', OrderedDict())
+    monkeypatch.setattr(app, '_artifact_expiry', [])
+    monkeypatch.setattr(app, '_artifact_bytes', 0)
+    app.ensure_folders()
+    return tmp_path
+
+
+@pytest.fixture
+def client(workdir):
+    """test client ของ Flask (ไม่เริ่ม watcher / thread เบื้องหลัง — start_services ไม่ถูกเรียกจาก request)"""
+    app.app.config['TESTING'] = True
+    return app.app.test_client()
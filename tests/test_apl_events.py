@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def short_streams(client, monkeypatch):
+    """stream เปิดได้ทีละ 1 และปิดเองหลัง 0.3 วินาที"""
+    monkeypatch.setattr(app, 'APL_EVENT_STREAM_SECONDS', 0.3)
+    monkeypatch.setattr(app, 'APL_EVENT_POLL_SECONDS', 0.05)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(app, '_apl_stream_slots', slots)
+    return slots
+
+
+def test_stream_ends_and_releases_its_slot(client, short_streams):
+    app.publish_apl_event('file', {'file': 'old.xlsx'})
+    response = client.get('/apl_events', headers={'Last-Event-ID': '0'})
+    body = response.get_data(as_text=True)  # อ่านจนจบ — stream ต้องปิดเองตาม APL_EVENT_STREAM_SECONDS
+    response.close()
+
+    assert body.startswith('retry: 3000')
+    assert 'event: file' in body and 'old.xlsx' in body
+    assert short_streams.acquire(blocking=False)
+    short_streams.release()
+
+
+def test_stream_over_the_cap_asks_the_browser_to_retry(client, short_streams):
+    short_streams.acquire()
+    try:
+        response = client.get('/apl_events')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        assert response.get_data(as_text=True) == f"retry: {app.APL_EVENT_BUSY_RETRY_MS}\n\n"
+        response.close()
+    finally:
+        short_streams.release()
+    # คำขอที่ถูกปฏิเสธต้องไม่คืน slot ที่ไม่ได้ถือ (BoundedSemaphore จะ error ถ้าคืนเกิน)
+    assert short_streams.acquire(blocking=False)
+
+
+def test_closed_before_reading_still_releases_the_slot(client, short_streams):
+    response = client.get('/apl_events')
+    response.close()
+    assert short_streams.acquire(blocking=False)
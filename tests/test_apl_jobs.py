@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+import pytest
+
+import app
+
+
+class _RecordingPool:
+    """แทน _apl_pool — จดงานที่ส่งเข้ามาโดยไม่รัน (งานจึงค้างสถานะ queued)"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+@pytest.fixture
+def pool(workdir, monkeypatch):
+    recording = _RecordingPool()
+    monkeypatch.setattr(app, '_apl_pool', recording)
+    return recording
+
+
+def _job_count():
+    return app.state_db().execute('SELECT COUNT(*) FROM apl_jobs').fetchone()[0]
+
+
+def test_same_partition_reuses_the_running_job(pool):
+    first = app.submit_apl_job('P1', '2025Q1', 'WB')
+    second = app.submit_apl_job('P1', '2025Q1', 'WB', full=True)
+
+    assert second['id'] == first['id']
+    assert not second['full']
+    assert pool.submitted == [(first['id'],)]
+
+    app._update_apl_job(first['id'], status='running')
+    assert app.submit_apl_job('P1', '2025Q1', 'WB')['id'] == first['id']
+    assert _job_count() == 1
+
+
+def test_other_partitions_get_their_own_job(pool):
+    ids = {app.submit_apl_job(*params)['id'] for params in [
+        ('P1', '2025Q1', 'WB'), ('P1', '2025Q1', 'DA'), ('P1', '2025Q2', 'WB'), ('P2', '2025Q1', 'WB'),
+    ]}
+    assert len(ids) == 4
+    assert len(pool.submitted) == 4
+
+
+@pytest.mark.parametrize('status', ['done', 'error'])
+def test_finished_job_is_not_reused(pool, status):
+    first = app.submit_apl_job('P1', '2025Q1', 'WB')
+    app._update_apl_job(first['id'], status=status)
+
+    second = app.submit_apl_job('P1', '2025Q1', 'WB')
+    assert second['id'] != first['id']
+    assert app.get_apl_job(first['id'])['status'] == status
+
+
+def test_stale_job_is_replaced(pool):
+    first = app.submit_apl_job('P1', '2025Q1', 'WB')
+    stale = time.time() - app.APL_JOB_STALE_SECONDS - 60
+    app.state_db().execute('UPDATE apl_jobs SET updated = ? WHERE id = ?', (stale, first['id']))
+
+    assert app.get_apl_job(first['id'])['status'] == 'error'
+    second = app.submit_apl_job('P1', '2025Q1', 'WB')
+    assert second['id'] != first['id']
+    assert second['status'] == 'queued'
+
+
+def _submit_in_child(barrier, results):
+    barrier.wait()
+    results.put(app.submit_apl_job('P1', '2025Q1', 'WB')['id'])
+
+
+def test_concurrent_processes_share_one_job(pool):
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(4)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_submit_in_child, args=(barrier, results)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    ids = [results.get(timeout=30) for _ in procs]
+    for p in procs:
+        p.join(timeout=30)
+        assert p.exitcode == 0
+
+    assert len(set(ids)) == 1
+    assert _job_count() == 1
+
+
+def test_job_runs_to_done(workdir, monkeypatch):
+    class _InlinePool:
+        def submit(self, fn, *args):
+            fn(*args)
+
+    save_path = os.path.join(app.DATA_FOLDER, app.apl_filename('P1', '2025Q1', 'WB'))
+
+    def fake_run_apl(url, plant, year_quarter, operation, progress=None, since=None):
+        progress('parsing')
+        pd.DataFrame({'UPH': [1]}).to_excel(save_path, index=False)
+        return True, save_path
+
+    monkeypatch.setattr(app, '_apl_pool', _InlinePool())
+    monkeypatch.setattr(app, 'run_apl', fake_run_apl)
+
+    job = app.get_apl_job(app.submit_apl_job('P1', '2025Q1', 'WB')['id'])
+    assert job['status'] == 'done'
+    assert job['filename'] == os.path.basename(save_path)
+    assert job['filename'] in app.list_generated_files()
+
+
+def test_landing_page_form_queues_a_job(client, monkeypatch):
+    recording = _RecordingPool()
+    monkeypatch.setattr(app, '_apl_pool', recording)
+    pd.DataFrame({'bom_no': ['B1'], 'operation': ['WB'], 'Machine_Model': ['WB-01'], 'UPH': [1]}).to_csv(
+        os.path.join(app.DATA_FOLDER, 'WB test.csv'), index=False)
+    display_name = app.get_file_index()['WB test.csv']['display_name']
+
+    response = client.post('/', data={
+        'submit_wb': '1', 'wb_csv_file': display_name, 'wb_selected_bom': 'B1', 'wb_operation': 'LEAD BOND',
+        'plant': 'P1', 'year_quarter': '2025Q1',
+    })
+
+    assert response.status_code == 200
+    assert len(recording.submitted) == 1
+    job = app.get_apl_job(recording.submitted[0][0])
+    assert (job['plant'], job['year_quarter'], job['operation']) == ('P1', '2025Q1', 'LEAD BOND')
+    assert job['id'] in response.get_data(as_text=True)
+
+
+# === APL store ล็อกข้าม process ===
+def _append_in_child(barrier, worker):
+    barrier.wait()
+    for batch in range(3):
+        rows = pd.DataFrame({
+            'date_time_start': [f'2025-01-01 {worker:02d}:{batch:02d}:{i:02d}' for i in range(5)],
+            'bom_no': 'B1', 'operation': 'WB', 'optn_code': 'A', 'Machine_Model': 'WB-01', 'UPH': 1000.0,
+        })
+        app.append_apl_rows('P1', '2025Q1', 'WB', rows)
+
+
+def test_concurrent_appends_keep_every_row(workdir):
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(4)
+    procs = [ctx.Process(target=_append_in_child, args=(barrier, w)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+
+    assert len(app.load_apl_partition('P1', '2025Q1', 'WB')) == 4 * 3 * 5
@@ -0,0 +1,105 @@
+import os
+
+import pandas as pd
+import pytest
+
+import app
+
+PARTITION = ('P1', '2025Q1', 'LEAD BOND')
+
+
+def _rows(start, n, uph=1000.0):
+    return pd.DataFrame({
+        'date_time_start': [f'2025-01-01 08:{i:02d}:00' for i in range(start, start + n)],
+        'bom_no': 'B1', 'operation': 'LEAD BOND', 'optn_code': 'A', 'Machine_Model': 'WB-01', 'UPH': uph,
+    })
+
+
+@pytest.fixture
+def store_path(workdir):
+    """ชื่อที่ partition แสดงในโฟลเดอร์ data"""
+    return os.path.join(app.DATA_FOLDER, app.apl_filename(*PARTITION))
+
+
+def test_append_compact_export_round_trip(store_path, monkeypatch):
+    monkeypatch.setattr(app, 'APL_COMPACT_PARTS', 3)
+    for batch in range(5):
+        app.append_apl_rows(*PARTITION, _rows(batch * 10, 10))
+    app.append_apl_rows(*PARTITION, _rows(0, 5, uph=2000.0))  # แถวซ้ำ — เก็บค่าล่าสุด
+
+    manifest = app._load_apl_manifest(app.apl_partition_dir(*PARTITION))
+    assert len(manifest['parts']) <= 3
+    assert manifest['watermark'] == '2025-01-01T08:49:00'
+
+    stored = app.load_apl_partition(*PARTITION)
+    assert len(stored) == 50
+    assert sorted(stored.loc[stored['UPH'] == 2000.0, 'date_time_start']) == list(_rows(0, 5)['date_time_start'])
+
+    exported = pd.read_excel(app.export_apl_xlsx(*PARTITION))
+    assert len(exported) == 50
+    assert set(exported.columns) == set(stored.columns)
+    assert not os.path.exists(store_path)
+
+
+def test_report_paths_read_the_store(store_path):
+    app.append_apl_rows(*PARTITION, _rows(0, 10))
+
+    name = os.path.basename(store_path)
+    assert name in app.list_data_files()
+    assert app.get_file_index()[name]['wb']
+    assert len(app.read_dataset(store_path)) == 10
+    assert [v for v, _ in app.get_file_facets(name)['bom_no']] == ['B1']
+
+    version = app.get_file_version(store_path)
+    app.append_apl_rows(*PARTITION, _rows(10, 5))
+    assert app.get_file_version(store_path) != version
+    assert len(app.read_dataset(store_path)) == 15
+    assert app.get_file_facets(name)['bom_no'] == [['B1', 15]]
+
+
+def test_source_lookup_uses_the_dataset_cache(store_path, monkeypatch):
+    app.append_apl_rows(*PARTITION, _rows(0, 10))
+    name, version, load = app.dataset_source(*PARTITION)
+    assert name == 'apl_store'
+    assert len(load()) == 10
+
+    calls = []
+    original = app.load_apl_partition
+    monkeypatch.setattr(app, 'load_apl_partition', lambda *a: calls.append(a) or original(*a))
+    assert len(load()) == 10
+    assert calls == []
+
+
+def test_export_is_reused_until_new_rows_arrive(store_path):
+    app.append_apl_rows(*PARTITION, _rows(0, 10))
+    first = app.export_apl_xlsx(*PARTITION)
+    assert app.export_apl_xlsx(*PARTITION) == first
+    assert os.path.dirname(first) == app.EXPORT_CACHE_FOLDER
+
+    app.append_apl_rows(*PARTITION, _rows(0, 0))  # ไม่มีแถวใหม่
+    assert app.export_apl_xlsx(*PARTITION) == first
+
+    app.append_apl_rows(*PARTITION, _rows(10, 5))
+    second = app.export_apl_xlsx(*PARTITION)
+    assert second != first
+    assert len(pd.read_excel(second)) == 15
+
+
+def test_legacy_workbook_becomes_the_first_part(store_path):
+    _rows(0, 10).to_excel(store_path, index=False)
+    app.append_apl_rows(*PARTITION, _rows(10, 5))
+
+    assert len(app.read_dataset(store_path)) == 15
+    assert app.list_data_files().count(os.path.basename(store_path)) == 1
+
+
+def test_export_route_downloads_the_partition(client, store_path):
+    assert client.get('/apl_export', query_string=dict(
+        plant=PARTITION[0], year_quarter=PARTITION[1], operation=PARTITION[2])).status_code == 404
+
+    app.append_apl_rows(*PARTITION, _rows(0, 10))
+    response = client.get('/apl_export', query_string=dict(
+        plant=PARTITION[0], year_quarter=PARTITION[1], operation=PARTITION[2]))
+    assert response.status_code == 200
+    assert os.path.basename(store_path) in response.headers['Content-Disposition']
+    response.close()
@@ -0,0 +1,177 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+VALID = [
+    '[]',
+    ' [ ] \n',
+    '[1, 2.5, -3e2, 1.5e3, 0, true, false, null]',
+    '[{"a": 1}, {"b": [1, {"c": "]"}]}, "x,y"]',
+    '[{"UPH": 1250.75, "Machine_Model": "WB-ไทย", "bom_no": "TIU1777P"}]',
+    '\ufeff[{"k": "\\u0e01\\"\\\\"}, 12345678901234567890]',
+    '[[], {}, [[1]], ""]',
+]
+
+INVALID = [
+    '',
+    '   ',
+    '{"a": 1}',
+    '[1 2]',
+    '[1,]',
+    '[,1]',
+    '[1,,2]',
+    '[1',
+    '[1,',
+    '[{"a": 1}',
+    '[{"a": 1',
+    '[1] [2]',
+    '[1]x',
+    '[1.]',
+    '[1e]',
+    '["unterminated]',
+]
+
+
+@pytest.mark.parametrize('text', VALID)
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 10 ** 6])
+def test_valid_arrays_match_json_loads(text, size):
+    data = text.encode('utf-8')
+    expected = json.loads(data.decode('utf-8-sig'))
+    assert list(app.iter_json_array(_chunks(data, size))) == expected
+
+
+@pytest.mark.parametrize('text', INVALID)
+@pytest.mark.parametrize('size', [1, 3, 10 ** 6])
+def test_malformed_or_truncated_arrays_raise(text, size):
+    if text.lstrip().startswith('['):
+        with pytest.raises(ValueError):
+            json.loads(text)
+    with pytest.raises(ValueError):
+        list(app.iter_json_array(_chunks(text.encode('utf-8'), size)))
+
+
+def test_truncated_response_at_every_offset():
+    rows = [{'date_time_start': f'2025-01-0{i % 9 + 1} 08:00:00', 'UPH': i * 1.5} for i in range(20)]
+    data = json.dumps(rows).encode('utf-8')
+    for cut in range(len(data)):
+        with pytest.raises(ValueError):
+            list(app.iter_json_array(_chunks(data[:cut], 7)))
+
+
+def test_read_apl_columns_collects_buffers():
+    rows = [
+        {'date_time_start': '2025-01-01 08:00:00', 'bom_no': 'B1', 'UPH': 100, 'extra': 1},
+        {'bom_no': 'B2', 'operation': 'WB'},
+    ]
+    buffers, seen, count = app.read_apl_columns(_chunks(json.dumps(rows).encode(), 4))
+    assert count == 2
+    assert seen == {'date_time_start', 'bom_no', 'UPH', 'operation'}
+    assert buffers['bom_no'] == ['B1', 'B2']
+    assert buffers['UPH'].dtype == np.float64
+    np.testing.assert_array_equal(buffers['UPH'], [100.0, np.nan])
+    assert list(buffers) == app.APL_COLUMNS
+
+
+def test_read_apl_columns_shares_repeated_strings():
+    rows = [{'bom_no': ''.join(['TIU', '1777P']), 'UPH': 1} for _ in range(3)]  # str แยก object กันทุกแถว
+    buffers, _, _ = app.read_apl_columns([json.dumps(rows).encode()])
+    assert len({id(v) for v in buffers['bom_no']}) == 1
+
+
+def test_read_apl_columns_keeps_non_numeric_values():
+    rows = [{'UPH': 1.5}, {'UPH': None}, {'UPH': 'n/a'}, {'UPH': 2}, {'UPH': True}]
+    buffers, _, count = app.read_apl_columns([json.dumps(rows).encode()])
+    assert count == 5
+    assert buffers['UPH'] == [1.5, None, 'n/a', 2, True]
+    assert pd.DataFrame(buffers, columns=app.APL_COLUMNS)['UPH'].tolist() == [1.5, None, 'n/a', 2, True]
+
+
+def test_read_apl_columns_rejects_non_object_rows():
+    with pytest.raises(ValueError):
+        app.read_apl_columns([b'[{"UPH": 1}, 2]'])
+
+
+# === run_apl กับ response จำลอง ===
+class _FakeResponse:
+    def __init__(self, body, status=200):
+        self.body = body
+        self.status_code = status
+        self.text = body.decode('utf-8', 'replace')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        return _chunks(self.body, 5)
+
+
+class _FakeSession:
+    def __init__(self, body, status=200):
+        self.response = _FakeResponse(body, status)
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+def _apl_rows(n):
+    return [{'date_time_start': f'2025-01-01 08:{i:02d}:00', 'bom_no': 'TIU1777P', 'operation': 'WB',
+             'optn_code': 'A', 'Machine_Model': 'WB-01', 'UPH': 1000 + i} for i in range(n)]
+
+
+def test_run_apl_stores_complete_response(workdir, monkeypatch):
+    body = json.dumps(_apl_rows(5)).encode()
+    monkeypatch.setattr(app, 'get_apl_session', lambda: _FakeSession(body))
+
+    ok, path = app.run_apl('http://apl/test', 'P1', '2025Q1', 'WB')
+
+    assert ok
+    assert path == os.path.join(app.DATA_FOLDER, app.apl_filename('P1', '2025Q1', 'WB'))
+    assert not os.path.exists(path)  # ไม่เขียน xlsx ลง data — หน้ารายงานอ่านจาก store
+    assert len(app.read_dataset(path)) == 5
+    assert len(app.load_apl_partition('P1', '2025Q1', 'WB')) == 5
+
+
+@pytest.mark.parametrize('body', [
+    json.dumps(_apl_rows(5))[:-40].encode(),  # ตัดกลาง object
+    json.dumps(_apl_rows(5))[:-1].encode(),  # ขาด ']'
+    b'<html>gateway timeout</html>',
+])
+def test_run_apl_rejects_truncated_response(workdir, monkeypatch, body):
+    monkeypatch.setattr(app, 'get_apl_session', lambda: _FakeSession(body))
+
+    assert app.run_apl('http://apl/test', 'P1', '2025Q1', 'WB') == (False, None)
+    assert not os.path.exists(os.path.join(app.DATA_FOLDER, app.apl_filename('P1', '2025Q1', 'WB')))
+    assert app.load_apl_partition('P1', '2025Q1', 'WB').empty
+
+
+# === API จำลอง ===
+def test_mock_api_is_not_routed_by_default(client):
+    assert not app.APL_MOCK_API
+    assert client.get('/mock_apl_api/data?year_quarter=2025Q1&operation=WB').status_code == 404
+
+
+def test_run_apl_ingests_the_mock_api(workdir, monkeypatch):
+    with app.app.test_request_context('/mock_apl_api/data?year_quarter=2025Q1&operation=WB'
+                                      '&since=2025-03-31T20:00:00'):
+        body = app.mock_apl_api().get_data()
+    monkeypatch.setattr(app, 'get_apl_session', lambda: _FakeSession(body))
+
+    ok, path = app.run_apl('http://apl/mock', 'P1', '2025Q1', 'WB')
+
+    assert ok
+    df = app.read_dataset(path)
+    assert len(df) == 4 * 2  # 20:00-23:00 ของวันสุดท้ายของ quarter × 2 BOM
+    assert set(df['bom_no']) == {'MOCK-BOM-1', 'MOCK-BOM-2'}
@@ -0,0 +1,100 @@
+import os
+import time
+
+import pytest
+
+import app
+
+KB = 1000
+
+
+@pytest.fixture
+def budget(workdir, monkeypatch):
+    """งบ 2.5 ไฟล์ (ไฟล์ละ 1000 byte)"""
+    monkeypatch.setattr(app, 'ARTIFACT_MAX_MB', 2.5 * KB / (1024 * 1024))
+
+
+def _artifact(name, folder=None, age=0):
+    path = os.path.join(folder or app.EXPORT_CACHE_FOLDER, name)
+    with open(path, 'wb') as fh:
+        fh.write(b'x' * KB)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def _names():
+    return [os.path.basename(p) for p in app._artifacts]
+
+
+def test_over_budget_removes_least_recently_used(budget):
+    a, b = _artifact('a.xlsx'), _artifact('b.xlsx')
+    app.register_artifact(a)
+    app.register_artifact(b)
+    assert app.touch_artifact(a)
+
+    app.register_artifact(_artifact('c.xlsx'))
+    assert _names() == ['a.xlsx', 'c.xlsx']
+    assert not os.path.exists(b)
+    assert app._artifact_bytes == 2 * KB
+
+
+def test_files_in_use_are_not_evicted(budget):
+    a = _artifact('a.xlsx')
+    app.acquire_artifact(a)
+    app.register_artifact(a)
+    app.register_artifact(_artifact('b.xlsx'))
+    app.register_artifact(_artifact('c.xlsx'))
+    assert _names() == ['a.xlsx', 'c.xlsx']  # a เก่าสุดแต่ยังถือ ref อยู่
+
+    app.release_artifact(a)
+    app.register_artifact(_artifact('d.xlsx'))
+    assert _names() == ['c.xlsx', 'd.xlsx']
+    assert not os.path.exists(a)
+
+
+def test_failed_build_leaves_no_entry(budget):
+    path = os.path.join(app.EXPORT_CACHE_FOLDER, 'never.xlsx')
+    app.acquire_artifact(path)
+    assert not app.touch_artifact(path)  # กำลังสร้าง — ยังใช้ไม่ได้
+    app.release_artifact(path)
+    assert _names() == []
+
+
+def test_sweep_removes_expired_files_only(workdir):
+    ttl = app.EXPORT_TTL_SECONDS
+    expired, fresh, used = _artifact('old.xlsx'), _artifact('new.xlsx'), _artifact('used.xlsx')
+    app.register_artifact(expired, ttl, last_used=time.time() - ttl - 10)
+    app.register_artifact(fresh, ttl)
+    app.register_artifact(used, ttl, last_used=time.time() - ttl - 10)
+    assert app.touch_artifact(used)  # ต่ออายุหลังเข้าคิวแล้ว
+
+    assert app.sweep_artifacts() == 1
+    assert _names() == ['new.xlsx', 'used.xlsx']
+    assert not os.path.exists(expired)
+    assert app.sweep_artifacts() == 0
+
+
+def test_touch_forgets_files_deleted_elsewhere(workdir):
+    path = _artifact('a.xlsx')
+    app.register_artifact(path)
+    os.remove(path)
+    assert not app.touch_artifact(path)
+    assert _names() == [] and app._artifact_bytes == 0
+
+
+def test_restart_picks_up_files_by_mtime(workdir):
+    ttl = app.EXPORT_TTL_SECONDS
+    newer = _artifact('newer.xlsx', age=60)
+    older = _artifact('older.xlsx', age=600)
+    stats = _artifact('box.pkl', folder=app.BOX_STATS_FOLDER, age=300)
+    expired = _artifact('expired.xlsx', age=ttl + 60)
+    stale_tmp = _artifact('stale.xlsx.tmp', age=app.ARTIFACT_SWEEP_SECONDS + 60)
+    live_tmp = _artifact('live.xlsx.tmp')
+
+    app.load_existing_artifacts()
+    assert _names() == ['older.xlsx', 'box.pkl', 'newer.xlsx']
+    assert not os.path.exists(expired) and not os.path.exists(stale_tmp)
+    assert os.path.exists(live_tmp)  # อาจเป็นของ process อื่นที่กำลังเขียน
+    assert all(os.path.exists(p) for p in [newer, older, stats])
@@ -0,0 +1,207 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+SMALL = app.OUTLIER_LABEL_SMALL
+
+
+@pytest.fixture
+def rendered(client, monkeypatch):
+    """เก็บ context ที่ all_boms ส่งให้ template (แถวสรุปก่อนจัดรูปเป็น HTML)"""
+    contexts = []
+    original = app.render_template
+
+    def spy(template, **context):
+        contexts.append(context)
+        return original(template, **context)
+
+    monkeypatch.setattr(app, 'render_template', spy)
+    return contexts
+
+
+@pytest.fixture
+def builds(workdir, monkeypatch):
+    """จดชื่อไฟล์ทุกครั้งที่ต้องคำนวณสรุปใหม่"""
+    calls = []
+    original = app._build_bom_summary
+    monkeypatch.setattr(app, '_build_bom_summary',
+                        lambda path, refs: calls.append(os.path.basename(path)) or original(path, refs))
+    return calls
+
+
+def _write(name, df):
+    path = os.path.join(app.DATA_FOLDER, name)
+    df.to_csv(path, index=False)
+    return path
+
+
+def _da_frame():
+    rows = [
+        # B1 / DA-01: 20 แถว 1000 + แถวเดียว 5000 (z ≈ 4.4 ถูกตัด) — BOM ' b1_x000D_' ต้อง clean เป็น B1
+        *[{'bom_no': 'B1', 'Machine_Model': 'DA-01', 'UPH': 1000, 'optn_code': None if i == 0 else 'A'}
+          for i in range(19)],
+        {'bom_no': ' b1_x000D_', 'Machine_Model': 'DA-01', 'UPH': 1000, 'optn_code': 'A'},
+        {'bom_no': 'B1', 'Machine_Model': 'DA-01', 'UPH': 5000, 'optn_code': 'A'},
+        {'bom_no': 'B1', 'Machine_Model': 'DA-01', 'UPH': 'n/a', 'optn_code': 'A'},
+        # B2: สองรุ่นที่มี WB3100 รวมเป็นรุ่นเดียว — 10 แถว ไม่ตัด Outlier
+        *[{'bom_no': 'B2', 'Machine_Model': 'WB3100 A', 'UPH': 900, 'optn_code': 'B'} for _ in range(5)],
+        *[{'bom_no': 'B2', 'Machine_Model': 'WB3100 B', 'UPH': 1100, 'optn_code': 'B'} for _ in range(5)],
+    ]
+    return pd.DataFrame(rows).assign(operation='DIE ATTACH')
+
+
+def _all_boms(client, rendered, name):
+    response = client.get('/all_boms', query_string={'csv_file': name})
+    assert response.status_code == 200
+    return rendered[-1]
+
+
+def test_da_summary_rows(client, rendered):
+    _write('DA test.csv', _da_frame())
+    context = _all_boms(client, rendered, 'DA test.csv')
+
+    assert context['summary_wb'] == [] and context['summary_pnp'] == []
+    assert context['summary_da'] == [
+        {'bom': 'B1', 'model': 'DA-01', 'mean_after': 1000.0, 'adjusted_mean': 1, 'wire_per_unit': 1,
+         'efficiency_ratio': 1000.0, 'no_outlier_removed': '', 'operation': 'DIE ATTACH', 'optn_code': 'A',
+         'da_specific': 'ข้อมูลเฉพาะ DA'},
+        {'bom': 'B2', 'model': 'WB3100', 'mean_after': 1000.0, 'adjusted_mean': 1, 'wire_per_unit': 1,
+         'efficiency_ratio': 1000.0, 'no_outlier_removed': 'ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: 10',
+         'operation': 'DIE ATTACH', 'optn_code': 'B', 'da_specific': 'ข้อมูลเฉพาะ DA'},
+    ]
+
+
+def test_wb_summary_divides_by_wire_count(client, rendered):
+    os.makedirs(app.NOBUMP_FOLDER, exist_ok=True)
+    pd.DataFrame({'BOM_NO': ['W1'], 'NO_BUMP': [4], 'NUMBER_REQUIRED': [2]}).to_excel(
+        os.path.join(app.NOBUMP_FOLDER, 'wire data.xlsx'), index=False)
+    _write('WB test.csv', pd.DataFrame({
+        'bom_no': ['W1', 'W1', 'W1', 'W2'], 'Machine_Model': ['WB-01'] * 4, 'UPH': [1200, 1210, 1190, 1000],
+        'operation': 'LEAD BOND', 'optn_code': 'A',
+    }))
+    rows = _all_boms(client, rendered, 'WB test.csv')['summary_wb']
+
+    # W1: UNIT = NO_BUMP / 2 + NUMBER_REQUIRED = 4, W2 ไม่มีใน NO_BUMP → 1
+    assert [(r['bom'], r['mean_after'], r['wire_per_unit'], r['efficiency_ratio']) for r in rows] == [
+        ('W1', 1200.0, 4, 300.0),
+        ('W2', 1000.0, 1, 1000.0),
+    ]
+    assert rows[0]['no_outlier_removed'] == 'ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: 3'
+
+
+def test_summary_stats_per_bom_model(workdir):
+    df = _da_frame()
+    df['UPH'] = pd.to_numeric(df['UPH'], errors='coerce')
+    df['bom_no'] = df['bom_no'].str.replace('_x000D_', '').str.strip().str.upper()
+    stats = app.summarize_bom_models(df.dropna(subset=['UPH']), 'Machine_Model')
+
+    assert stats[['bom_no', 'Normalized Model', 'rows_after', 'count_before', 'count_after']].values.tolist() == [
+        ['B1', 'DA-01', 20, 21, 20],
+        ['B2', 'WB3100', 10, 10, 10],
+    ]
+    np.testing.assert_allclose(stats['mean'], [1000.0, 1000.0])
+    assert stats['first_method'].iloc[1] == SMALL
+    assert not stats['has_nx116'].any()
+
+
+def _packtype_table(pairs):
+    os.makedirs(app.PACKTYPE_FOLDER, exist_ok=True)
+    pd.DataFrame(pairs, columns=['BOM_NO', 'Assy Pack Type']).to_excel(
+        os.path.join(app.PACKTYPE_FOLDER, 'packtype.xlsx'), index=False)
+
+
+def _package_frame():
+    return pd.DataFrame([
+        ('P1', 'B9', 'M-A', 100),  # B9 ไม่มีใน packtype → ใช้ BOM ถัดไปของรุ่นเดียวกัน
+        ('P1', 'B2', 'M-A', 200),
+        ('P1', 'B3', 'M-A', 300),
+        ('P2', 'B3', 'M-B', 50),
+        ('P2', 'B3', 'M-B', 70),
+        ('P2', 'B2', 'NX-116 X', 10),
+        ('P3', 'B9', 'M-C', 40),
+    ], columns=['Package code', 'bom_no', 'Machine_Model', 'UPH'])
+
+
+def test_package_rows_use_first_known_bom_per_model(client, rendered):
+    _packtype_table([('B2', 'REEL'), ('b3 ', 'TRAY')])
+    _write('PNP test.csv', _package_frame())
+    rows = _all_boms(client, rendered, 'PNP test.csv')['summary_pnp']
+
+    assert [(r['package_code'], r['model'], r['mean_after'], r['efficiency_ratio'], r['assy_pack_type'])
+            for r in rows] == [
+        ('P1', 'M-A', 200.0, 200.0, 'REEL'),
+        ('P2', 'M-B', 60.0, 60.0, 'TRAY'),
+        ('P2', 'NX-116 X', 10.0, 10.0, 'TUBE'),
+        ('P3', 'M-C', 40.0, 40.0, 'ไม่พบ packtype'),
+    ]
+
+
+def test_resolve_model_packtype(workdir):
+    pkg = _package_frame().rename(columns={'Machine_Model': 'model', 'UPH': 'uph'})
+    result = app.resolve_model_packtype(pkg, {'B2': 'REEL', 'B3': 'TRAY'})
+    assert result.to_dict() == {'M-A': 'REEL', 'M-B': 'TRAY', 'NX-116 X': 'TUBE', 'M-C': 'ไม่พบ packtype'}
+
+    # BOM แรกที่พบในตารางเป็นตัวตัดสิน แม้ค่าจะว่าง (เหมือน loop เดิมที่ break ที่ match แรก)
+    result = app.resolve_model_packtype(pkg, {'B2': 'REEL', 'B3': 'TRAY', 'B9': ''})
+    assert result['M-A'] == 'ไม่พบ packtype'
+
+
+def _export(client, name):
+    response = client.get('/export_all_boms_excel', query_string={'csv_file': name})
+    assert response.status_code == 200
+    return response
+
+
+def _exports():
+    return sorted(os.listdir(app.EXPORT_CACHE_FOLDER))
+
+
+def test_export_reuses_the_page_summary(client, rendered, builds):
+    _write('DA test.csv', _da_frame())
+    page = _all_boms(client, rendered, 'DA test.csv')['summary_da']
+    sheet = pd.read_excel(BytesIO(_export(client, 'DA test.csv').get_data()), sheet_name=None)
+
+    assert builds == ['DA test.csv']
+    assert list(sheet) == ['DA Summary']
+    rows = sheet['DA Summary'].to_dict(orient='records')
+    assert [(r['bom'], r['model'], r['Wire Per Hour'], r['UPH']) for r in rows] == \
+        [(r['bom'], r['model'], r['mean_after'], r['efficiency_ratio']) for r in page]
+    assert rows[0]['no_outlier_removed'] == 'ตัด Outlier — ก่อน: 21 หลัง: 20'
+    assert rows[1]['no_outlier_removed'] == 'ไม่ตัด Outlier (ข้อมูลน้อย) — แถว: 10'
+
+
+def test_export_artifact_is_reused_until_the_file_changes(client, builds):
+    _write('DA test.csv', _da_frame())
+    first = _export(client, 'DA test.csv').get_data()
+    exported = _exports()
+    assert len(exported) == 1
+
+    assert _export(client, 'DA test.csv').get_data() == first
+    assert _exports() == exported
+    assert builds == ['DA test.csv']
+
+    df = _da_frame()
+    df.loc[df['bom_no'] == 'B2', 'UPH'] = 2000
+    _write('DA test.csv', df)
+    rows = pd.read_excel(BytesIO(_export(client, 'DA test.csv').get_data())).to_dict(orient='records')
+    assert builds == ['DA test.csv', 'DA test.csv']
+    assert rows[1]['UPH'] == 2000.0
+    assert len(_exports()) == 2 and exported[0] in _exports()  # ไฟล์เก่ารอหมดอายุตาม TTL
+
+
+def test_summary_cache_keeps_one_version_per_file(workdir, builds):
+    _write('DA test.csv', _da_frame())
+    first = app.get_bom_summary('DA test.csv')
+    assert app.get_bom_summary('DA test.csv') is first
+
+    df = _da_frame()
+    df['UPH'] = df['UPH'].replace(1000, 1001)
+    _write('DA test.csv', df)
+    assert app.get_bom_summary('DA test.csv') is not first
+    assert builds == ['DA test.csv', 'DA test.csv']
+    assert len(app._summary_cache) == 1
@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib.figure import Figure
+
+import app
+
+
+# === ค่าที่ส่งให้ browser วาด = ค่าที่ DataFrame.boxplot (ภาพ PNG เดิม) วาด ===
+def _drawn_stats(values):
+    ax = Figure().subplots()
+    artists = pd.DataFrame({'uph': values}).boxplot(column='uph', ax=ax, return_type='dict')
+    caps = sorted(y for cap in artists['caps'] for y in cap.get_ydata())
+    box = artists['boxes'][0].get_ydata()
+    return {
+        'q1': min(box),
+        'q3': max(box),
+        'med': artists['medians'][0].get_ydata()[0],
+        'whislo': caps[0],
+        'whishi': caps[-1],
+        'fliers': sorted(artists['fliers'][0].get_ydata()),
+    }
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_box_stats_match_the_drawn_boxplot(seed):
+    rng = np.random.default_rng(seed)
+    values = np.r_[rng.normal(1000, 80, int(rng.integers(5, 300))), rng.uniform(0, 3000, seed)]
+    stats = app.box_stats(values)
+    drawn = _drawn_stats(values)
+
+    for name in ['q1', 'q3', 'med', 'whislo', 'whishi']:
+        assert stats[name] == pytest.approx(drawn[name]), name
+    assert sorted(stats['fliers']) == pytest.approx(drawn['fliers'])
+    assert stats['n'] == len(values)
+    assert stats['mean'] == pytest.approx(values.mean())
+
+
+def test_model_box_stats_before_and_after():
+    before = pd.DataFrame({'machine_model': ['A'] * 4 + ['B'] * 3, 'uph': [1, 2, 3, 100, 5, 6, 7]})
+    after = before[before['uph'] != 100]
+    result = app.model_box_stats(before, after[after['machine_model'] == 'A'], 'machine_model')
+    assert [m['model'] for m in result] == ['A', 'B']
+    assert result[0]['before']['n'] == 4 and result[0]['after']['n'] == 3
+    assert result[1]['after'] is None
+
+
+# === cache ของ /box_stats ===
+def _write_data(name, rows):
+    rng = np.random.default_rng(rows)
+    pd.DataFrame({
+        'bom_no': 'B1',
+        'operation': 'DIE ATTACH',
+        'Machine_Model': rng.choice(['DA-1', 'DA-2'], rows),
+        'UPH': np.round(rng.normal(900, 40, rows), 1),
+    }).to_csv(os.path.join(app.DATA_FOLDER, name), index=False)
+
+
+@pytest.fixture
+def frame_loads(monkeypatch):
+    calls = []
+    original = app.load_display_frame
+
+    def spy(*args):
+        calls.append(args)
+        return original(*args)
+
+    monkeypatch.setattr(app, 'load_display_frame', spy)
+    return calls
+
+
+def _cached_files():
+    return os.listdir(app.BOX_STATS_FOLDER)
+
+
+def test_box_stats_are_computed_once_per_input(client, frame_loads):
+    _write_data('DA test.csv', 40)
+
+    first = client.get('/box_stats?file=DA test.csv&bom=B1')
+    assert first.status_code == 200
+    assert len(frame_loads) == 1
+    assert len(_cached_files()) == 1
+
+    # ผู้ใช้อื่น (ไม่มี ETag) ได้ผลจาก cache โดยไม่โหลดไฟล์ซ้ำ
+    second = client.get('/box_stats?file=DA test.csv&bom=B1')
+    assert second.get_json() == first.get_json()
+    assert len(frame_loads) == 1
+
+    client.get('/box_stats?file=DA test.csv&bom=OTHER')
+    assert len(frame_loads) == 2
+    assert len(_cached_files()) == 2
+
+
+def test_box_stats_recomputed_when_the_file_changes(client, frame_loads):
+    _write_data('DA test.csv', 40)
+    first = client.get('/box_stats?file=DA test.csv').get_json()
+
+    _write_data('DA test.csv', 60)
+    second = client.get('/box_stats?file=DA test.csv').get_json()
+
+    assert len(frame_loads) == 2
+    assert sum(m['before']['n'] for m in second['models']) == 60
+    assert second != first
+
+
+def test_evicted_box_stats_are_recomputed(client, frame_loads):
+    _write_data('DA test.csv', 40)
+    client.get('/box_stats?file=DA test.csv')
+    for name in _cached_files():
+        os.remove(os.path.join(app.BOX_STATS_FOLDER, name))
+
+    assert client.get('/box_stats?file=DA test.csv').status_code == 200
+    assert len(frame_loads) == 2
+
+
+def test_box_stats_missing_file(client):
+    response = client.get('/box_stats?file=missing.csv')
+    assert response.status_code == 404
+    assert _cached_files() == []
@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def da_file(client):
+    path = os.path.join(app.DATA_FOLDER, 'DA test.csv')
+    pd.DataFrame({
+        'bom_no': ['B1'] * 20, 'operation': ['DIE ATTACH'] * 20, 'optn_code': ['A'] * 20,
+        'Machine_Model': ['DA-01'] * 20, 'UPH': [1000 + i for i in range(20)],
+    }).to_csv(path, index=False)
+    return path
+
+
+def _all_boms(client, **headers):
+    return client.get('/all_boms', query_string={'csv_file': 'DA test.csv'}, headers=headers)
+
+
+def test_unchanged_page_is_answered_with_304(client, da_file):
+    first = _all_boms(client)
+    assert first.status_code == 200
+    assert 'B1' in first.get_data(as_text=True)
+    etag = first.headers['ETag']
+
+    again = _all_boms(client, **{'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+
+    pd.read_csv(da_file).assign(UPH=900).to_csv(da_file, index=False)
+    changed = _all_boms(client, **{'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_failed_summary_is_not_cached(client, da_file, monkeypatch):
+    etag = _all_boms(client).headers['ETag']
+
+    def broken(*args, **kwargs):
+        raise OSError('อ่านไฟล์ไม่ได้')
+
+    original = app.get_bom_summary
+    monkeypatch.setattr(app, 'get_bom_summary', broken)
+    failed = _all_boms(client)
+    assert failed.status_code == 500
+    assert 'ETag' not in failed.headers
+    assert 'อ่านไฟล์ไม่ได้' in failed.get_data(as_text=True)
+
+    # กลับมาอ่านได้ — browser ที่ยังถือ ETag ของผลสำเร็จได้ 304 ส่วนที่เคยได้หน้า error ได้ผลใหม่
+    monkeypatch.setattr(app, 'get_bom_summary', original)
+    assert _all_boms(client, **{'If-None-Match': etag}).status_code == 304
+    recovered = _all_boms(client)
+    assert recovered.status_code == 200
+    assert 'B1' in recovered.get_data(as_text=True)
+
+
+def test_display_data_errors_carry_an_error_status(client, da_file, monkeypatch):
+    missing = client.get('/display_data', query_string={'file': 'nope.csv'})
+    assert missing.status_code == 404
+    assert 'ETag' not in missing.headers
+
+    def broken(*args, **kwargs):
+        raise OSError('อ่านไฟล์ไม่ได้')
+
+    monkeypatch.setattr(app, 'load_display_frame', broken)
+    failed = client.get('/display_data', query_string={'file': 'DA test.csv', 'bom': 'B1'})
+    assert failed.status_code == 500
+    assert 'ETag' not in failed.headers
@@ -0,0 +1,130 @@
+import os
+from collections import deque
+
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def watcher(workdir, monkeypatch):
+    """สถานะ watcher ใหม่ทุก test (listener ที่ลงทะเบียนใน test ไม่ค้างไปถึง test อื่น)"""
+    monkeypatch.setattr(app, '_watch_snapshot', {})
+    monkeypatch.setattr(app, '_watch_seq', 0)
+    monkeypatch.setattr(app, '_watch_events', deque(maxlen=app.WATCH_EVENT_HISTORY))
+    monkeypatch.setattr(app, '_watch_listeners', list(app._watch_listeners))
+    monkeypatch.setattr(app, '_watch_started', False)
+    app.rescan_folders()
+    return monkeypatch
+
+
+def _write(name, uph, folder=None):
+    path = os.path.join(folder or app.DATA_FOLDER, name)
+    pd.DataFrame({
+        'bom_no': ['B1'] * len(uph), 'Machine_Model': 'DA-01', 'operation': 'DIE ATTACH', 'UPH': uph,
+    }).to_csv(path, index=False)
+    return path
+
+
+def _changes(events):
+    return [(e['seq'], e['file'], e['kind']) for e in events]
+
+
+def test_rescan_reports_added_modified_deleted(watcher):
+    path = _write('a.csv', [1, 2])
+    open(os.path.join(app.DATA_FOLDER, '~$a.xlsx'), 'w').close()
+    open(os.path.join(app.DATA_FOLDER, 'b.csv.tmp'), 'w').close()
+
+    added = app.rescan_folders()
+    assert _changes(added) == [(1, 'a.csv', 'added')]
+    assert added[0]['path'] == os.path.normcase(os.path.abspath(path))
+    assert added[0]['version'] == [os.stat(path).st_mtime_ns, os.stat(path).st_size]
+    assert app.rescan_folders() == []
+
+    _write('a.csv', [1, 2, 3])
+    assert _changes(app.rescan_folders()) == [(2, 'a.csv', 'modified')]
+
+    os.remove(path)
+    deleted = app.rescan_folders()
+    assert _changes(deleted) == [(3, 'a.csv', 'deleted')]
+    assert deleted[0]['version'] is None
+    assert app.data_change_seq() == 3
+
+
+def test_failing_listener_does_not_stop_the_others(watcher):
+    seen = []
+
+    @app.on_data_change
+    def broken(events):
+        raise RuntimeError('boom')
+
+    @app.on_data_change
+    def record(events):
+        seen.extend(e['file'] for e in events)
+
+    _write('a.csv', [1])
+    assert len(app.rescan_folders()) == 1
+    assert seen == ['a.csv']
+
+
+def test_changes_since_reports_lost_history(watcher):
+    watcher.setattr(app, '_watch_events', deque(maxlen=2))
+    for name in ['a.csv', 'b.csv', 'c.csv']:
+        _write(name, [1])
+        app.rescan_folders()
+
+    assert _changes(app.data_changes_since(1)) == [(2, 'b.csv', 'added'), (3, 'c.csv', 'added')]
+    assert app.data_changes_since(3) == []
+    assert app.data_changes_since(0) is None  # event seq 1 หลุดจากประวัติแล้ว
+
+
+def test_change_drops_cached_entries_of_that_file(watcher):
+    changed = _write('DA test.csv', [1000] * 5)
+    kept = _write('DA other.csv', [1000] * 5)
+    app.rescan_folders()
+    for path in [changed, kept]:
+        app.read_dataset(path)
+        app.get_file_facets(os.path.basename(path))
+        app.get_bom_summary(os.path.basename(path))
+    app.get_file_index()
+
+    def cached():
+        # path ใน key ของแคชเป็น normcase(abspath) — เทียบด้วยชื่อไฟล์แบบ normcase (dataset แยก entry ตาม option การอ่าน)
+        return {
+            'datasets': sorted({os.path.basename(k[0]) for k in app._dataset_cache}),
+            'index': sorted(os.path.normcase(f) for f in app._file_index),
+            'facets': sorted(os.path.normcase(f) for f in app._facet_cache),
+            'summaries': sorted(os.path.normcase(os.path.basename(k[0])) for k in app._summary_cache),
+        }
+    both = sorted(os.path.normcase(f) for f in ['DA other.csv', 'DA test.csv'])
+    assert cached() == dict.fromkeys(['datasets', 'index', 'facets', 'summaries'], both)
+
+    _write('DA test.csv', [2000] * 5)
+    app.rescan_folders()
+    assert cached() == dict.fromkeys(['datasets', 'index', 'facets', 'summaries'], [os.path.normcase('DA other.csv')])
+
+
+def test_reference_change_drops_the_signature(watcher):
+    watcher.setattr(app, '_reference_signature', ('stale',))
+    _write('other.csv', [1], folder=app.FRAMESTOCK_FOLDER)
+    app.rescan_folders()
+    assert app._reference_signature == ('stale',)
+
+    os.makedirs(app.PACKTYPE_FOLDER, exist_ok=True)
+    _write('packtype.csv', [1], folder=app.PACKTYPE_FOLDER)
+    app.rescan_folders()
+    assert app._reference_signature is None
+
+
+def test_listing_comes_from_the_snapshot_once_started(watcher):
+    _write('a.csv', [1])
+    assert app.watched_files(app.DATA_FOLDER) == ['a.csv']  # ยังไม่เริ่ม — os.listdir
+
+    app.rescan_folders()
+    watcher.setattr(app, '_watch_started', True)
+    _write('b.csv', [1])
+    assert app.watched_files(app.DATA_FOLDER) == ['a.csv']
+
+    app.rescan_folders()
+    assert sorted(app.watched_files(app.DATA_FOLDER)) == ['a.csv', 'b.csv']
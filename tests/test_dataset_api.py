@@ -0,0 +1,84 @@
+import gzip
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import app
+
+QUERY = {'plant': 'utl1', 'year_quarter': '2025Q1', 'operation': 'LEAD BOND ROV'}
+
+
+def _store_rows(n):
+    return pd.DataFrame({
+        'date_time_start': [f'2025-01-01 {i // 60:02d}:{i % 60:02d}:00' for i in range(n)],
+        'bom_no': [f'B{i % 3}' for i in range(n)], 'operation': 'LEAD BOND ROV', 'optn_code': 'A',
+        'Machine_Model': 'WB-01', 'UPH': [float(i) for i in range(n)],
+    })
+
+
+def _get(client, **params):
+    response = client.get('/api/dataset', query_string=dict(QUERY, **params))
+    return response, (json.loads(response.get_data()) if response.status_code == 200 else None)
+
+
+@pytest.fixture
+def store(client):
+    app.append_apl_rows(QUERY['plant'], QUERY['year_quarter'], QUERY['operation'], _store_rows(450))
+
+
+def test_pages_cover_every_row_once(client, store):
+    seen, offset = [], 0
+    while True:
+        _, page = _get(client, offset=offset, limit=200)
+        assert page['total'] == 450
+        assert page['offset'] == offset
+        seen += page['data']['UPH']
+        offset += page['rows']
+        if page['rows'] < 200:
+            break
+    assert seen == [float(i) for i in range(450)]
+
+
+def test_columns_and_records_format(client, store):
+    _, page = _get(client, columns='bom_no,UPH,missing', limit=2)
+    assert page['columns'] == ['bom_no', 'UPH']
+    assert page['data'] == {'bom_no': ['B0', 'B1'], 'UPH': [0.0, 1.0]}
+
+    _, page = _get(client, format='records', offset=448)
+    assert [r['UPH'] for r in page['records']] == [448.0, 449.0]
+
+
+def test_etag_and_compression(client, store):
+    first, _ = _get(client, limit=200)
+    etag = first.headers['ETag']
+    again = client.get('/api/dataset', query_string=dict(QUERY, limit=200), headers={'If-None-Match': etag})
+    assert again.status_code == 304
+
+    zipped = client.get('/api/dataset', query_string=dict(QUERY, limit=200), headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(zipped.get_data())) == json.loads(first.get_data())
+
+    app.append_apl_rows(QUERY['plant'], QUERY['year_quarter'], QUERY['operation'], _store_rows(460).iloc[450:])
+    changed, page = _get(client, limit=200)
+    assert changed.headers['ETag'] != etag
+    assert page['total'] == 460
+
+
+def test_sources_in_priority_order(client):
+    assert _get(client)[0].status_code == 404
+
+    os.makedirs(app.JS_DATASET_FOLDER, exist_ok=True)
+    with open(os.path.join(app.JS_DATASET_FOLDER, 'WB2025Q1.js'), 'w', encoding='utf-8') as fh:
+        fh.write('window.WB2025Q1_raw = ' + json.dumps([{'UPH': 1}, {'UPH': 2}]) + ';')
+    _, page = _get(client)
+    assert (page['source'], page['total']) == ('js', 2)
+
+    app.append_apl_rows(QUERY['plant'], QUERY['year_quarter'], QUERY['operation'], _store_rows(5))
+    _, page = _get(client)
+    assert (page['source'], page['total']) == ('apl_store', 5)
+
+
+def test_missing_parameters(client):
+    assert client.get('/api/dataset', query_string={'plant': 'utl1'}).status_code == 400
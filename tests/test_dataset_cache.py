@@ -0,0 +1,98 @@
+import glob
+import os
+from collections import OrderedDict
+
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def parses(workdir, monkeypatch):
+    """จดชื่อไฟล์ทุกครั้งที่ต้อง parse csv / xlsx จริง"""
+    calls = []
+    read_csv, read_excel = pd.read_csv, pd.read_excel
+    monkeypatch.setattr(pd, 'read_csv', lambda path, **kw: calls.append(os.path.basename(path)) or read_csv(path, **kw))
+    monkeypatch.setattr(pd, 'read_excel', lambda path, **kw: calls.append(os.path.basename(path)) or read_excel(path, **kw))
+    return calls
+
+
+def _write_csv(name, uph):
+    path = os.path.join(app.DATA_FOLDER, name)
+    pd.DataFrame({'bom_no': ['B1'] * len(uph), 'UPH': uph}).to_csv(path, index=False)
+    return path
+
+
+def _sidecars(path):
+    return glob.glob(os.path.join(app.DATASET_CACHE_FOLDER, glob.escape(app.safe_filename(os.path.basename(path))) + '_*'))
+
+
+def test_second_read_comes_from_memory(parses):
+    path = _write_csv('a.csv', [1, 2, 3])
+    first = app.read_dataset(path)
+    first.loc[0, 'UPH'] = 999  # ผู้เรียกแก้ไขสำเนาของตัวเองได้
+
+    again = app.read_dataset(path)
+    assert parses == ['a.csv']
+    assert again['UPH'].tolist() == [1, 2, 3]
+
+
+def test_changed_file_is_parsed_again(parses):
+    path = _write_csv('a.csv', [1, 2, 3])
+    app.read_dataset(path)
+
+    _write_csv('a.csv', [4, 5, 6])  # ขนาดเท่าเดิม mtime ใหม่
+    assert app.read_dataset(path)['UPH'].tolist() == [4, 5, 6]
+
+    st = os.stat(path)
+    _write_csv('a.csv', [7, 8, 9, 10])
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))  # mtime เดิม ขนาดใหม่
+    assert app.read_dataset(path)['UPH'].tolist() == [7, 8, 9, 10]
+    assert parses == ['a.csv'] * 3
+
+
+def test_restart_reads_the_sidecar(parses, monkeypatch):
+    path = _write_csv('a.csv', [1, 2, 3])
+    app.read_dataset(path)
+    assert len(_sidecars(path)) == 1
+
+    monkeypatch.setattr(app, '_dataset_cache', OrderedDict())  # process ใหม่
+    assert app.read_dataset(path)['UPH'].tolist() == [1, 2, 3]
+    assert parses == ['a.csv']
+
+    _write_csv('a.csv', [4, 5])
+    app.read_dataset(path)
+    assert len(_sidecars(path)) == 1  # sidecar ของ version เก่าถูกลบ
+
+
+def test_broken_sidecar_is_replaced(parses, monkeypatch):
+    path = _write_csv('a.csv', [1, 2, 3])
+    app.read_dataset(path)
+    for sidecar in _sidecars(path):
+        with open(sidecar, 'wb') as fh:
+            fh.write(b'not a frame')
+
+    monkeypatch.setattr(app, '_dataset_cache', OrderedDict())
+    assert app.read_dataset(path)['UPH'].tolist() == [1, 2, 3]
+    assert parses == ['a.csv', 'a.csv']
+    monkeypatch.setattr(app, '_dataset_cache', OrderedDict())
+    app.read_dataset(path)
+    assert parses == ['a.csv', 'a.csv']
+
+
+def test_read_options_are_cached_separately(parses):
+    path = _write_csv('a.csv', [1, 2, 3])
+    assert len(app.read_dataset(path)) == 3
+    assert len(app.read_dataset(path, nrows=1)) == 1
+    assert len(app.read_dataset(path)) == 3
+    assert parses == ['a.csv', 'a.csv']
+
+
+def test_memory_cache_is_bounded(parses, monkeypatch):
+    monkeypatch.setattr(app, 'DATASET_CACHE_MAX_ENTRIES', 2)
+    paths = [_write_csv(f'{name}.csv', [1]) for name in 'abc']
+    for path in paths:
+        app.read_dataset(path)
+    assert len(app._dataset_cache) == 2
+    assert os.path.normcase(os.path.abspath(paths[0])) not in {k[0] for k in app._dataset_cache}
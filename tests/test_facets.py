@@ -0,0 +1,57 @@
+import os
+
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def builds(workdir, monkeypatch):
+    """จดชื่อไฟล์ที่ต้องอ่านเพื่อสร้าง facet"""
+    calls = []
+    original = app.build_file_facets
+    monkeypatch.setattr(app, 'build_file_facets', lambda path: calls.append(os.path.basename(path)) or original(path))
+    return calls
+
+
+def _write(name, boms):
+    pd.DataFrame({
+        ' BOM_NO ': boms,
+        'Operation': ['WB'] * len(boms),
+        'UPH': range(len(boms)),
+    }).to_csv(os.path.join(app.DATA_FOLDER, name), index=False)
+
+
+def test_facets_are_sorted_values_with_counts(builds):
+    _write('a.csv', ['B2', 'B1', 'B2', None, 'B10'])
+    facets = app.get_file_facets('a.csv')
+    assert facets == {'bom_no': [['B1', 1], ['B10', 1], ['B2', 2]], 'operation': [['WB', 5]]}
+    assert app.facet_values(facets, 'bom_no') == ['B1', 'B10', 'B2']
+    assert app.facet_values(facets, 'optn_code') == []
+
+
+def test_facets_are_built_once_per_version(builds, monkeypatch):
+    _write('a.csv', ['B1', 'B2'])
+    app.get_file_facets('a.csv')
+    app.get_file_facets('a.csv')
+    assert builds == ['a.csv']
+
+    monkeypatch.setattr(app, '_facet_cache', {})  # process ใหม่ — อ่านจาก cache/facets
+    assert app.get_file_facets('a.csv')['bom_no'] == [['B1', 1], ['B2', 1]]
+    assert builds == ['a.csv']
+
+    _write('a.csv', ['B3'])
+    assert app.get_file_facets('a.csv')['bom_no'] == [['B3', 1]]
+    assert builds == ['a.csv', 'a.csv']
+
+
+def test_routes_use_the_display_name(client, builds):
+    _write('Data WB test.csv', ['B2', 'B1', 'B2'])
+
+    assert client.get('/get_bom_list', query_string={'file': 'Data WB test'}).get_json() == ['B1', 'B2']
+    facets = client.get('/get_file_facets', query_string={'file': 'Data WB test'}).get_json()
+    assert facets['bom_no'] == [{'value': 'B1', 'count': 1}, {'value': 'B2', 'count': 2}]
+    assert builds == ['Data WB test.csv']
+
+    assert client.get('/get_file_facets', query_string={'file': 'missing'}).status_code == 404
@@ -0,0 +1,90 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def classified(workdir, monkeypatch):
+    """จดชื่อไฟล์ที่ถูกเปิดเพื่อจัดกลุ่ม"""
+    calls = []
+    original = app.classify_data_file
+    monkeypatch.setattr(app, 'classify_data_file', lambda path: calls.append(os.path.basename(path)) or original(path))
+    return calls
+
+
+def _write(name, operation):
+    path = os.path.join(app.DATA_FOLDER, name)
+    df = pd.DataFrame({'bom_no': ['B1'], 'operation': [operation], 'UPH': [1]})
+    if name.endswith('.csv'):
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+    return path
+
+
+def test_files_are_grouped_by_content(classified):
+    _write('one.csv', 'LEAD BOND')
+    _write('two.xlsx', 'PKG PICK PLACE')
+    _write('three.csv', 'DIE ATTACH')
+
+    index = app.get_file_index()
+    assert {f: (e['wb'], e['pnp'], e['da']) for f, e in index.items()} == {
+        'one.csv': (True, False, False),
+        'two.xlsx': (False, True, False),
+        'three.csv': (False, False, True),
+    }
+    assert index['two.xlsx']['display_name'] == 'two'
+
+
+def test_only_new_or_changed_files_are_opened(classified):
+    _write('one.csv', 'LEAD BOND')
+    _write('two.csv', 'DIE ATTACH')
+    app.get_file_index()
+    assert sorted(classified) == ['one.csv', 'two.csv']
+
+    classified.clear()
+    app.get_file_index()
+    assert classified == []
+
+    _write('two.csv', 'PKG PICK PLACE')
+    _write('three.csv', 'DIE ATTACH')
+    index = app.get_file_index()
+    assert sorted(classified) == ['three.csv', 'two.csv']
+    assert index['two.csv']['pnp'] and not index['two.csv']['da']
+
+
+def test_deleted_file_leaves_the_index(classified):
+    path = _write('one.csv', 'LEAD BOND')
+    _write('two.csv', 'DIE ATTACH')
+    app.get_file_index()
+
+    os.remove(path)
+    assert list(app.get_file_index()) == ['two.csv']
+    with open(app.FILE_INDEX_PATH, encoding='utf-8') as fh:
+        assert list(json.load(fh)) == ['two.csv']
+
+
+def test_index_survives_restart(classified, monkeypatch):
+    _write('one.csv', 'LEAD BOND')
+    before = app.get_file_index()
+
+    monkeypatch.setattr(app, '_file_index', None)  # process ใหม่ — โหลดจาก cache/file_index.json
+    classified.clear()
+    assert app.get_file_index() == before
+    assert classified == []
+
+
+def test_unreadable_file_is_recorded_not_retried(classified):
+    path = os.path.join(app.DATA_FOLDER, 'broken.xlsx')
+    with open(path, 'wb') as fh:
+        fh.write(b'not a workbook')
+
+    entry = app.get_file_index()['broken.xlsx']
+    assert 'error' in entry
+    assert not (entry['wb'] or entry['pnp'] or entry['da'])
+    app.get_file_index()
+    assert classified == ['broken.xlsx']
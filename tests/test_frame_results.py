@@ -0,0 +1,131 @@
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def _result(seed, rows=200):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Group': [f'Group {i % 7} (2025-01-01)' for i in range(rows)],
+        'sec': rng.normal(30, 5, rows),
+        'SPEED': pd.array(rng.integers(1, 4, rows), dtype='Int64'),
+    })
+
+
+def _key(name, sid='s1'):
+    return (sid, name)
+
+
+def _files():
+    return sorted(os.listdir(app.FRAME_RESULT_FOLDER))
+
+
+@pytest.fixture
+def tight_budget(workdir, monkeypatch):
+    """งบหน่วยความจำ 0 MB — เก็บในหน่วยความจำได้แค่ผลล่าสุด"""
+    monkeypatch.setattr(app, 'FRAME_RESULT_MEMORY_MB', 0)
+    monkeypatch.setattr(app, 'APP_MODE', 'development')
+    return workdir
+
+
+def test_least_recent_result_spills_and_reloads(tight_budget):
+    a, b = _result(1), _result(2)
+    app.store_frame_result(_key('a.xlsx'), a)
+    app.store_frame_result(_key('b.xlsx'), b)
+
+    assert app._frame_results[_key('a.xlsx')]['df'] is None
+    assert app._frame_results[_key('b.xlsx')]['df'] is b
+    assert len(_files()) == 1
+
+    pd.testing.assert_frame_equal(app.get_frame_result(_key('a.xlsx')), a)
+    # a กลับเข้าหน่วยความจำ (ไฟล์ของ a ถูกลบ) และ b ที่ไม่ได้ใช้นานสุดถูกย้ายลงดิสก์แทน
+    assert app._frame_results[_key('b.xlsx')]['df'] is None
+    assert app._frame_results[_key('a.xlsx')]['path'] is None
+    assert len(_files()) == 1
+    pd.testing.assert_frame_equal(app.get_frame_result(_key('b.xlsx')), b)
+
+
+def test_results_within_budget_stay_in_memory(workdir, monkeypatch):
+    monkeypatch.setattr(app, 'APP_MODE', 'development')
+    monkeypatch.setattr(app, 'FRAME_RESULT_MEMORY_MB', 64)
+    for i in range(5):
+        app.store_frame_result(_key(f'{i}.xlsx'), _result(i))
+    assert all(e['df'] is not None for e in app._frame_results.values())
+    assert _files() == []
+
+
+def test_sessions_do_not_share_results(tight_budget):
+    app.store_frame_result(_key('a.xlsx', 's1'), _result(1))
+    app.store_frame_result(_key('a.xlsx', 's2'), _result(2))
+    pd.testing.assert_frame_equal(app.get_frame_result(_key('a.xlsx', 's1')), _result(1))
+    pd.testing.assert_frame_equal(app.get_frame_result(_key('a.xlsx', 's2')), _result(2))
+    assert app.get_frame_result(_key('a.xlsx', 's3')) is None
+
+
+def test_spill_disabled_drops_old_results(tight_budget, monkeypatch):
+    monkeypatch.setattr(app, 'FRAME_RESULT_SPILL', False)
+    app.store_frame_result(_key('a.xlsx'), _result(1))
+    app.store_frame_result(_key('b.xlsx'), _result(2))
+    assert app.get_frame_result(_key('a.xlsx')) is None
+    assert app.get_frame_result(_key('b.xlsx')) is not None
+    assert _files() == []
+
+
+def test_spilled_results_are_capped(tight_budget, monkeypatch):
+    monkeypatch.setattr(app, 'FRAME_RESULT_MAX_SPILLED', 2)
+    for i in range(5):
+        app.store_frame_result(_key(f'{i}.xlsx'), _result(i))
+    assert list(app._frame_results) == [_key('2.xlsx'), _key('3.xlsx'), _key('4.xlsx')]
+    assert len(_files()) == 2
+    assert app.get_frame_result(_key('0.xlsx')) is None
+
+
+def test_replacing_a_result_removes_its_old_file(tight_budget):
+    app.store_frame_result(_key('a.xlsx'), _result(1))
+    app.store_frame_result(_key('b.xlsx'), _result(2))  # a ลงดิสก์
+    app.store_frame_result(_key('a.xlsx'), _result(3))  # ผลใหม่ของ a แทนไฟล์เดิม / b ลงดิสก์
+    assert len(_files()) == 1
+    pd.testing.assert_frame_equal(app.get_frame_result(_key('a.xlsx')), _result(3))
+
+
+# === โหมด production: ผลเขียนลงดิสก์ทันที ให้ process อื่นโหลดได้ ===
+def test_production_result_is_visible_to_another_process(workdir, monkeypatch):
+    monkeypatch.setattr(app, 'APP_MODE', 'production')
+    key = _key('a.xlsx')
+    app.store_frame_result(key, _result(1))
+    worker_a = app._frame_results
+
+    # process ที่สอง (หน่วยความจำว่าง) โหลดผลจากไฟล์
+    monkeypatch.setattr(app, '_frame_results', OrderedDict())
+    pd.testing.assert_frame_equal(app.get_frame_result(key), _result(1))
+
+    # process ที่สองประมวลผลใหม่ → process แรกต้องเห็นผลใหม่ ไม่ใช่ผลเก่าในหน่วยความจำ
+    time.sleep(0.01)
+    app.store_frame_result(key, _result(2, rows=50))
+    monkeypatch.setattr(app, '_frame_results', worker_a)
+    pd.testing.assert_frame_equal(app.get_frame_result(key), _result(2, rows=50))
+
+    # ไฟล์ถูกลบ (ไฟล์ต้นทางเปลี่ยน / หมดอายุ) → ไม่มีผล
+    for name in _files():
+        os.remove(os.path.join(app.FRAME_RESULT_FOLDER, name))
+    assert app.get_frame_result(key) is None
+
+
+def test_clear_spilled_frame_results_by_age(workdir):
+    old = os.path.join(app.FRAME_RESULT_FOLDER, 'old.parquet')
+    new = os.path.join(app.FRAME_RESULT_FOLDER, 'new.parquet')
+    for path in (old, new):
+        open(path, 'wb').close()
+    stale = time.time() - app.FRAME_RESULT_TTL_SECONDS - 60
+    os.utime(old, (stale, stale))
+
+    assert app.clear_spilled_frame_results(app.FRAME_RESULT_TTL_SECONDS) == 1
+    assert _files() == ['new.parquet']
+    assert app.clear_spilled_frame_results() == 1
+    assert _files() == []
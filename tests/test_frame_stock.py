@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+OP = 'Unnamed: 2'
+TIME = 'Unnamed: 1'
+STEP = 'Unnamed: 5'
+MACHINE = 'Unnamed: 3'
+DATE = 'Unnamed: 0'
+
+
+def _make_frame(seed, n=400):
+    """สร้าง df หลังขั้นเตรียมคอลัมน์ของ frame_stock (กรอง op, reset_index, คอลัมน์ผลลัพธ์ว่าง)"""
+    rng = np.random.default_rng(seed)
+    ops = rng.choice(['PRO'] * 6 + ['CUC', 'ERRSET', 'ERRRCV', 'ERRCLR', 'DMC', 'DMW'], n)
+    # เครื่องเดิมต่อเนื่องเป็นช่วง ๆ แล้วสลับเครื่อง
+    segment = np.cumsum(rng.random(n) < 0.08)
+    machines = np.array(['ST\\WB01-A1', 'ST\\WB02B', 'ST\\WB03-X9'])[segment % 3]
+
+    steps = rng.integers(1, 6, n).astype(float)
+    steps[rng.random(n) < 0.05] = np.nan
+    seconds = np.cumsum(rng.integers(5, 120, n)) % 86400
+    times = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds]
+    times = [t if rng.random() > 0.03 else 'bad' for t in times]
+    dates = np.where(np.arange(n) < n // 2, '2025-01-01', '2025-01-02').astype(object)
+    dates[rng.random(n) < 0.03] = None
+    speed = rng.choice([2540.0, 5080.0, np.nan], n)
+
+    df = pd.DataFrame({DATE: dates, TIME: times, OP: ops, MACHINE: machines, STEP: steps, 'Unnamed: 10': speed})
+    df['Speed'] = (df['Unnamed: 10'] / 10 / 25.4).round().astype('Int64')
+    df['SPEED'] = None
+    df['sec'] = None
+    df['min'] = None
+    df['Reverse'] = None
+    df['Group'] = None
+    df['Average'] = ''
+    df['Data Point'] = ''
+    df['DateOnly'] = pd.to_datetime(df[DATE], errors='coerce').dt.date
+    return df
+
+
+def _normalise(values):
+    return [None if (not isinstance(v, str) and pd.isna(v)) else v for v in values]
+
+
+# === SPEED ของ PRO จาก CUC ก่อนหน้า (user-008) ===
+def _ref_cuc_speed(df):
+    df = df.copy()
+    for i, row in df.iterrows():
+        if row[OP] == 'PRO':
+            cuc_rows = df.loc[:i - 1]
+            matched = cuc_rows[(cuc_rows[OP] == 'CUC') & (cuc_rows[MACHINE] == row[MACHINE]) & cuc_rows['Speed'].notna()]
+            if not matched.empty:
+                df.at[i, 'SPEED'] = matched.iloc[-1]['Speed']
+    return df['SPEED']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_cuc_speed_matches_row_scan(seed):
+    df = _make_frame(seed)
+    expected = _ref_cuc_speed(df)
+    result = app.propagate_cuc_speed(df, OP, MACHINE)
+    assert result.index.equals(df.index)
+    assert _normalise(result) == _normalise(expected)
+
+
+def test_cuc_speed_ignores_other_machines_and_empty_speed():
+    df = pd.DataFrame({
+        OP: ['CUC', 'PRO', 'CUC', 'PRO', 'CUC', 'PRO'],
+        MACHINE: ['A', 'B', 'A', 'A', 'A', 'A'],
+        'Speed': pd.array([10, None, 20, None, None, None], dtype='Int64'),
+    })
+    assert _normalise(app.propagate_cuc_speed(df, OP, MACHINE)) == [None, None, None, 20, None, 20]
+
+
+# === กลุ่ม strip / เวลา / ค่าเฉลี่ยต่อกลุ่ม (user-009) ===
+def _ref_strip_groups(df):
+    df = df.copy()
+    groups, current, last_machine = [], [], None
+    for idx in df[df[OP] == 'PRO'].index:
+        step, machine = df.at[idx, STEP], df.at[idx, MACHINE]
+        if pd.isna(step):
+            continue
+        if last_machine is not None and machine != last_machine:
+            if len(current) > 1:
+                groups.append(current.copy())
+            current = []
+        current.append(idx)
+        last_machine = machine
+        if step == 1:
+            if len(current) > 1:
+                groups.append(current.copy())
+            current, last_machine = [], None
+    if len(current) > 1:
+        groups.append(current.copy())
+
+    error_ops = ['ERRSET', 'ERRRCV', 'ERRCLR', 'DMC', 'DMW']
+    tracker = {}
+    for group in groups:
+        group_df = df.loc[group].copy()
+        group_df['DateOnly'] = pd.to_datetime(group_df[DATE], errors='coerce').dt.date
+        for date, sub_df in group_df.groupby('DateOnly'):
+            sub = sub_df.index.tolist()
+            if len(sub) < 2:
+                continue
+            date_str = str(date)
+            tracker[date_str] = tracker.get(date_str, 0) + 1
+            name = f"Group {tracker[date_str]} ({date_str})"
+            if df.at[sub[-1], STEP] != 1:
+                for idx in sub:
+                    df.at[idx, 'Group'] = f"Invalid {name}"
+                continue
+            deltas = []
+            for idx in sub:
+                df.at[idx, 'Group'] = name
+            for prev_idx, curr_idx in zip(sub, sub[1:]):
+                if df.at[curr_idx, STEP] > df.at[prev_idx, STEP]:
+                    df.loc[curr_idx, ['sec', 'min', 'Reverse']] = 'Out of Order'
+                    continue
+                between = df.loc[prev_idx + 1: curr_idx - 1]
+                if between[OP].astype(str).str.upper().isin(error_ops).any():
+                    df.loc[curr_idx, ['sec', 'min', 'Reverse']] = 'Machine Error'
+                    continue
+                t1 = pd.to_datetime(df.at[prev_idx, TIME], format='%H:%M:%S', errors='coerce')
+                t2 = pd.to_datetime(df.at[curr_idx, TIME], format='%H:%M:%S', errors='coerce')
+                if pd.notnull(t1) and pd.notnull(t2):
+                    delta_sec = (t2 - t1).total_seconds()
+                    delta_str = str(pd.to_timedelta(abs(delta_sec), unit='s')).split(' ')[-1]
+                    df.at[curr_idx, 'sec'] = abs(delta_sec)
+                    df.at[curr_idx, 'min'] = delta_str
+                    df.at[curr_idx, 'Reverse'] = f"{t2.time()} - {t1.time()} = {delta_str}"
+                    deltas.append(abs(delta_sec))
+            if deltas:
+                df.at[sub[-1], 'Average'] = f"Average-Group = {round(sum(deltas) / len(deltas), 4)} sec/strip"
+                df.at[sub[-1], 'Data Point'] = str(len(deltas))
+    return df
+
+
+STRIP_COLUMNS = ['Group', 'sec', 'min', 'Reverse', 'Average', 'Data Point']
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_strip_groups_match_loop(seed):
+    df = _make_frame(seed)
+    expected = _ref_strip_groups(df)
+    app.compute_strip_groups(df, OP, TIME, STEP, MACHINE)
+    for col in STRIP_COLUMNS:
+        assert _normalise(df[col]) == _normalise(expected[col]), col
+
+
+def test_strip_groups_without_pro_rows_leave_frame_untouched():
+    df = _make_frame(0)
+    df[OP] = 'CUC'
+    before = df.copy()
+    app.compute_strip_groups(df, OP, TIME, STEP, MACHINE)
+    pd.testing.assert_frame_equal(df, before)
+
+
+def test_strip_group_average_and_errors():
+    df = pd.DataFrame({
+        DATE: ['2025-01-01'] * 6,
+        TIME: ['08:00:00', '08:00:10', '08:00:30', '08:00:40', '08:01:00', '08:01:05'],
+        OP: ['PRO', 'PRO', 'ERRSET', 'PRO', 'PRO', 'PRO'],
+        MACHINE: ['A'] * 6,
+        STEP: [4.0, 3.0, np.nan, 2.0, 5.0, 1.0],
+    })
+    for col in ['sec', 'min', 'Reverse', 'Group']:
+        df[col] = None
+    df['Average'] = ''
+    df['Data Point'] = ''
+    df['DateOnly'] = pd.to_datetime(df[DATE]).dt.date
+
+    app.compute_strip_groups(df, OP, TIME, STEP, MACHINE)
+
+    assert _normalise(df['sec']) == [None, 10.0, None, 'Machine Error', 'Out of Order', 5.0]
+    assert df.at[1, 'Reverse'] == '08:00:10 - 08:00:00 = 00:00:10'
+    assert df.at[5, 'Average'] == 'Average-Group = 7.5 sec/strip'
+    assert df.at[5, 'Data Point'] == '2'
+    assert set(df.loc[df[OP] == 'PRO', 'Group']) == {'Group 1 (2025-01-01)'}
+
+
+# === ตัด outlier ต่อ (station, SPEED) (user-010) ===
+def _ref_zscore_keep(codes, values):
+    frame = pd.DataFrame({'code': codes, 'sec': values})
+    z = frame.groupby('code')['sec'].transform(lambda x: app.zscore(x, nan_policy='omit'))
+    return (z.abs() <= 3).to_numpy()
+
+
+@pytest.mark.filterwarnings('ignore:Precision loss:RuntimeWarning')
+@pytest.mark.parametrize('seed', range(10))
+def test_station_zscore_matches_scipy(seed):
+    rng = np.random.default_rng(seed)
+    parts, codes = [], []
+    for g in range(30):
+        n = int(rng.integers(1, 60))
+        kind = g % 5
+        if kind == 0:
+            part = np.full(n, 12.0)  # std = 0 → zscore เป็น NaN → ตัดทิ้งทั้งกลุ่ม
+        elif kind == 1:
+            part = np.r_[np.full(max(n - 1, 1), 30.0), 31.0]  # std เล็กมาก
+        elif kind == 2:
+            part = np.r_[rng.normal(20, 2, n), 500.0]
+        else:
+            part = np.round(rng.exponential(15, n), 1)
+        parts.append(part)
+        codes.append(np.full(len(part), g))
+    values = np.concatenate(parts)
+    codes = np.concatenate(codes)
+    order = rng.permutation(len(values))
+    values, codes = values[order], codes[order]
+
+    np.testing.assert_array_equal(app.station_zscore_keep(codes, values), _ref_zscore_keep(codes, values))
+
+
+@pytest.mark.filterwarnings('ignore:Precision loss:RuntimeWarning')
+def test_station_zscore_at_the_limit():
+    # 10 ค่าเท่ากัน + 1 ค่าห่าง → |z| ของค่าห่าง = sqrt(10) ≈ 3.16 (ตัด) / 9 ค่า → z = 3 พอดี (เก็บ)
+    for n in (9, 10):
+        values = np.r_[np.zeros(n), 1.0]
+        codes = np.zeros(len(values), dtype=int)
+        np.testing.assert_array_equal(app.station_zscore_keep(codes, values), _ref_zscore_keep(codes, values))
+
+
+def test_station_zscore_empty():
+    assert app.station_zscore_keep(np.array([], dtype=int), np.array([], dtype=float)).shape == (0,)
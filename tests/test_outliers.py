@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+# === ตัวเทียบ: โค้ดวนทีละกลุ่มแบบเดิม (ก่อนเปลี่ยนเป็น remove_outliers_grouped) ===
+def _ref_zscore(df):
+    mean = df['uph'].mean()
+    std = df['uph'].std()
+    if std == 0:
+        return df
+    z = (df['uph'] - mean) / std
+    return df[(z >= -3) & (z <= 3)].copy()
+
+
+def _ref_bounds(df):
+    q1 = df['uph'].quantile(0.25)
+    q3 = df['uph'].quantile(0.75)
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+
+def _ref_has_outlier(df):
+    lower, upper = _ref_bounds(df)
+    return ((df['uph'] < lower) | (df['uph'] > upper)).sum() > 0
+
+
+def _ref_iqr(df):
+    lower, upper = _ref_bounds(df)
+    return df[(df['uph'] >= lower) & (df['uph'] <= upper)].copy()
+
+
+def _ref_auto(df_model, max_iter=20):
+    df_model = df_model.copy()
+    df_model['uph'] = pd.to_numeric(df_model['uph'], errors='coerce')
+    df_model = df_model.dropna(subset=['uph'])
+    if len(df_model) < 15:
+        df_model['Outlier_Method'] = 'ไม่ตัด (ข้อมูลน้อย)'
+        return df_model
+
+    current = df_model.copy()
+    for i in range(max_iter):
+        z_df = _ref_zscore(current)
+        if not _ref_has_outlier(z_df):
+            z_df['Outlier_Method'] = f'Z-Score Loop ×{i+1}'
+            return z_df
+        iqr_df = _ref_iqr(z_df)
+        if not _ref_has_outlier(iqr_df):
+            iqr_df['Outlier_Method'] = f'IQR Loop ×{i+1}'
+            return iqr_df
+        current = iqr_df
+    current['Outlier_Method'] = f'IQR-Z-Score Loop ×{max_iter}+'
+    return current
+
+
+def _ref_remove_outliers(df, max_iter=20):
+    return pd.concat([_ref_auto(df[df['machine model'] == m], max_iter) for m in df['machine model'].unique()])
+
+
+def _make_data(seed):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for g in range(12):
+        n = int(rng.choice([3, 14, 15, 16, 40, 200]))
+        kind = g % 4
+        if kind == 0:
+            values = rng.normal(1000, 50, n)
+        elif kind == 1:
+            values = np.r_[rng.normal(800, 20, n), rng.uniform(2000, 5000, max(1, n // 10))]
+        elif kind == 2:
+            values = np.full(n, 750.0)  # std = 0
+        else:
+            values = np.round(rng.lognormal(6, 0.6, n))
+        frames.append(pd.DataFrame({'machine model': f'M{g}', 'uph': values}))
+    df = pd.concat(frames, ignore_index=True)
+    df = df.sample(frac=1, random_state=seed).reset_index(drop=True)  # สลับลำดับ — กลุ่มปนกัน
+    df.loc[df.sample(frac=0.03, random_state=seed + 1).index, 'uph'] = np.nan
+    df.loc[df.sample(frac=0.02, random_state=seed + 2).index, 'machine model'] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_grouped_engine_matches_per_group_loop(seed):
+    df = _make_data(seed)
+    expected = _ref_remove_outliers(df)
+    result = app.remove_outliers(df)
+
+    assert result.index.tolist() == expected.index.tolist()
+    assert result['Outlier_Method'].tolist() == expected['Outlier_Method'].tolist()
+    np.testing.assert_array_equal(result['uph'].to_numpy(), expected['uph'].to_numpy())
+
+
+def test_iteration_cap_label():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'machine model': 'M', 'uph': np.round(rng.lognormal(6, 1.2, 300))})
+    expected = _ref_remove_outliers(df, max_iter=1)
+    result = app.remove_outliers_grouped(df, ['machine model'], max_iter=1)
+    assert result.index.tolist() == expected.index.tolist()
+    assert set(result['Outlier_Method']) == set(expected['Outlier_Method'])
+
+
+def test_small_group_is_kept_whole():
+    df = pd.DataFrame({'Machine_Model': ['A'] * 5, 'UPH': [1, 2, 3, 4, 1000]})
+    result = app.remove_outliers(df)
+    assert len(result) == 5
+    assert set(result['Outlier_Method']) == {app.OUTLIER_LABEL_SMALL}
+
+
+def test_quantiles_match_numpy():
+    rng = np.random.default_rng(3)
+    codes = rng.integers(0, 5, 200)
+    values = rng.normal(size=200)
+    q1, q3 = app._grouped_quantiles(codes, values, 6, (0.25, 0.75))
+    for g in range(5):
+        np.testing.assert_allclose([q1[g], q3[g]], np.percentile(values[codes == g], [25, 75]))
+    assert np.isnan(q1[5]) and np.isnan(q3[5])  # กลุ่มว่าง
@@ -0,0 +1,49 @@
+import os
+
+import pandas as pd
+
+import app
+
+
+def _write_nobump(name, rows):
+    os.makedirs(app.NOBUMP_FOLDER, exist_ok=True)
+    pd.DataFrame(rows, columns=['BOM_NO', 'NO_BUMP', 'NUMBER_REQUIRED']).to_excel(
+        os.path.join(app.NOBUMP_FOLDER, name), index=False)
+
+
+def test_nobump_lookup_compares_bom_exactly(workdir):
+    _write_nobump('wire data.xlsx', [
+        ['TIU1777P', 4, 2],
+        [' tiu1777p', 8, 1],
+        ['ABC.0', 6, None],
+        ['ABC.0', None, 3],
+    ])
+
+    assert app.lookup_nobump('TIU1777P') == (4, 2)
+    assert app.lookup_nobump(' tiu1777p') == (8, 1)
+    assert app.lookup_nobump('tiu1777p') == (None, None)
+    assert app.lookup_nobump('ABC') == (None, None)
+    # ค่าแรกที่ไม่ว่างของแต่ละคอลัมน์
+    assert app.lookup_nobump('ABC.0') == (6, 3)
+
+
+def test_nobump_lookup_numeric_bom(workdir):
+    _write_nobump('wire data.xlsx', [[1234, 4, 2]])
+    assert app.lookup_nobump(1234) == (4, 2)
+    assert app.lookup_nobump(1234.0) == (4, 2)
+    assert app.lookup_nobump('1234') == (None, None)
+
+
+def test_reference_tables_reload_when_a_file_changes(workdir):
+    _write_nobump('wire data.xlsx', [['B1', 4, 2]])
+    first = app.get_reference_data()
+    assert app.get_reference_data() is first
+
+    _write_nobump('wire data.xlsx', [['B1', 10, 2], ['B2', 2, 2]])
+    second = app.get_reference_data()
+    assert second is not first
+    assert second['version'] != first['version']
+    assert app.lookup_nobump('B1', second) == (10, 2)
+
+    os.remove(os.path.join(app.NOBUMP_FOLDER, 'wire data.xlsx'))
+    assert app.lookup_nobump('B1') == (None, None)
@@ -0,0 +1,24 @@
+import os
+import runpy
+
+import app
+
+
+def test_requests_do_not_start_services(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, 'start_services', lambda: calls.append(os.getpid()))
+    assert client.get('/url').status_code == 200
+    assert calls == []
+
+
+def test_gunicorn_config_starts_services_after_fork(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, 'start_services', lambda: calls.append(os.getpid()))
+    monkeypatch.setenv('APP_MODE', 'production')  # ไฟล์ config ตั้ง APP_MODE — คืนค่าเดิมหลัง test
+    config = runpy.run_path(os.path.join(os.path.dirname(app.__file__), 'gunicorn.conf.py'))
+
+    assert config['workers'] == app.WEB_WORKERS
+    assert config['threads'] == app.WEB_THREADS
+    assert config['worker_class'] == 'gthread'
+    config['post_fork'](None, None)
+    assert calls == [os.getpid()]
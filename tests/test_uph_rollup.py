@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def _reference(data_folder):
+    """ค่าเฉลี่ยแบบเดิม: อ่านทุกไฟล์ ต่อกันแล้ว groupby mean"""
+    frames = []
+    for fname in os.listdir(data_folder):
+        if not fname.endswith(('.xlsx', '.csv')) or fname.startswith('~$'):
+            continue
+        fpath = os.path.join(data_folder, fname)
+        df = pd.read_excel(fpath) if fname.endswith('.xlsx') else pd.read_csv(fpath)
+        df.columns = df.columns.str.strip()
+        if 'Package code' in df.columns and 'UPH' in df.columns:
+            df = df[df['Package code'].notna()]
+            df = df[df['Package code'] != '#N/A']
+            df['UPH'] = pd.to_numeric(df['UPH'], errors='coerce')
+            frames.append(df[df['UPH'].notna()][['Package code', 'UPH']])
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.groupby('Package code')['UPH'].mean()
+
+
+def _assert_matches_reference(result):
+    expected = _reference(app.DATA_FOLDER)
+    assert list(result.columns) == ['Package code', 'UPH']
+    assert result['UPH'].is_monotonic_decreasing
+    got = result.set_index('Package code')['UPH']
+    assert sorted(got.index) == sorted(expected.index)
+    np.testing.assert_allclose(got[expected.index].to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+def _write(name, df):
+    path = os.path.join(app.DATA_FOLDER, name)
+    if name.endswith('.xlsx'):
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def _package_frame(seed, rows=120):
+    rng = np.random.default_rng(seed)
+    codes = rng.choice(['QFN-32', 'SOIC-8', 'BGA-256', 'TSSOP-20', '#N/A', None], rows)
+    uph = np.round(rng.normal(1200, 300, rows), 2).astype(object)
+    uph[rng.random(rows) < 0.05] = 'n/a'
+    return pd.DataFrame({' Package code ': codes, 'UPH': uph, 'Machine': 'WB-01'})
+
+
+@pytest.fixture
+def data_files(workdir):
+    _write('a.csv', _package_frame(1))
+    _write('b.xlsx', _package_frame(2))
+    _write('c.csv', pd.DataFrame({'bom_no': ['X'], 'UPH': [10]}))  # ไม่มีคอลัมน์ Package code
+    return workdir
+
+
+@pytest.fixture
+def partial_calls(monkeypatch):
+    calls = []
+    original = app.package_uph_partials
+
+    def spy(path):
+        calls.append(os.path.basename(path))
+        return original(path)
+
+    monkeypatch.setattr(app, 'package_uph_partials', spy)
+    return calls
+
+
+def test_rollup_matches_concat_mean(data_files):
+    _assert_matches_reference(app.process_all_files_in_data())
+
+
+def test_only_changed_files_are_reread(data_files, partial_calls):
+    app.process_all_files_in_data()
+    assert sorted(partial_calls) == ['a.csv', 'b.xlsx', 'c.csv']
+
+    partial_calls.clear()
+    app.process_all_files_in_data()
+    assert partial_calls == []
+
+    _write('a.csv', _package_frame(3, rows=80))
+    _assert_matches_reference(app.process_all_files_in_data())
+    assert partial_calls == ['a.csv']
+
+    partial_calls.clear()
+    _write('d.xlsx', _package_frame(4))
+    _assert_matches_reference(app.process_all_files_in_data())
+    assert partial_calls == ['d.xlsx']
+
+
+def test_deleted_file_leaves_the_rollup(data_files, partial_calls):
+    app.process_all_files_in_data()
+    os.remove(os.path.join(app.DATA_FOLDER, 'b.xlsx'))
+    partial_calls.clear()
+
+    _assert_matches_reference(app.process_all_files_in_data())
+    assert partial_calls == []
+    assert 'b.xlsx' not in app.get_uph_partials()
+
+
+def test_rollup_survives_restart(data_files, partial_calls, monkeypatch):
+    before = app.process_all_files_in_data()
+    partial_calls.clear()
+
+    monkeypatch.setattr(app, '_uph_rollup', None)  # process ใหม่ — โหลดจาก cache/uph_rollup.json
+    after = app.process_all_files_in_data()
+
+    assert partial_calls == []
+    pd.testing.assert_frame_equal(after.reset_index(drop=True), before.reset_index(drop=True))
+
+
+def test_empty_data_folder(workdir):
+    result = app.process_all_files_in_data()
+    assert result.empty
+    assert list(result.columns) == ['Package code', 'UPH']